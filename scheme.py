@@ -1,11 +1,27 @@
+import argparse
+import asyncio
+import atexit
+import concurrent.futures
+import contextlib
+import copyreg
+import multiprocessing
+import pickle
 import re
 import sys
+import threading
+import time
 import traceback
-from io import StringIO
+import weakref
+from collections import OrderedDict, deque
+from io import BytesIO, StringIO
 from ucb import main, trace
 from scheme_tokens import *
 from scheme_utils import *
 from scheme_primitives import *
+from scheme_primitives import _CompactStore
+import scheme_primitives
+from scheme_vectors import VECTOR_PRIMITIVES
+from scheme_fasl import FASL_PRIMITIVES
 
 from random import choice
 from types import GeneratorType
@@ -35,24 +51,75 @@ class PrimitiveFunction(SchemeValue):
     def __repr__(self):
         return "PrimitiveFunction({0})".format(repr(self.func))
 
+class InlinePrimitive(SchemeValue):
+    """The operator of a call that the optimizer has specialized to invoke
+    the Python function FAST on the values of exactly ARITY operands, in
+    place of the general call of the predefined function named SYM."""
+
+    def __init__(self, sym, fast, arity):
+        self.sym = sym
+        self.fast = fast
+        self.arity = arity
+
+    def type_name(self):
+        return "inline primitive"
+
+    def step(self, expr, evaluation):
+        """Evaluate the call EXPR, whose operator is SELF, as the remaining
+        computation of EVALUATION."""
+        operands = expr.cdr
+        x = evaluation.operand_value(operands.car)
+        if self.arity == 1:
+            evaluation.set_value(self.fast(x))
+        else:
+            evaluation.set_value(
+                self.fast(x, evaluation.operand_value(operands.cdr.car)))
+
+    def write(self, out):
+        self.sym.write(out)
+
+    def __repr__(self):
+        return "InlinePrimitive({0}, {1})".format(repr(self.sym), self.arity)
+
 class LambdaFunction(SchemeValue):
     """A function defined by lambda expression or the complex define form."""
 
-    def __init__(self, formals, body, env):
+    # The Closure analysis of SELF's lambda expression, or None if SELF was
+    # not made from one.
+    scope = None
+
+    def __init__(self, formals, body, env, closure = None):
         """A function whose formal parameter list is FORMALS (in Scheme format),
         whose body is the single Scheme expression BODY, and whose environment
         is the EnvironFrame ENV.  A lambda expression containing multiple expressions,
         such as (lambda (x) (set! y x) (+ x 1)) can be handled by
-        using (begin (set! y x) (+ x 1)) as the body."""
+        using (begin (set! y x) (+ x 1)) as the body.  If CLOSURE, the
+        Closure analysis of the lambda expression, is given, the function
+        keeps only the parts of ENV that BODY may use (see
+        closure_environment)."""
         self.formals = formals
         self.body = body
-        self.env = env
+        if closure is None:
+            self.env = env
+        else:
+            self.env = closure_environment(closure, env)
+            self.scope = closure
 
     def type_name(self):
         return "closure"
 
     def apply_step(self, args, evaluation):
-        evaluation.set_expr(self.body, self.env.make_call_frame(self.formals, args))
+        frame = evaluation.frame
+        if frame is not None and frame is evaluation.env \
+           and frame.scope is self.scope and frame.enclosing is self.env:
+            # A tail call from SELF's body to SELF, in a frame that nothing
+            # else can observe (see Closure.reusable): rebind it in place.
+            frame.bind(self.formals, args)
+        else:
+            frame = self.env.make_call_frame(self.formals, args, self.scope)
+            if self.scope is not None and self.scope.reusable:
+                evaluation.frame = frame
+        evaluation.set_expr(self.body, frame)
 
     def write(self, out):
         print("<(lambda ", file=out, end='')
@@ -65,6 +132,123 @@ class LambdaFunction(SchemeValue):
         return "LambdaFunction({0}, {1}, {2})" \
                .format(repr(self.formals), repr(self.body), repr(self.env))
 
+class NamedLoop(SchemeValue):
+    """The procedure named by a native named let LOOP (see NamedLet).  FRAME
+    binds the loop's name and variables, and belongs to the Evaluation
+    OWNER, which is evaluating the loop.  A call made by OWNER is a tail call
+    from the loop's body, and rebinds the variables in FRAME in place; any
+    other call gets a frame of its own."""
+
+    def __init__(self, loop, frame, owner):
+        self.loop = loop
+        self.frame = frame
+        self.owner = owner
+
+    def type_name(self):
+        return "closure"
+
+    def apply_step(self, args, evaluation):
+        frame = self.frame
+        if evaluation is not self.owner:
+            frame = EnvironFrame(frame.enclosing)
+            frame.define(self.loop.name, NamedLoop(self.loop, frame, evaluation))
+        evaluation.run_loop(self.loop, frame, args)
+
+    def __repr__(self):
+        return "NamedLoop({0})".format(repr(self.loop.name))
+
+class MemoizedFunction(SchemeValue):
+    """A function that caches the values returned by another function for
+    the most recently used argument lists."""
+
+    # Number of argument lists cached by default.
+    DEFAULT_SIZE = 10000
+
+    def __init__(self, func, max_size = DEFAULT_SIZE, key = "equal_key"):
+        """A function that applies FUNC to its arguments, remembering the
+        values for up to MAX_SIZE argument lists and discarding the least
+        recently used ones as needed.  Argument lists are compared using the
+        SchemeValue method named KEY ("eqv_key" or "equal_key")."""
+        self.func = func
+        self.max_size = max_size
+        self.key = key
+        self.cache = OrderedDict()
+        self.hits = self.misses = 0
+
+    def type_name(self):
+        return "memoized procedure"
+
+    def apply_step(self, args, evaluation):
+        key_name = self.key
+        key = tuple(getattr(arg, key_name)() for arg in args)
+        cache = self.cache
+        value = cache.get(key)
+        if value is not None:
+            self.hits += 1
+            cache.move_to_end(key)
+            evaluation.set_value(value)
+        else:
+            # The call is the rest of EVALUATION, whose value is entered in
+            # the cache when it is set, so that FUNC runs as a tail call.
+            self.misses += 1
+            evaluation.remember(self, key)
+            self.func.apply_step(args, evaluation)
+
+    def store(self, key, value):
+        """Enter VALUE in SELF's cache for the argument key KEY."""
+        cache = self.cache
+        cache[key] = value
+        if len(cache) > self.max_size:
+            cache.popitem(last = False)
+
+    def __repr__(self):
+        return "MemoizedFunction({0}, {1}, {2})" \
+               .format(repr(self.func), self.max_size, repr(self.key))
+
+class Promise(SchemeValue):
+    """A value to be computed when it is first needed, and then remembered.
+    Until then, THUNK is a Python function of no arguments that computes it.
+    If LAZY is true (as for delay-force), the value of THUNK is itself a
+    promise, whose value becomes the value of SELF."""
+
+    def __init__(self, thunk = None, value = None, lazy = False):
+        self.thunk = thunk
+        self.value = value
+        self.lazy = lazy
+
+    def type_name(self):
+        return "promise"
+
+    def force(self):
+        """The value of SELF, computing it if necessary.  A chain of lazy
+        promises is followed iteratively, and every promise on it receives
+        the value of the last."""
+        chain = []
+        promise = self
+        while promise.thunk is not None:
+            result = promise.thunk()
+            if promise.thunk is None:
+                # PROMISE was forced while its value was being computed.
+                break
+            if not promise.lazy:
+                promise.thunk, promise.value = None, result
+                break
+            chain.append(promise)
+            promise = check_type(result, _promisep, 0, "delay-force")
+        for p in chain:
+            p.thunk, p.value = None, promise.value
+        return promise.value
+
+    def write(self, out):
+        print("#[promise]", file=out, end="")
+
+    def __repr__(self):
+        return "Promise({0})".format("forced" if self.thunk is None
+                                     else "unforced")
+
+def _promisep(x):
+    return isinstance(x, Promise)
+
 ## LambdaFunction Utility Function ##
 def make_single_body(exprs):
     """Utility function to make a single Scheme expression for the
@@ -76,9 +260,23 @@ def make_single_body(exprs):
     else:
         return Pair(Evaluation._BEGIN_SYM, exprs)
 
+class Cell:
+    """The storage for a variable that is shared by the frame binding it and
+    the environments of closures that refer to it (see
+    closure_environment), so that assignments are seen by all of them."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
 class EnvironFrame:
     """An environment frame, representing a mapping from Scheme symbols to
-    Scheme values, possibly enclosed within another frame."""
+    Scheme values, possibly enclosed within another frame.  A value may be
+    held in a Cell, which is transparent to the methods below."""
+
+    # The Scope describing the code evaluated in SELF, or None if unknown.
+    scope = None
 
     def __init__(self, enclosing):
         """An empty frame that is attached to the frame ENCLOSING."""
@@ -86,10 +284,13 @@ class EnvironFrame:
         self.enclosing = enclosing
 
     def __getitem__(self, sym):
-        return self.find(sym).inner[sym]
+        value = self.find(sym).inner[sym]
+        if type(value) is Cell:
+            return value.value
+        return value
 
     def __setitem__(self, sym, val):
-        self.find(sym).inner[sym] = val
+        self.find(sym).define(sym, val)
 
     def __repr__(self):
         if self.enclosing is None:
@@ -108,7 +309,7 @@ class EnvironFrame:
             e = e.enclosing
         raise SchemeError("unknown identifier: {0}".format(str(sym)))
 
-    def make_call_frame(self, formals, vals):
+    def make_call_frame(self, formals, vals, scope = None):
         """A new local frame attached to SELF in which the symbols in
         the Scheme formal parameter list FORMALS are bound to the
         Scheme values in the Python list VALS.  FORMALS has either of the
@@ -120,33 +321,191 @@ class EnvironFrame:
         symbol, then the number of values in VALS  must be at least as large as
         the number of preceding ("normal") formal symbols, and the last
         formal symbol is bound to a Scheme list containing the remaining
-        values in VALS (which may be 0)."""
+        values in VALS (which may be 0).  SCOPE, if given, is the Scope of
+        the code to be evaluated in the new frame."""
 
         # FORMALS is a Scheme list (last one could be pair), VALS is a Python list
 
-        # Error checking
-        if scm_listp(formals) and len(vals) > formals.length():
-            raise SchemeError("too many arguments provided")
-
-        # Defining formals
         call_frame = EnvironFrame(self)
+        if scope is not None:
+            call_frame.scope = scope
+        call_frame.bind(formals, vals)
+        return call_frame
+
+    def bind(self, formals, vals):
+        """Bind the symbols in FORMALS to the values in VALS in SELF, as
+        described for make_call_frame."""
+        inner = self.inner
+        n = len(vals)
         i = 0
         while formals.pairp():
-            try:
-                call_frame.define(formals.car,vals[i])
-            except IndexError:
+            if i == n:
                 raise SchemeError("too few arguments provided")
+            inner[formals.car] = vals[i]
             formals = formals.cdr
             i += 1
         if formals.symbolp():
-            rest = make_list(*vals[i:])
-            call_frame.define(formals,rest)
-
-        return call_frame
+            # Build the rest list directly from VALS, without copying it.
+            rest = NULL
+            for k in range(n - 1, i - 1, -1):
+                rest = Pair(vals[k], rest)
+            inner[formals] = rest
+        elif i < n:
+            raise SchemeError("too many arguments provided")
 
     def define(self, sym, val):
         """Define Scheme symbol SYM to have value VAL in SELF."""
-        self.inner[sym] = val
+        inner = self.inner
+        cell = inner.get(sym)
+        if type(cell) is Cell:
+            cell.value = val
+        else:
+            inner[sym] = val
+
+class BudgetExceeded(SchemeError):
+    """The error raised when an evaluation exceeds a limit of the Budget
+    BUDGET, whose statistics show the resources used up to that point."""
+
+    def __init__(self, message, budget):
+        SchemeError.__init__(self, message)
+        self.budget = budget
+
+class Budget:
+    """Limits on the resources used by the evaluations carried out while
+    SELF is in effect (in a with statement): at most STEPS evaluation steps,
+    SECONDS of elapsed time, evaluations nested DEPTH deep, and CONSES pairs
+    allocated.  A limit of None is unlimited.  Exceeding a limit raises
+    BudgetExceeded.  A budget applies to the thread that enters it; if
+    budgets are nested, only the innermost is in effect.
+
+    SELF counts the resources used as it goes (see stats), checking the
+    step and pair limits exactly and the clock every CHECK_INTERVAL steps,
+    so that enforcing the limits costs only a few counter updates per
+    step."""
+
+    # Number of steps between readings of the clock.
+    CHECK_INTERVAL = 1024
+
+    # The number of budgets in effect in all threads, while which pairs are
+    # counted, and the lock held while changing it.
+    _active = 0
+    _lock = threading.Lock()
+
+    def __init__(self, steps = None, seconds = None, depth = None,
+                 conses = None):
+        self.max_steps = steps
+        self.seconds = seconds
+        self.max_depth = depth
+        self.max_conses = conses
+        self.steps = self.depth = self.deepest = self.conses = 0
+        self.start = self.deadline = self.elapsed = None
+        self.next_check = 0
+        self._outer = None
+
+    def stats(self):
+        """A dictionary of the resources used under SELF: the number of
+        "steps", the deepest nesting of evaluations ("depth"), the number of
+        pairs allocated ("conses"), and the elapsed "time" in seconds."""
+        if self.elapsed is not None:
+            elapsed = self.elapsed
+        elif self.start is not None:
+            elapsed = time.monotonic() - self.start
+        else:
+            elapsed = 0.0
+        return { "steps": self.steps, "depth": self.deepest,
+                 "conses": self.conses, "time": elapsed }
+
+    def __enter__(self):
+        self._outer = thread_state.budget
+        self.start = time.monotonic()
+        self.elapsed = None
+        if self.seconds is not None:
+            self.deadline = self.start + self.seconds
+        self.next_check = self.steps
+        thread_state.budget = self
+        with Budget._lock:
+            if Budget._active == 0:
+                Pair.__init__ = _counting_pair_init
+                _CompactStore.__init__ = _counting_store_init
+            Budget._active += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with Budget._lock:
+            Budget._active -= 1
+            if Budget._active == 0:
+                Pair.__init__, _CompactStore.__init__ = _PAIR_INITS
+        thread_state.budget = self._outer
+        self.elapsed = time.monotonic() - self.start
+
+    def allocate(self, n):
+        """Charge the allocation of N pairs to SELF."""
+        self.conses += n
+        if self.max_conses is not None and self.conses > self.max_conses:
+            raise BudgetExceeded("cons limit exceeded", self)
+
+    def descend(self):
+        """Charge the start of a nested evaluation to SELF, which must be
+        matched by decrementing SELF.depth when it ends."""
+        depth = self.depth + 1
+        if depth > self.deepest:
+            if self.max_depth is not None and depth > self.max_depth:
+                raise BudgetExceeded("depth limit exceeded", self)
+            self.deepest = depth
+        self.depth = depth
+
+    def remaining(self):
+        """The keyword arguments of a Budget that limits an evaluation to
+        the resources remaining under SELF."""
+        def rest(limit, used):
+            return None if limit is None else max(limit - used, 0)
+        seconds = None
+        if self.deadline is not None:
+            seconds = max(self.deadline - time.monotonic(), 0)
+        return { "steps": rest(self.max_steps, self.steps),
+                 "seconds": seconds,
+                 "depth": rest(self.max_depth, self.depth),
+                 "conses": rest(self.max_conses, self.conses) }
+
+    def absorb(self, stats):
+        """Charge to SELF the resources in STATS, the stats of a budget of
+        remaining() used elsewhere (as in another process)."""
+        self.steps += stats["steps"]
+        self.conses += stats["conses"]
+        self.deepest = max(self.deepest, self.depth + stats["depth"])
+
+    def charge(self):
+        """Charge one evaluation step to SELF."""
+        self.steps += 1
+        if self.steps >= self.next_check:
+            self.check()
+
+    def check(self):
+        """Raise BudgetExceeded if SELF's step or time limit has been
+        exceeded, and otherwise schedule the next check."""
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise BudgetExceeded("step limit exceeded", self)
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise BudgetExceeded("evaluation timed out", self)
+        self.next_check = self.steps + self.CHECK_INTERVAL
+        if self.max_steps is not None:
+            self.next_check = min(self.next_check, self.max_steps + 1)
+
+# The constructors of Pair and _CompactStore, which are replaced while any
+# budget is in effect by versions that charge the current thread's budget.
+_PAIR_INITS = (Pair.__init__, _CompactStore.__init__)
+
+def _counting_pair_init(pair, x, y):
+    _PAIR_INITS[0](pair, x, y)
+    budget = thread_state.budget
+    if budget is not None:
+        budget.allocate(1)
+
+def _counting_store_init(store, items):
+    _PAIR_INITS[1](store, items)
+    budget = thread_state.budget
+    if budget is not None:
+        budget.allocate(len(items))
 
 class Evaluation:
     """An Evaluation represents the information needed to evaluate an
@@ -155,6 +514,18 @@ class Evaluation:
     the expression, either leaving behind the final value, or else another
     intermediate expression and environment to be further evaluated."""
 
+    # The frame that SELF created to call a function whose frames may be
+    # reused (see LambdaFunction.apply_step), or None.
+    frame = None
+
+    # The (MemoizedFunction, key) pairs of the memoized calls whose value
+    # is the value of SELF, or None.
+    memo_calls = None
+
+    # In a task, the form handler carrying out SELF's current step, if it
+    # is waiting for a value (see Task.advance), or None.
+    handler = None
+
     def __init__(self, expr, env):
         """An evaluation of EXPR in the environment ENV."""
         self.expr = expr
@@ -166,6 +537,17 @@ class Evaluation:
         assert value is not None
         self.expr = None
         self.value = value
+        if self.memo_calls is not None:
+            for func, key in self.memo_calls:
+                func.store(key, value)
+            self.memo_calls = None
+
+    def remember(self, func, key):
+        """Record that the value of SELF is the value of the MemoizedFunction
+        FUNC for the argument key KEY."""
+        if self.memo_calls is None:
+            self.memo_calls = []
+        self.memo_calls.append((func, key))
 
     def set_expr(self, expr, env = None):
         """Replace SELF's expression with EXPR.  If ENV is non-null, replace
@@ -190,7 +572,9 @@ class Evaluation:
             self.set_value(value)
         elif expr.atomp():
             self.set_value(expr)
-        elif not scm_listp(expr):
+        elif type(expr.car) is InlinePrimitive:
+            expr.car.step(expr, self)
+        elif expr.analysis is None and not scm_listp(expr):
             raise SchemeError("malformed list: {0}".format(str(self.expr)))
         else:
             op = expr.car
@@ -204,10 +588,34 @@ class Evaluation:
         default."""
         return Evaluation(expr, env or self.env).step_to_value()
 
+    def operand_value(self, expr):
+        """The value of EXPR in SELF's environment, avoiding the creation of
+        a new Evaluation for symbols and literals."""
+        if type(expr) is Symbol:
+            return self.env[expr]
+        elif expr.atomp():
+            return expr
+        return Evaluation(expr, self.env).step_to_value()
+
     def step_to_value(self):
-        """Perform evaluation steps on SELF until a value is reached."""
-        while not self.evaluated():
-            self.step()
+        """Perform evaluation steps on SELF until a value is reached,
+        charging them to the budget in effect, if any."""
+        budget = thread_state.budget
+        if budget is None:
+            while not self.evaluated():
+                self.step()
+            return self.value
+        # The steps are charged here, rather than in a method of BUDGET,
+        # so that a budget adds no Python frames to nested evaluations.
+        budget.descend()
+        try:
+            while self.value is None:
+                budget.steps += 1
+                if budget.steps >= budget.next_check:
+                    budget.check()
+                self.step()
+        finally:
+            budget.depth -= 1
         return self.value
 
     # Special forms.  Each of these methods is called when
@@ -224,7 +632,8 @@ class Evaluation:
         self.check_form(3)
         formals = self.expr.nth(1)  # gets the arguments
         self.check_formals(formals)
-        fn = LambdaFunction(formals,make_single_body(self.expr.cdr.cdr),self.env)
+        fn = LambdaFunction(formals, make_single_body(self.expr.cdr.cdr),
+                            self.env, _closure_analysis(self.expr))
         self.set_expr(fn)
 
     # To handle tail-recursion for conditionals, make sure the final
@@ -319,6 +728,8 @@ class Evaluation:
         # Undefined symbol handled in find
         e = self.env.find(to_set)
         e.define(to_set, new_value)
+        if to_set in current_context().optimized_sites:
+            deoptimize(to_set)
         self.set_value(UNSPEC)
 
     def do_define_form(self):
@@ -330,6 +741,8 @@ class Evaluation:
             self.check_form(3,3)
             value = self.expr.nth(2)
             self.env.define(target,self.full_eval(value))
+            if target in current_context().optimized_sites:
+                deoptimize(target)
             self.set_value(UNSPEC)
 
         elif not target.pairp():
@@ -338,9 +751,52 @@ class Evaluation:
         # Defining functions
         else:
             self.check_formals(target.cdr)
-            self.env.define(target.car, self.full_eval(LambdaFunction(target.cdr,make_single_body(self.expr.cdr.cdr), self.env)))
+            if self.env.scope is not None and target.car not in self.env.inner:
+                # Let the function refer to itself through a Cell, rather
+                # than through this whole frame (see closure_environment).
+                self.env.inner[target.car] = Cell(None)
+            self.env.define(target.car, self.full_eval(LambdaFunction(
+                target.cdr, make_single_body(self.expr.cdr.cdr), self.env,
+                _closure_analysis(self.expr))))
+            if target.car in current_context().optimized_sites:
+                deoptimize(target.car)
             self.set_value(UNSPEC)
 
+    def do_define_memoized_form(self):
+        # (define-memoized TARGET [SIZE] [TEST] BODY ...), where SIZE is an
+        # integer literal and TEST is eqv? or equal?, as for memoize.  They
+        # are options only when followed by more of the form, since as part
+        # of the body they could have no effect.
+        self.check_form(3)
+        target = self.expr.nth(1)
+        rest = self.expr.cdr.cdr
+        size = test = None
+        if rest.car.numberp() and not rest.cdr.nullp():
+            size, rest = rest.car, rest.cdr
+        if (rest.car is self._EQV_SYM or rest.car is self._EQUAL_SYM) \
+           and not rest.cdr.nullp():
+            test, rest = self.env[rest.car], rest.cdr
+
+        if target.symbolp():
+            if not rest.cdr.nullp():
+                raise SchemeError("badly formed expression")
+            func = self.full_eval(rest.car)
+        elif not target.pairp():
+            raise SchemeError("bad argument to define-memoized")
+        else:
+            self.check_formals(target.cdr)
+            closure = self.expr.analysis
+            if closure is None:
+                closure = cache_analysis(self.expr,
+                                         Closure(target.cdr, _items(rest)))
+            func = LambdaFunction(target.cdr, make_single_body(rest),
+                                  self.env, closure)
+            target = target.car
+        self.env.define(target, scm_memoize(func, size, test))
+        if target in current_context().optimized_sites:
+            deoptimize(target)
+        self.set_value(UNSPEC)
+
     def do_begin_form(self):
         self.check_form(2)
         for k in range(1, self.expr.length()-1):
@@ -348,6 +804,9 @@ class Evaluation:
         self.set_expr(self.expr.nth(self.expr.length()-1))
 
     def do_let_form(self):
+        if self.expr.cdr.pairp() and self.expr.cdr.car.symbolp():
+            self.do_named_let_form()
+            return
         self.check_form(3)
         bindings = self.expr.cdr.car  # of form ((VAR1 INIT1)(VAR2 INIT2)...)
         exprs = self.expr.cdr.cdr  # of form (BODY1)(BODY2)...
@@ -373,7 +832,8 @@ class Evaluation:
             symbols = Pair(binding.car,symbols)
             vals.append(self.full_eval(binding.cdr.car))
             bindings = bindings.cdr
-        let_frame = self.env.make_call_frame(symbols, list(reversed(vals)))
+        let_frame = self.env.make_call_frame(symbols, list(reversed(vals)),
+                                             _let_analysis(self.expr))
 
         # Evaluating the body in new frame
         for _ in range(0, exprs.length()-1):
@@ -394,7 +854,7 @@ class Evaluation:
             raise SchemeError("badly formed bindings - incorrect number of subforms")
         
         # Create new EMPTY env frame
-        let_frame = self.env.make_call_frame(NULL,[])
+        let_frame = self.env.make_call_frame(NULL, [], _let_analysis(self.expr))
         while bindings.pairp():
             binding = bindings.car
 
@@ -413,62 +873,150 @@ class Evaluation:
             exprs = exprs.cdr
         self.set_expr(exprs.car, let_frame)
 
-    def do_case_form(self):
-        self.check_form(2)
-        k = self.full_eval(self.expr.nth(1))
-        clauses = self.expr.cdr.cdr
-
-        while clauses.pairp():
-            clause = clauses.car
-            data = clause.car
-            # if empty expr_seq but still matches, then defaults to TRUE
-            expr_seq = clause.cdr
+    def do_named_let_form(self):
+        loop = _loop_analysis(self.expr)
+        vals = [self.full_eval(init) for init in loop.inits]
+        if loop.native:
+            frame = EnvironFrame(self.env)
+            frame.define(loop.name, NamedLoop(loop, frame, self))
+            self.run_loop(loop, frame, vals)
+        else:
+            self.call_named_let(loop, vals)
+
+    def call_named_let(self, loop, vals):
+        """Leave as SELF's remaining computation the call of the procedure
+        of the named let LOOP on the values VALS of its inits."""
+        frame = EnvironFrame(self.env)
+        # The procedure refers to itself through the Cell binding NAME.
+        frame.scope = loop.scope
+        frame.inner[loop.name] = Cell(None)
+        proc = LambdaFunction(loop.formals, loop.body, frame, loop.closure)
+        frame.define(loop.name, proc)
+        proc.apply_step(vals, self)
+
+    def run_loop(self, loop, frame, vals):
+        """Run the native named let LOOP in FRAME, starting with its
+        variables bound to the values VALS, until its PLAN reaches an
+        expression other than a call of the loop, which is left as SELF's
+        remaining computation."""
+        variables = loop.variables
+        inner = frame.inner
+        self.env = frame
+        while True:
+            if len(vals) != len(variables):
+                raise SchemeError("too {0} arguments provided".format(
+                    "few" if len(vals) < len(variables) else "many"))
+            for k in range(len(vals)):
+                inner[variables[k]] = vals[k]
+            budget = thread_state.budget
+            if budget is not None:
+                budget.charge()
+            node = loop.plan
+            while True:
+                kind = node[0]
+                if kind == _PLAN_IF:
+                    node = node[2] if self.full_eval(node[1]) else node[3]
+                elif kind == _PLAN_LOOP:
+                    vals = [self.operand_value(arg) for arg in node[1]]
+                    break
+                elif kind == _PLAN_BEGIN:
+                    for expr in node[1]:
+                        self.full_eval(expr)
+                    node = node[2]
+                elif kind == _PLAN_COND:
+                    for test, body in node[1]:
+                        value = TRUE if test is None else self.full_eval(test)
+                        if value:
+                            if body is None:
+                                self.set_value(value)
+                                return
+                            node = body
+                            break
+                    else:
+                        node = (_PLAN_EXPR, UNSPEC)
+                else:
+                    self.set_expr(node[1])
+                    return
 
-            # if an else clause
-            if data is self._ELSE_SYM:
-                try:
-                    self.check_form(2, expr = clause)
-                except SchemeError:
-                    raise SchemeError("badly formed else clause")
-                if not clauses.cdr.nullp():
-                    raise SchemeError("else clause must be the last clause in cond")
-                self.evaluate_expr_seq_and_set_expr_as_last(expr_seq, TRUE)
-                return
+    def do_do_form(self):
+        loop = _loop_analysis(self.expr)
+        variables = loop.variables
+        frame = EnvironFrame(self.env)
+        if not loop.native:
+            frame.scope = loop.scope
+        vals = [self.full_eval(init) for init in loop.inits]
+        while True:
+            inner = frame.inner
+            for k in range(len(vals)):
+                inner[variables[k]] = vals[k]
+            if self.full_eval(loop.test, frame):
+                break
+            for command in loop.commands:
+                self.full_eval(command, frame)
+            vals = [self.full_eval(step, frame) for step in loop.steps]
+            if not loop.native:
+                # Each iteration has its own bindings, which closures
+                # created by the previous iteration may refer to.
+                frame = EnvironFrame(self.env)
+                frame.scope = loop.scope
+        self.env = frame
+        self.evaluate_expr_seq_and_set_expr_as_last(loop.results)
+
+    def delayed(self, expr, lazy = False):
+        """A Promise to evaluate EXPR in SELF's environment."""
+        env = self.env
+        return Promise(lambda: Evaluation(expr, env).step_to_value(),
+                       lazy = lazy)
+
+    def do_delay_form(self):
+        self.check_form(2, 2)
+        self.set_value(self.delayed(self.expr.cdr.car))
 
-            # if one piece of data
-            elif data.atomp():
-                if k.eqvp(data):
-                    self.evaluate_expr_seq_and_set_expr_as_last(expr_seq, TRUE)
-                    return
+    def do_delay_force_form(self):
+        self.check_form(2, 2)
+        self.set_value(self.delayed(self.expr.cdr.car, True))
 
-            # otherwise check each datum
-            while data.pairp():
-                datum = data.car
-                if k.eqvp(datum):
-                    self.evaluate_expr_seq_and_set_expr_as_last(expr_seq, TRUE)
-                    return
-                data = data.cdr
-                
-            clauses = clauses.cdr
+    def do_cons_stream_form(self):
+        self.check_form(3, 3)
+        first = self.full_eval(self.expr.cdr.car)
+        self.set_value(Pair(first, self.delayed(self.expr.cdr.cdr.car)))
 
-        self.set_value(UNSPEC)
+    def do_case_form(self):
+        table = self.expr.analysis
+        if table is None:
+            self.check_form(2)
+            table = cache_analysis(self.expr, CaseTable(self.expr.cdr.cdr))
+        k = self.full_eval(self.expr.cdr.car)
+        expr_seq = table.lookup(k)
+        if expr_seq is None:
+            self.set_value(UNSPEC)
+        else:
+            # if empty expr_seq but still matches, then defaults to TRUE
+            self.evaluate_expr_seq_and_set_expr_as_last(expr_seq, TRUE)
 
     # Symbols that are used in special forms.
 
-    _AND_SYM = Symbol.string_to_symbol("and")
-    _ARROW_SYM = Symbol.string_to_symbol("=>")
-    _BEGIN_SYM = Symbol.string_to_symbol("begin")
-    _CASE_SYM = Symbol.string_to_symbol("case")
-    _COND_SYM = Symbol.string_to_symbol("cond")
-    _DEFINE_SYM = Symbol.string_to_symbol("define")
-    _ELSE_SYM = Symbol.string_to_symbol("else")
-    _IF_SYM = Symbol.string_to_symbol("if")
-    _LAMBDA_SYM = Symbol.string_to_symbol("lambda")
-    _LET_SYM = Symbol.string_to_symbol("let")
-    _LET_STAR_SYM = Symbol.string_to_symbol("let*")
-    _OR_SYM = Symbol.string_to_symbol("or")
-    _QUOTE_SYM = Symbol.string_to_symbol("quote")
-    _SET_BANG_SYM = Symbol.string_to_symbol("set!")
+    _AND_SYM = Symbol.pin("and")
+    _ARROW_SYM = Symbol.pin("=>")
+    _BEGIN_SYM = Symbol.pin("begin")
+    _CASE_SYM = Symbol.pin("case")
+    _COND_SYM = Symbol.pin("cond")
+    _CONS_STREAM_SYM = Symbol.pin("cons-stream")
+    _DEFINE_SYM = Symbol.pin("define")
+    _DEFINE_MEMOIZED_SYM = Symbol.pin("define-memoized")
+    _DELAY_SYM = Symbol.pin("delay")
+    _DELAY_FORCE_SYM = Symbol.pin("delay-force")
+    _DO_SYM = Symbol.pin("do")
+    _ELSE_SYM = Symbol.pin("else")
+    _EQUAL_SYM = Symbol.pin("equal?")
+    _EQV_SYM = Symbol.pin("eqv?")
+    _IF_SYM = Symbol.pin("if")
+    _LAMBDA_SYM = Symbol.pin("lambda")
+    _LET_SYM = Symbol.pin("let")
+    _LET_STAR_SYM = Symbol.pin("let*")
+    _OR_SYM = Symbol.pin("or")
+    _QUOTE_SYM = Symbol.pin("quote")
+    _SET_BANG_SYM = Symbol.pin("set!")
 
     # Mapping of symbols that introduce special forms to the methods that
     # handle the forms.
@@ -477,7 +1025,12 @@ class Evaluation:
         _BEGIN_SYM :   do_begin_form,
         _CASE_SYM :    do_case_form,
         _COND_SYM :    do_cond_form,
+        _CONS_STREAM_SYM: do_cons_stream_form,
         _DEFINE_SYM :  do_define_form,
+        _DEFINE_MEMOIZED_SYM: do_define_memoized_form,
+        _DELAY_SYM :   do_delay_form,
+        _DELAY_FORCE_SYM: do_delay_force_form,
+        _DO_SYM :      do_do_form,
         _IF_SYM :      do_if_form,
         _LAMBDA_SYM :  do_lambda_form,
         _LET_SYM :     do_let_form,
@@ -490,13 +1043,13 @@ class Evaluation:
     # Function calls
 
     def do_call_form(self):
-        self.check_form(1)
-        op = self.full_eval(self.expr.car)
+        # SELF.expr was checked to be a (non-empty) list by step.
+        op = self.operand_value(self.expr.car)
         args = []
         rest = self.expr.cdr
         # Slightly optimized to not traverse the expression multiple times
         while not rest.nullp():
-            args.append(self.full_eval(rest.car))
+            args.append(self.operand_value(rest.car))
             rest = rest.cdr
         op.apply_step(args, self)
 
@@ -508,9 +1061,9 @@ class Evaluation:
         at least MIN and no more than MAX (default: no maximum). Raises
         a SchemeError if this is not the case."""
         if expr is None:
+            # SELF.expr was checked to be a list by step.
             expr = self.expr
-        # Checks that the expr is a list
-        if not scm_listp(expr):
+        elif not scm_listp(expr):
             raise SchemeError("badly formed expression")
         L = expr.length()
         if L < min:
@@ -556,6 +1109,983 @@ class Evaluation:
         # Returns the last of the options
         self.set_expr(expr_seq.car)
 
+##
+## Optimization
+##
+
+# Names of predefined functions that have no side effects and, given the
+# same arguments, always return the same value (rather than newly allocated
+# pairs), so that calls to them on constant arguments may be replaced by
+# their values.
+_PURE_NAMES = (
+    "eqv?", "eq?", "equal?", "atom?", "pair?", "null?", "list?",
+    "car", "cdr", "length",
+    "integer?", "+", "-", "*", "/", "quotient", "modulo", "remainder",
+    "floor", "ceil", "ceiling", "exact->inexact", "expt", "sqrt",
+    "<", ">", "=", "<=", ">=",
+    "boolean?", "not", "symbol?", "error",
+    "word", "first", "bf", "butfirst", "last",
+    "caar", "cadr", "cdar", "cddr", "caaar", "caadr", "cadar", "caddr",
+    "cdaar", "cdadr", "cddar", "cdddr", "list-tail", "list-ref",
+    "assq", "assv", "assoc", "memq", "memv", "member",
+    "zero?", "positive?", "negative?", "max", "min", "abs",
+)
+
+def _fast_arith(op, general):
+    """A specialized version of the arithmetic function GENERAL for two
+    operands, which applies OP directly to the values of two Numbers."""
+    def fast(x, y):
+        if type(x) is Number and type(y) is Number:
+            return Number(op(x.num_val, y.num_val))
+        return general(x, y)
+    return fast
+
+def _fast_comparison(op, general):
+    """A specialized version of the comparison GENERAL for two operands,
+    which applies OP directly to the values of two Numbers."""
+    def fast(x, y):
+        if type(x) is Number and type(y) is Number:
+            return TRUE if op(x.num_val, y.num_val) else FALSE
+        return general(x, y)
+    return fast
+
+# Specialized versions of predefined functions (name, function, arity, fast),
+# where FAST is called by the optimizer with the values of ARITY operands in
+# place of the general calling mechanism.  Each falls back to the general
+# function when its operands are not of the expected types, so that errors
+# are reported the same way.
+_INLINE_PRIMITIVES = (
+    ("car", scm_car, 1, lambda x: x.car if type(x) is Pair else scm_car(x)),
+    ("cdr", scm_cdr, 1, lambda x: x.cdr if type(x) is Pair else scm_cdr(x)),
+    ("cons", scm_cons, 2, Pair),
+    ("null?", scm_nullp, 1, lambda x: x.nullp()),
+    ("pair?", scm_pairp, 1, lambda x: x.pairp()),
+    ("not", scm_not, 1, lambda x: FALSE if x else TRUE),
+    ("eq?", scm_eqp, 2, lambda x, y: TRUE if x is y else FALSE),
+    ("eqv?", scm_eqvp, 2, lambda x, y: x.eqvp(y)),
+    ("+", scm_add, 2, _fast_arith(add, scm_add)),
+    ("-", scm_sub, 1,
+     lambda x: Number(-x.num_val) if type(x) is Number else scm_sub(x)),
+    ("-", scm_sub, 2, _fast_arith(sub, scm_sub)),
+    ("*", scm_mul, 2, _fast_arith(mul, scm_mul)),
+    ("=", scm_eq, 2, _fast_comparison(eq, scm_eq)),
+    ("<", scm_lt, 2, _fast_comparison(lt, scm_lt)),
+    (">", scm_gt, 2, _fast_comparison(gt, scm_gt)),
+    ("<=", scm_le, 2, _fast_comparison(le, scm_le)),
+    (">=", scm_ge, 2, _fast_comparison(ge, scm_ge)),
+)
+
+# Maps each Pair in the optimized_sites tables of all interpreters to the
+# Pair it replaced.
+_site_originals = weakref.WeakKeyDictionary()
+
+def _find_pure_functions(interp):
+    """Fill in the pure_functions, inline_primitives, and initial_globals
+    tables of the Interpreter INTERP from its global environment."""
+    env = interp.env
+    pure_functions = interp.pure_functions = {}
+    inline_primitives = interp.inline_primitives = {}
+    initial_globals = interp.initial_globals = {}
+    names = set(map(Symbol.string_to_symbol, _PURE_NAMES))
+    refs = {}
+    for sym in names:
+        value = env.inner.get(sym)
+        if isinstance(value, PrimitiveFunction):
+            refs[sym] = set()
+        elif isinstance(value, LambdaFunction):
+            refs[sym] = _free_symbols(value.body, _formal_symbols(value.formals))
+    for sym in refs:
+        # The transitive closure of the functions that SYM refers to.
+        deps, work = set(), [sym]
+        while work:
+            s = work.pop()
+            if s not in deps:
+                deps.add(s)
+                work.extend(refs.get(s, ()))
+        if deps <= set(refs):
+            pure_functions[sym] = frozenset(deps)
+            initial_globals[sym] = env.inner[sym]
+    for name, func, arity, fast in _INLINE_PRIMITIVES:
+        sym = Symbol.string_to_symbol(name)
+        value = env.inner.get(sym)
+        if isinstance(value, PrimitiveFunction) and value.func is func:
+            inline_primitives.setdefault(sym, {})[arity] = \
+                InlinePrimitive(sym, fast, arity)
+            initial_globals[sym] = value
+
+def _formal_symbols(formals):
+    """The set of symbols in the formal parameter list FORMALS."""
+    result = set()
+    while formals.pairp():
+        result.add(formals.car)
+        formals = formals.cdr
+    if formals.symbolp():
+        result.add(formals)
+    return result
+
+def _free_symbols(expr, bound):
+    """The symbols other than those in BOUND (and those that introduce
+    special forms) that appear in EXPR outside quoted data, other than those
+    defined in EXPR or used as formal parameters in it."""
+    bound = set(bound) | _assigned_symbols(expr)
+    result = set()
+    work = [expr]
+    while work:
+        expr = work.pop()
+        if expr.symbolp():
+            result.add(expr)
+        elif expr.pairp() and expr.car is not Evaluation._QUOTE_SYM:
+            if expr.car in _BINDING_FORMS and expr.cdr.pairp():
+                formals = expr.cdr.car
+                bound |= _formal_symbols(formals.cdr if formals.pairp()
+                                         and expr.car is not Evaluation._LAMBDA_SYM
+                                         else formals)
+            while expr.pairp():
+                work.append(expr.car)
+                expr = expr.cdr
+    return {sym for sym in result
+            if sym not in bound and sym not in Evaluation.SPECIAL_FORMS
+            and sym is not Evaluation._ELSE_SYM
+            and sym is not Evaluation._ARROW_SYM}
+
+def _assigned_symbols(expr):
+    """The set of symbols defined or assigned anywhere in EXPR outside
+    quoted data, or None if EXPR may evaluate or load arbitrary code."""
+    result = set()
+    work = [expr]
+    while work:
+        expr = work.pop()
+        if expr is _EVAL_SYM or expr is _LOAD_SYM:
+            return None
+        if not expr.pairp() or expr.car is Evaluation._QUOTE_SYM:
+            continue
+        if expr.car in _ASSIGNMENT_FORMS and expr.cdr.pairp():
+            target = expr.cdr.car
+            if target.pairp():
+                target = target.car
+            result.add(target)
+        while expr.pairp():
+            work.append(expr.car)
+            expr = expr.cdr
+    return result
+
+_EVAL_SYM = Symbol.pin("eval")
+_LOAD_SYM = Symbol.pin("load")
+_ASSIGNMENT_FORMS = (Evaluation._DEFINE_SYM, Evaluation._DEFINE_MEMOIZED_SYM,
+                     Evaluation._SET_BANG_SYM)
+_BINDING_FORMS = (Evaluation._DEFINE_SYM, Evaluation._DEFINE_MEMOIZED_SYM,
+                  Evaluation._LAMBDA_SYM)
+
+def optimize(expr, env):
+    """EXPR, with each call to a pure predefined function on constant
+    operands replaced by its value, and each if or cond form whose tests are
+    constant replaced by the selected expressions, to be evaluated in the
+    environment ENV.  EXPR itself is not modified.  The replacements that
+    depend on the values of predefined functions are recorded, so that they
+    are undone if those functions are redefined (see deoptimize)."""
+    interp = current_context()
+    if not interp.initial_globals or not expr.pairp():
+        return expr
+    assigned = _assigned_symbols(expr)
+    if assigned is None:
+        return expr
+    return _Optimizer(env, assigned, interp).fold(expr, frozenset())[0]
+
+def deoptimize(sym):
+    """Restore every expression that was optimized on the assumption that
+    SYM keeps its initial global value."""
+    sites = current_context().optimized_sites.pop(sym, None)
+    if sites:
+        for site, original in list(sites.items()):
+            site.car, site.cdr = original.car, original.cdr
+            site.analysis = None
+
+class _Optimizer:
+    """The state of one call to optimize: the environment ENV in which the
+    optimized expression is to be evaluated, the set ASSIGNED of symbols
+    whose values it might change, and the Interpreter INTERP whose tables
+    describe the predefined functions."""
+
+    def __init__(self, env, assigned, interp):
+        self.env = env
+        self.assigned = assigned
+        self.interp = interp
+
+    def fold(self, expr, bound):
+        """A pair (expr', deps), where EXPR' is the optimized version of EXPR,
+        given that the symbols in BOUND are local variables.  DEPS is None if
+        EXPR' is not constant, and otherwise the set of symbols whose initial
+        values its value depends on."""
+        if not expr.pairp():
+            if expr.symbolp():
+                return expr, None
+            return expr, frozenset()
+        op = expr.car
+        if not scm_listp(expr):
+            return expr, None
+        if op is Evaluation._QUOTE_SYM:
+            return expr, (frozenset() if expr.length() == 2 else None)
+        if op.symbolp() and op in Evaluation.SPECIAL_FORMS:
+            folder = _Optimizer.FOLDERS.get(op)
+            if folder is None:
+                return expr, None
+            return folder(self, expr, bound), None
+        items, changed = [], False
+        constant, deps = True, set()
+        p = expr
+        while p.pairp():
+            item, item_deps = self.fold(p.car, bound)
+            changed = changed or item is not p.car
+            items.append(item)
+            if p is not expr:
+                if item_deps is None:
+                    constant = False
+                else:
+                    deps |= item_deps
+            p = p.cdr
+        interp = self.interp
+        if constant and op.symbolp() and op in interp.pure_functions:
+            func_deps = interp.pure_functions[op]
+            if self.initial_values(func_deps, bound):
+                try:
+                    value = scm_apply(interp.initial_globals[op],
+                                      _list_from([_constant(arg)[1]
+                                                  for arg in items[1:]]))
+                except (SchemeError, RecursionError):
+                    pass
+                else:
+                    return self.site(_quoted(value), expr, deps | func_deps), \
+                           frozenset(deps | func_deps)
+        if op.symbolp() and op in interp.inline_primitives:
+            inline = interp.inline_primitives[op].get(len(items) - 1)
+            if inline is not None and self.initial_values((op,), bound):
+                return self.site(Pair(inline, _list_from(items[1:])),
+                                 expr, (op,)), None
+        if not changed:
+            return expr, None
+        return _list_from(items), None
+
+    def initial_values(self, syms, bound):
+        """True iff none of SYMS is in BOUND or ASSIGNED, and each has its
+        initial global value in ENV."""
+        for sym in syms:
+            if sym in bound or sym in self.assigned:
+                return False
+            e = self.env
+            while e.enclosing is not None:
+                if sym in e.inner:
+                    return False
+                e = e.enclosing
+            if e.inner.get(sym) is not self.interp.initial_globals[sym]:
+                return False
+        return True
+
+    def site(self, replacement, original, deps):
+        """Record that the Pair REPLACEMENT stands for ORIGINAL on the
+        assumption that the symbols in DEPS keep their initial values.
+        Returns REPLACEMENT."""
+        optimized_sites = self.interp.optimized_sites
+        for sym in deps:
+            if sym not in optimized_sites:
+                optimized_sites[sym] = weakref.WeakKeyDictionary()
+            optimized_sites[sym][replacement] = original
+        _site_originals[replacement] = original
+        return replacement
+
+    def fold_seq(self, exprs, bound):
+        """The list of the optimized versions of the expressions in the
+        list EXPRS (EXPRS itself if none changed)."""
+        items, changed = [], False
+        p = exprs
+        while p.pairp():
+            item = self.fold(p.car, bound)[0]
+            changed = changed or item is not p.car
+            items.append(item)
+            p = p.cdr
+        if not changed:
+            return exprs
+        return _list_from(items, p)
+
+    def fold_tail(self, expr, start, bound):
+        """EXPR with its elements from the START'th onward optimized."""
+        head = []
+        p = expr
+        for _ in range(start):
+            head.append(p.car)
+            p = p.cdr
+        rest = self.fold_seq(p, bound)
+        if rest is p:
+            return expr
+        return _list_from(head, rest)
+
+    def fold_sequence_form(self, expr, bound):
+        return self.fold_tail(expr, 1, bound)
+
+    def fold_lambda(self, expr, bound):
+        if expr.length() < 3:
+            return expr
+        bound = bound | _formal_symbols(expr.cdr.car)
+        return self.fold_tail(expr, 2, bound)
+
+    def fold_define(self, expr, bound):
+        if expr.length() < 3:
+            return expr
+        target = expr.cdr.car
+        if target.pairp():
+            bound = bound | _formal_symbols(target.cdr)
+        return self.fold_tail(expr, 2, bound)
+
+    def fold_set_bang(self, expr, bound):
+        return self.fold_tail(expr, 2, bound)
+
+    def fold_let(self, expr, bound):
+        if expr.length() >= 4 and expr.cdr.car.symbolp():
+            # A named let: fold the rest as a let in which NAME is bound.
+            rest = self.fold_let(Pair(expr.car, expr.cdr.cdr),
+                                 bound | {expr.cdr.car})
+            if rest.cdr is expr.cdr.cdr:
+                return expr
+            return Pair(expr.car, Pair(expr.cdr.car, rest.cdr))
+        if expr.length() < 3 or not scm_listp(expr.cdr.car):
+            return expr
+        variables, inits = set(), []
+        bindings = expr.cdr.car
+        while bindings.pairp():
+            binding = bindings.car
+            if not scm_listp(binding) or binding.length() != 2:
+                return expr
+            variables.add(binding.car)
+            bindings = bindings.cdr
+        inner = bound | variables
+        init_bound = inner if expr.car is Evaluation._LET_STAR_SYM else bound
+        bindings = expr.cdr.car
+        changed = False
+        while bindings.pairp():
+            binding = bindings.car
+            init = self.fold(binding.cdr.car, init_bound)[0]
+            if init is not binding.cdr.car:
+                binding = make_list(binding.car, init)
+                changed = True
+            inits.append(binding)
+            bindings = bindings.cdr
+        body = self.fold_seq(expr.cdr.cdr, inner)
+        if not changed and body is expr.cdr.cdr:
+            return expr
+        return Pair(expr.car, Pair(_list_from(inits), body))
+
+    def fold_do(self, expr, bound):
+        if expr.length() < 3 or not scm_listp(expr.cdr.car) \
+           or not scm_listp(expr.cdr.cdr.car):
+            return expr
+        specs, variables = [], set()
+        p = expr.cdr.car
+        while p.pairp():
+            spec = p.car
+            if not scm_listp(spec) or not 2 <= spec.length() <= 3:
+                return expr
+            variables.add(spec.car)
+            specs.append(spec)
+            p = p.cdr
+        inner = bound | variables
+        changed = False
+        for k, spec in enumerate(specs):
+            init = self.fold(spec.cdr.car, bound)[0]
+            step = self.fold_seq(spec.cdr.cdr, inner)
+            if init is not spec.cdr.car or step is not spec.cdr.cdr:
+                specs[k] = Pair(spec.car, Pair(init, step))
+                changed = True
+        clause = self.fold_seq(expr.cdr.cdr.car, inner)
+        commands = self.fold_seq(expr.cdr.cdr.cdr, inner)
+        if not changed and clause is expr.cdr.cdr.car \
+           and commands is expr.cdr.cdr.cdr:
+            return expr
+        return Pair(expr.car, Pair(_list_from(specs), Pair(clause, commands)))
+
+    def fold_case(self, expr, bound):
+        if expr.length() < 2:
+            return expr
+        key = self.fold(expr.cdr.car, bound)[0]
+        clauses, changed = [], key is not expr.cdr.car
+        p = expr.cdr.cdr
+        while p.pairp():
+            clause = p.car
+            if scm_listp(clause) and clause.pairp():
+                body = self.fold_seq(clause.cdr, bound)
+                if body is not clause.cdr:
+                    clause = Pair(clause.car, body)
+                    changed = True
+            clauses.append(clause)
+            p = p.cdr
+        if not changed:
+            return expr
+        return Pair(expr.car, Pair(key, _list_from(clauses)))
+
+    def fold_if(self, expr, bound):
+        if not 3 <= expr.length() <= 4:
+            return expr
+        test, deps = self.fold(expr.cdr.car, bound)
+        branches = self.fold_seq(expr.cdr.cdr, bound)
+        if deps is None:
+            if test is expr.cdr.car and branches is expr.cdr.cdr:
+                return expr
+            return Pair(expr.car, Pair(test, branches))
+        if _constant(test)[1]:
+            choice = branches.car
+        elif branches.cdr.nullp():
+            choice = UNSPEC
+        else:
+            choice = branches.cdr.car
+        return self.select(choice, expr, deps)
+
+    def fold_cond(self, expr, bound):
+        clauses, deps, changed = [], set(), False
+        p = expr.cdr
+        while p.pairp():
+            clause = p.car
+            if not scm_listp(clause) or clause.nullp():
+                return expr
+            if clause.car is Evaluation._ELSE_SYM:
+                if not p.cdr.nullp():
+                    return expr
+                test, test_deps, truth = clause.car, frozenset(), True
+            else:
+                test, test_deps = self.fold(clause.car, bound)
+                truth = test_deps is not None and _constant(test)[1]
+            if clause.cdr.pairp() and clause.cdr.car is Evaluation._ARROW_SYM:
+                body = Pair(clause.cdr.car, self.fold_seq(clause.cdr.cdr, bound))
+                test_deps = None
+            else:
+                body = self.fold_seq(clause.cdr, bound)
+            if test is not clause.car or body is not clause.cdr:
+                clause = Pair(test, body)
+                changed = True
+            if test_deps is not None:
+                if not truth:
+                    # A clause that can never be selected.
+                    deps |= test_deps
+                    changed = True
+                    p = p.cdr
+                    continue
+                if not clauses and not body.nullp():
+                    # The first remaining clause is always selected.
+                    deps |= test_deps
+                    return self.site(Pair(Evaluation._BEGIN_SYM, body),
+                                     expr, deps)
+            clauses.append(clause)
+            p = p.cdr
+        if not changed:
+            return expr
+        return self.site(Pair(expr.car, _list_from(clauses)), expr, deps)
+
+    def select(self, choice, original, deps):
+        """CHOICE, an expression equivalent to ORIGINAL provided that the
+        symbols in DEPS keep their initial values."""
+        if not deps:
+            return choice
+        return self.site(make_list(Evaluation._BEGIN_SYM, choice),
+                         original, deps)
+
+    FOLDERS = {
+        Evaluation._AND_SYM: fold_sequence_form,
+        Evaluation._BEGIN_SYM: fold_sequence_form,
+        Evaluation._CASE_SYM: fold_case,
+        Evaluation._COND_SYM: fold_cond,
+        Evaluation._DEFINE_SYM: fold_define,
+        Evaluation._DEFINE_MEMOIZED_SYM: fold_define,
+        Evaluation._DO_SYM: fold_do,
+        Evaluation._IF_SYM: fold_if,
+        Evaluation._LAMBDA_SYM: fold_lambda,
+        Evaluation._LET_SYM: fold_let,
+        Evaluation._LET_STAR_SYM: fold_let,
+        Evaluation._OR_SYM: fold_sequence_form,
+        Evaluation._SET_BANG_SYM: fold_set_bang,
+    }
+
+def _constant(expr):
+    """A pair (True, value) if EXPR is a literal or quotation denoting VALUE,
+    and otherwise (False, None)."""
+    if expr.pairp():
+        if expr.car is Evaluation._QUOTE_SYM and expr.cdr.pairp() \
+           and expr.cdr.cdr.nullp():
+            return True, expr.cdr.car
+        return False, None
+    if expr.symbolp():
+        return False, None
+    return True, expr
+
+def _quoted(value):
+    """A new expression (quote VALUE)."""
+    return make_list(Evaluation._QUOTE_SYM, value)
+
+def _list_from(items, tail = NULL):
+    """The Scheme list of the values in the Python list ITEMS, ending with
+    TAIL."""
+    result = tail
+    for item in reversed(items):
+        result = Pair(item, result)
+    return result
+
+class CaseTable:
+    """The clauses of a case form, analyzed so that the clause selected by a
+    key is found in constant time.  Selects the same clause, and reports
+    the same errors, as checking each datum of each clause in turn."""
+
+    def __init__(self, clauses):
+        # Maps the eqv_key of each datum to the expression sequence of the
+        # first clause containing it.
+        self.table = {}
+        # The expression sequence of the else clause, if any.
+        self.else_seq = None
+        # The error reported when no datum matches, if any.
+        self.error = None
+        while clauses.pairp():
+            clause = clauses.car
+            if not clause.pairp():
+                self.error = "badly formed case clause"
+                return
+            data = clause.car
+            if data is Evaluation._ELSE_SYM:
+                if not scm_listp(clause) or clause.length() < 2:
+                    self.error = "badly formed else clause"
+                elif not clauses.cdr.nullp():
+                    self.error = "else clause must be the last clause in cond"
+                else:
+                    self.else_seq = clause.cdr
+                return
+            if data.atomp():
+                self.table.setdefault(data.eqv_key(), clause.cdr)
+            while data.pairp():
+                self.table.setdefault(data.car.eqv_key(), clause.cdr)
+                data = data.cdr
+            clauses = clauses.cdr
+
+    def lookup(self, k):
+        """The expression sequence of the clause selected by the key K, or
+        None if there is none."""
+        key = k.eqv_key()
+        if type(k) is Number and type(k.num_val) is float \
+           and k.num_val.is_integer():
+            # A real number is eqv? to an integer datum with the same value.
+            key = (Number, int(k.num_val))
+        expr_seq = self.table.get(key)
+        if expr_seq is not None:
+            return expr_seq
+        if self.error is not None:
+            raise SchemeError(self.error)
+        return self.else_seq
+
+def _bindings(bindings, min_size, max_size):
+    """The elements of the binding list BINDINGS of a let, named let, or do
+    form as a Python list, checking that each is a list of MIN_SIZE to
+    MAX_SIZE items that starts with a symbol."""
+    if not scm_listp(bindings):
+        raise SchemeError("badly formed bindings - incorrect number of subforms")
+    result = []
+    while bindings.pairp():
+        binding = bindings.car
+        if not scm_listp(binding) or binding.nullp() \
+           or not min_size <= binding.length() <= max_size:
+            raise SchemeError("badly formed binding - incorrect binding format")
+        result.append(binding)
+        bindings = bindings.cdr
+    return result
+
+class Scope:
+    """What is known about the code evaluated in a frame: DEFINES is the set
+    of symbols it may define in the frame after the frame is created, and
+    ASSIGNED the set of symbols whose bindings it may change once made,
+    with set! (in the frame or any other) or define (in the frame)."""
+
+    def __init__(self, defines, assigned):
+        self.defines = frozenset(defines)
+        self.assigned = frozenset(assigned)
+
+class Closure(Scope):
+    """The Scope of the body of a lambda expression (or a define form that
+    defines a function), with the set FREE of the symbols that the body may
+    refer to other than the formal parameters.  The function's frames are
+    REUSABLE if its body defines nothing, evaluates no code, and creates no
+    procedure or promise that refers to the formal parameters, so that once
+    the body reaches a tail call, nothing can observe the frame's bindings
+    any longer."""
+
+    def __init__(self, formals, exprs):
+        """The analysis of the expressions in the Python list EXPRS, the body
+        of a function whose formal parameter list is FORMALS."""
+        variables = _formal_symbols(formals)
+        free, defines, assigned = _scan_body(exprs, variables)
+        Scope.__init__(self, defines, assigned | defines)
+        self.free = tuple(free)
+        self.reusable = _frame_reuse_safe(exprs, variables)
+
+def _scan_body(exprs, bound):
+    """A tuple (free, defines, assigned) of sets describing the expressions in
+    the Python list EXPRS, evaluated in a new frame binding the symbols in
+    BOUND: FREE holds the symbols that they may refer to other than those in
+    BOUND, DEFINES the symbols that they may define in the new frame, and
+    ASSIGNED the symbols that they may assign with set!.  Each set may hold
+    more symbols than necessary.  Expressions replaced by optimize are
+    included in their original forms as well, since deoptimize may restore
+    them."""
+    free, defines, assigned = set(), set(), set()
+    # Items (expr, bound, own), where OWN is true iff EXPR is evaluated in
+    # the new frame itself.
+    work = [(expr, bound, True) for expr in exprs]
+
+    def push(exprs, bound, own):
+        while exprs.pairp():
+            work.append((exprs.car, bound, own))
+            exprs = exprs.cdr
+        work.append((exprs, bound, own))
+
+    while work:
+        expr, bound, own = work.pop()
+        if type(expr) is Symbol:
+            if expr not in bound:
+                free.add(expr)
+            continue
+        if not expr.pairp():
+            continue
+        original = _site_originals.get(expr)
+        if original is not None:
+            work.append((original, bound, own))
+        op, rest = expr.car, expr.cdr
+        if op is Evaluation._QUOTE_SYM:
+            continue
+        if op.symbolp() and op in Evaluation.SPECIAL_FORMS:
+            if not rest.pairp() or not scm_listp(expr):
+                push(rest, bound, own)
+            elif op is Evaluation._LAMBDA_SYM:
+                push(rest.cdr, bound | _formal_symbols(rest.car), False)
+            elif op is Evaluation._DEFINE_SYM \
+                 or op is Evaluation._DEFINE_MEMOIZED_SYM:
+                target = rest.car
+                if target.pairp():
+                    push(rest.cdr, bound | _formal_symbols(target.cdr), False)
+                    target = target.car
+                else:
+                    push(rest.cdr, bound, own)
+                if own:
+                    defines.add(target)
+            elif op is Evaluation._SET_BANG_SYM:
+                assigned.add(rest.car)
+                push(rest, bound, own)
+            elif op is Evaluation._LET_SYM or op is Evaluation._LET_STAR_SYM \
+                 or op is Evaluation._DO_SYM:
+                body_bound = set(bound)
+                if rest.car.symbolp():
+                    body_bound.add(rest.car)
+                    rest = rest.cdr
+                if not rest.pairp():
+                    continue
+                bindings = rest.car
+                while bindings.pairp():
+                    binding = bindings.car
+                    if binding.pairp():
+                        if op is Evaluation._LET_STAR_SYM:
+                            # The value may refer to earlier variables.
+                            push(binding.cdr, frozenset(body_bound), False)
+                        else:
+                            work.append((binding.cdr.car if binding.cdr.pairp()
+                                         else binding.cdr, bound, own))
+                            if binding.cdr.pairp():
+                                push(binding.cdr.cdr, body_bound, False)
+                        body_bound.add(binding.car)
+                    bindings = bindings.cdr
+                push(rest.cdr, frozenset(body_bound), False)
+            elif op is Evaluation._COND_SYM:
+                clauses = rest
+                while clauses.pairp():
+                    clause = clauses.car
+                    while clause.pairp():
+                        if clause.car is not Evaluation._ELSE_SYM \
+                           and clause.car is not Evaluation._ARROW_SYM:
+                            work.append((clause.car, bound, own))
+                        clause = clause.cdr
+                    clauses = clauses.cdr
+            elif op is Evaluation._CASE_SYM:
+                work.append((rest.car, bound, own))
+                clauses = rest.cdr
+                while clauses.pairp():
+                    if clauses.car.pairp():
+                        push(clauses.car.cdr, bound, own)
+                    clauses = clauses.cdr
+            else:
+                push(rest, bound, own)
+        else:
+            push(expr, bound, own)
+    return free, defines, assigned
+
+def _closure_analysis(expr):
+    """The Closure for the lambda expression or function definition EXPR,
+    cached in EXPR."""
+    closure = expr.analysis
+    if closure is None:
+        formals = expr.cdr.car
+        if expr.car is not Evaluation._LAMBDA_SYM:
+            formals = formals.cdr
+        closure = cache_analysis(expr, Closure(formals, _items(expr.cdr.cdr)))
+    return closure
+
+def _let_analysis(expr):
+    """The Scope of the frame created by the let or let* form EXPR, cached
+    in EXPR."""
+    scope = expr.analysis
+    if scope is None:
+        variables = [binding.car for binding in _items(expr.cdr.car)
+                     if binding.pairp()]
+        _, defines, assigned = _scan_body(_items(expr.cdr.cdr), set(variables))
+        if expr.car is Evaluation._LET_STAR_SYM:
+            # A let* form defines its variables one by one, possibly more
+            # than once.
+            repeated = {sym for sym in variables if variables.count(sym) > 1}
+            scope = Scope(defines | set(variables),
+                          assigned | defines | repeated)
+        else:
+            scope = Scope(defines, assigned | defines)
+        cache_analysis(expr, scope)
+    return scope
+
+def closure_environment(closure, env):
+    """The environment for a function with the Closure analysis CLOSURE,
+    created in the environment ENV.  To avoid keeping alive bindings that
+    the function cannot use, this is a new frame holding only the function's
+    free variables, enclosed by the innermost frame of ENV whose Scope is
+    unknown.  The new frame shares the Cells of variables that may be
+    assigned (putting them into Cells, if necessary), and copies the values
+    of the others.  A variable that is not yet defined, but may be, is found
+    in the frame that will define it, by enclosing the new frame in that
+    frame instead."""
+    stop = env
+    while stop.scope is not None:
+        stop = stop.enclosing
+    if stop is env:
+        return env
+    captured = {}
+    for sym in closure.free:
+        e = env
+        while e is not stop:
+            inner = e.inner
+            if sym in inner:
+                value = inner[sym]
+                if type(value) is not Cell and sym in e.scope.assigned:
+                    value = inner[sym] = Cell(value)
+                captured[sym] = value
+                break
+            if sym in e.scope.defines:
+                stop = e
+                break
+            e = e.enclosing
+    if stop is env:
+        return env
+    frame = EnvironFrame(stop)
+    frame.inner = captured
+    frame.scope = _CAPTURED_SCOPE
+    return frame
+
+# The Scope of the frames made by closure_environment, in which nothing is
+# defined, and whose variables are assigned only through their Cells.
+_CAPTURED_SCOPE = Scope((), ())
+
+class NamedLet:
+    """The parts of a named let form (let NAME ((VAR INIT) ...) BODY ...).
+    The loop is NATIVE if its body can create no procedure that refers to
+    NAME or the VARs and uses NAME only to call it, so that a single frame
+    can serve for every iteration (see NamedLoop).  The PLAN of a native
+    loop (see _loop_plan) lets Evaluation.run_loop carry out its iterations
+    as a Python loop."""
+
+    def __init__(self, expr):
+        if not scm_listp(expr) or expr.length() < 4:
+            raise SchemeError("too few operands in form")
+        self.name = expr.cdr.car
+        bindings = _bindings(expr.cdr.cdr.car, 2, 2)
+        self.variables = [binding.car for binding in bindings]
+        self.inits = [binding.cdr.car for binding in bindings]
+        self.formals = make_list(*self.variables)
+        Evaluation.check_formals(self.formals)
+        self.body = make_single_body(expr.cdr.cdr.cdr)
+        self.native = self.name not in self.variables and \
+            _frame_reuse_safe(_items(expr.cdr.cdr.cdr), self.variables,
+                              self.name)
+        self.plan = _loop_plan(self.body, self.name) if self.native else None
+        # The Closure of the loop's procedure, and the Scope of the frame
+        # binding its name, for loops that are not native, and for all
+        # loops in tasks (see Task.let_form).
+        self.closure = Closure(self.formals, _items(expr.cdr.cdr.cdr))
+        self.scope = Scope((), self.closure.assigned)
+
+class DoLoop:
+    """The parts of a do form
+        (do ((VAR INIT STEP) ...) (TEST RESULT ...) COMMAND ...),
+    with STEPS holding the STEP of each VAR (or VAR itself, if it has none).
+    The loop is NATIVE if it can create no procedure that refers to the VARs,
+    so that a single frame can serve for every iteration."""
+
+    def __init__(self, expr):
+        if not scm_listp(expr) or expr.length() < 3:
+            raise SchemeError("too few operands in form")
+        bindings = _bindings(expr.cdr.car, 2, 3)
+        self.variables = [binding.car for binding in bindings]
+        self.inits = [binding.cdr.car for binding in bindings]
+        self.steps = [binding.nth(2) if binding.length() == 3 else binding.car
+                      for binding in bindings]
+        Evaluation.check_formals(make_list(*self.variables))
+        clause = expr.cdr.cdr.car
+        if not scm_listp(clause) or clause.nullp():
+            raise SchemeError("badly formed do test clause")
+        self.test = clause.car
+        self.results = clause.cdr
+        self.commands = _items(expr.cdr.cdr.cdr)
+        self.native = _frame_reuse_safe(
+            self.inits + self.steps + _items(clause) + self.commands,
+            self.variables)
+        if not self.native:
+            _, defines, assigned = _scan_body(
+                self.steps + _items(clause) + self.commands,
+                set(self.variables))
+            self.scope = Scope(defines, assigned | defines)
+
+def _items(exprs):
+    """The elements of the list EXPRS, as a Python list."""
+    result = []
+    while exprs.pairp():
+        result.append(exprs.car)
+        exprs = exprs.cdr
+    return result
+
+# The kinds of node in the plan of a native named let.
+_PLAN_EXPR, _PLAN_IF, _PLAN_BEGIN, _PLAN_COND, _PLAN_LOOP = range(5)
+
+def _loop_plan(expr, name):
+    """The plan for evaluating EXPR, in tail position in the body of the
+    native named let named NAME: a tree of tuples with the forms
+        (_PLAN_IF, TEST, THEN, ELSE)    an if form;
+        (_PLAN_BEGIN, EXPRS, LAST)      a sequence whose last element is LAST;
+        (_PLAN_COND, CLAUSES)           a cond form, with CLAUSES a list of
+                                        pairs (TEST, BODY), where TEST is None
+                                        for else and BODY is None if the
+                                        clause has only a test;
+        (_PLAN_LOOP, OPERANDS)          a call of the loop;
+        (_PLAN_EXPR, EXPR)              any other expression.
+    Malformed forms, and forms created by optimize (which deoptimize may
+    change), are left to be evaluated as ordinary expressions."""
+    if not expr.pairp() or expr in _site_originals or not scm_listp(expr):
+        return (_PLAN_EXPR, expr)
+    op, items = expr.car, _items(expr.cdr)
+    if op is name:
+        return (_PLAN_LOOP, items)
+    elif op is Evaluation._IF_SYM and 2 <= len(items) <= 3:
+        if len(items) == 3:
+            otherwise = _loop_plan(items[2], name)
+        else:
+            otherwise = (_PLAN_EXPR, UNSPEC)
+        return (_PLAN_IF, items[0], _loop_plan(items[1], name), otherwise)
+    elif op is Evaluation._BEGIN_SYM and items:
+        return _sequence_plan(items, name)
+    elif op is Evaluation._COND_SYM:
+        clauses = []
+        for k, clause in enumerate(items):
+            if not scm_listp(clause) or clause.nullp():
+                return (_PLAN_EXPR, expr)
+            body = _items(clause.cdr)
+            if body and body[0] is Evaluation._ARROW_SYM:
+                return (_PLAN_EXPR, expr)
+            if clause.car is Evaluation._ELSE_SYM:
+                if k != len(items) - 1 or not body:
+                    return (_PLAN_EXPR, expr)
+                test = None
+            else:
+                test = clause.car
+            clauses.append((test, _sequence_plan(body, name) if body else None))
+        return (_PLAN_COND, clauses)
+    return (_PLAN_EXPR, expr)
+
+def _sequence_plan(exprs, name):
+    """The plan for evaluating the expressions in the non-empty Python list
+    EXPRS in turn (see _loop_plan)."""
+    if len(exprs) == 1:
+        return _loop_plan(exprs[0], name)
+    return (_PLAN_BEGIN, exprs[:-1], _loop_plan(exprs[-1], name))
+
+def _loop_analysis(expr):
+    """The NamedLet or DoLoop for the loop form EXPR, cached in EXPR."""
+    loop = expr.analysis
+    if loop is None:
+        if expr.car is Evaluation._DO_SYM:
+            loop = DoLoop(expr)
+        else:
+            loop = NamedLet(expr)
+        cache_analysis(expr, loop)
+    return loop
+
+# Special forms that create no procedures or promises of their own.
+_NONCAPTURING_FORMS = (
+    Evaluation._AND_SYM, Evaluation._BEGIN_SYM, Evaluation._CASE_SYM,
+    Evaluation._COND_SYM, Evaluation._IF_SYM, Evaluation._LET_STAR_SYM,
+    Evaluation._OR_SYM, Evaluation._QUOTE_SYM, Evaluation._SET_BANG_SYM,
+)
+
+def _frame_reuse_safe(exprs, variables, name = None):
+    """True iff evaluating the expressions in the Python list EXPRS in a
+    frame that binds the symbols in VARIABLES (and NAME, if not None)
+    defines nothing, evaluates or loads no code, creates no procedure or
+    promise that might refer to those symbols, and uses NAME only as the
+    operator of calls.
+    Expressions replaced by optimize are checked in their original forms as
+    well, since deoptimize may restore them."""
+    syms = set(variables)
+    if name is not None:
+        syms.add(name)
+    work = list(exprs)
+    while work:
+        expr = work.pop()
+        if expr is name or expr is _EVAL_SYM or expr is _LOAD_SYM:
+            return False
+        if not expr.pairp():
+            continue
+        original = _site_originals.get(expr)
+        if original is not None:
+            work.append(original)
+        op = expr.car
+        if op is Evaluation._QUOTE_SYM:
+            continue
+        if op is Evaluation._DEFINE_SYM or op is Evaluation._DEFINE_MEMOIZED_SYM:
+            return False
+        if op is Evaluation._DO_SYM or op is Evaluation._LET_SYM:
+            if op is Evaluation._DO_SYM or \
+               (expr.cdr.pairp() and expr.cdr.car.symbolp()):
+                try:
+                    native = _loop_analysis(expr).native
+                except SchemeError:
+                    native = False
+                if not native and _mentions(expr, syms):
+                    return False
+        elif op in Evaluation.SPECIAL_FORMS and op not in _NONCAPTURING_FORMS \
+             and _mentions(expr, syms):
+            return False
+        if op is name:
+            expr = expr.cdr
+        while expr.pairp():
+            work.append(expr.car)
+            expr = expr.cdr
+        if expr is name:
+            return False
+    return True
+
+def _mentions(expr, syms):
+    """True iff any of the symbols in SYMS occurs anywhere in EXPR."""
+    work = [expr]
+    while work:
+        expr = work.pop()
+        if expr.symbolp():
+            if expr in syms:
+                return True
+        elif expr.pairp():
+            work.append(expr.car)
+            work.append(expr.cdr)
+    return False
+
 def scm_eval(sexpr):
     # To begin with, this function simply returns SEXPR unchanged, without
     # doing any evaluation.  This allows you to test your solution to
@@ -567,7 +2097,8 @@ def scm_eval(sexpr):
     #    return Evaluation(sexpr, the_global_environment).step_to_value()
     # which is what evaluation is supposed to do.
 
-    return Evaluation(sexpr, the_global_environment).step_to_value()
+    env = current_context().env
+    return Evaluation(optimize(sexpr, env), env).step_to_value()
 
 def scm_apply(func, arg0, *other_args):
     """If OTHER_ARGS is empty, apply the function value FUNC to the argument 
@@ -575,25 +2106,1289 @@ def scm_apply(func, arg0, *other_args):
     the last value in OTHER_ARGS are first added (with scm_cons) to
     the beginning of the last argument in OTHER_ARGS (which must be 
     a Scheme list), and then passed to the value of FUNC."""
+    return apply_function(func, _apply_args(arg0, other_args))
+
+def _apply_args(arg0, other_args):
+    """The Python list of the arguments to which apply, given ARG0 and
+    OTHER_ARGS, applies its function (see scm_apply)."""
     if other_args:
         check_type(other_args[-1], scm_listp, len(other_args), 'apply')
         args = [arg0]
-        for i in range(len(other_args)-1):
-            args.append(other_args[i])
+        args.extend(other_args[:-1])
         rest = other_args[-1]
     else:
         check_type(arg0, scm_listp, 0, 'apply')
         args = []
         rest = arg0
 
+    if type(rest) is CompactList and rest.intact():
+        args.extend(rest.elements())
+        rest = NULL
     while not rest.nullp():
         args.append(rest.car)
         rest = rest.cdr
-    
+    return args
+
+def apply_function(func, args):
+    """The value of the Scheme function FUNC applied to the Python list of
+    values ARGS."""
     evaluation = Evaluation(None, None)
     func.apply_step(args, evaluation)
     return evaluation.step_to_value()
 
+def scm_memoize(func, size = None, test = None):
+    """A MemoizedFunction that caches the values of FUNC for up to SIZE
+    argument lists (an integer), compared using TEST (the eqv? or equal?
+    procedure, by default equal?)."""
+    if size is None:
+        size = MemoizedFunction.DEFAULT_SIZE
+    else:
+        check_type(size, scm_integerp, 1, "memoize")
+        if size.num_val < 1:
+            raise SchemeError("memoize cache size must be positive")
+        size = size.num_val
+    if test is None or getattr(test, "func", None) is scm_equalp:
+        key = "equal_key"
+    elif getattr(test, "func", None) is scm_eqvp:
+        key = "eqv_key"
+    else:
+        raise SchemeError("memoize test must be eqv? or equal?")
+    return MemoizedFunction(func, size, key)
+
+def _memoizedp(x):
+    return isinstance(x, MemoizedFunction)
+
+def scm_memo_stats(func):
+    """A list (hits misses size max-size) describing the cache of the
+    memoized function FUNC."""
+    check_type(func, _memoizedp, 0, "memo-stats")
+    return make_list(Number(func.hits), Number(func.misses),
+                     Number(len(func.cache)), Number(func.max_size))
+
+def scm_memo_clear(func):
+    """Empty the cache of the memoized function FUNC and reset its
+    statistics."""
+    check_type(func, _memoizedp, 0, "memo-clear!")
+    func.cache.clear()
+    func.hits = func.misses = 0
+    return UNSPEC
+
+##
+## Higher-order list operations
+##
+## These loop in Python over their list arguments (which may be of any
+## length), build their results in a single forward pass, and call
+## primitive functions directly.
+
+def _function_caller(func):
+    """A Python function that applies the Scheme function FUNC to its
+    arguments and returns the value."""
+    if type(func) is PrimitiveFunction:
+        py_func = func.func
+        def call(*args):
+            try:
+                return py_func(*args)
+            except TypeError:
+                raise SchemeError("{0} received an incorrect number of arguments"
+                                  .format(repr(py_func)))
+        return call
+    return lambda *args: apply_function(func, list(args))
+
+def _elements(lst, k, name):
+    """An iterable over the elements of LST, which must be a proper list
+    (argument K of NAME)."""
+    check_type(lst, scm_listp, k, name)
+    if type(lst) is CompactList and lst.intact():
+        return lst.elements()
+    return _walk(lst)
+
+def _walk(lst):
+    """Generate the elements of the proper list LST."""
+    while lst.pairp():
+        yield lst.car
+        lst = lst.cdr
+
+def _operand_tuples(lists, name):
+    """An iterable over tuples of the corresponding elements of the lists
+    in LISTS (arguments 1 on of NAME), as long as the shortest."""
+    return zip(*[_elements(lst, k + 1, name) for k, lst in enumerate(lists)])
+
+def scm_map(func, lst, *lists):
+    call = _function_caller(func)
+    head = last = Pair(NULL, NULL)
+    if lists:
+        for args in _operand_tuples((lst,) + lists, "map"):
+            last.cdr = last = Pair(call(*args), NULL)
+    else:
+        for x in _elements(lst, 1, "map"):
+            last.cdr = last = Pair(call(x), NULL)
+    return head.cdr
+
+def scm_for_each(func, lst, *lists):
+    call = _function_caller(func)
+    if lists:
+        for args in _operand_tuples((lst,) + lists, "for-each"):
+            call(*args)
+    else:
+        for x in _elements(lst, 1, "for-each"):
+            call(x)
+    return UNSPEC
+
+def scm_filter(pred, lst):
+    call = _function_caller(pred)
+    head = last = Pair(NULL, NULL)
+    for x in _elements(lst, 1, "filter"):
+        if call(x):
+            last.cdr = last = Pair(x, NULL)
+    return head.cdr
+
+def scm_fold(func, init, lst, *lists):
+    """The result of combining INIT with the elements of LST (and of LISTS)
+    from left to right, as (FUNC element ... accumulated)."""
+    call = _function_caller(func)
+    acc = init
+    if lists:
+        for args in _operand_tuples((lst,) + lists, "fold"):
+            acc = call(*(args + (acc,)))
+    else:
+        for x in _elements(lst, 2, "fold"):
+            acc = call(x, acc)
+    return acc
+
+def scm_fold_right(func, init, lst, *lists):
+    """The result of combining INIT with the elements of LST (and of LISTS)
+    from right to left, as (FUNC element ... accumulated)."""
+    call = _function_caller(func)
+    acc = init
+    for args in reversed(list(_operand_tuples((lst,) + lists, "fold-right"))):
+        acc = call(*(args + (acc,)))
+    return acc
+
+def scm_reduce(func, init, lst):
+    """INIT if LST is empty, and otherwise the result of combining the
+    elements of LST from left to right, as (FUNC element accumulated)."""
+    call = _function_caller(func)
+    items = iter(_elements(lst, 2, "reduce"))
+    acc = next(items, None)
+    if acc is None:
+        return init
+    for x in items:
+        acc = call(x, acc)
+    return acc
+
+##
+## Promises and streams
+##
+## A stream is either the empty list or a pair whose cdr is a promise of a
+## stream.  The stream operations defined here are iterative, so that
+## streams of any length can be processed in constant space (provided that
+## their heads are not retained).
+
+def scm_force(x):
+    """The value of X if it is a promise, and otherwise X itself."""
+    if isinstance(x, Promise):
+        return x.force()
+    return x
+
+def scm_make_promise(x):
+    """X if it is a promise, and otherwise a promise whose value is X."""
+    if isinstance(x, Promise):
+        return x
+    return Promise(value = x)
+
+def scm_promisep(x):
+    return boolify(isinstance(x, Promise))
+
+def _stream_pairp(x):
+    return x.pairp() and isinstance(x.cdr, Promise)
+
+def _streamp(x):
+    return x.nullp() or _stream_pairp(x)
+
+def scm_stream_car(s):
+    check_type(s, scm_pairp, 0, "stream-car")
+    return s.car
+
+def scm_stream_cdr(s):
+    check_type(s, _stream_pairp, 0, "stream-cdr")
+    return s.cdr.force()
+
+def _stream_map(func, streams):
+    """The stream of the values of FUNC applied to the corresponding
+    elements of the Python list STREAMS, as long as the shortest."""
+    for k, s in enumerate(streams):
+        if s.nullp():
+            return NULL
+        check_type(s, _streamp, k + 1, "stream-map")
+    value = apply_function(func, [s.car for s in streams])
+    return Pair(value, Promise(lambda: _stream_map(
+        func, [scm_stream_cdr(s) for s in streams])))
+
+def scm_stream_map(func, s0, *streams):
+    return _stream_map(func, [s0] + list(streams))
+
+def scm_stream_filter(pred, s):
+    """The stream of the elements of the stream S that satisfy PRED.
+    Elements that do not satisfy it are skipped iteratively."""
+    while not s.nullp():
+        check_type(s, _streamp, 1, "stream-filter")
+        if apply_function(pred, [s.car]):
+            rest = s
+            return Pair(s.car, Promise(
+                lambda: scm_stream_filter(pred, scm_stream_cdr(rest))))
+        s = scm_stream_cdr(s)
+    return NULL
+
+def scm_stream_take(s, n):
+    """The stream of the first N elements of the stream S (all of them, if
+    S has fewer)."""
+    check_type(n, scm_integerp, 1, "stream-take")
+    if n.num_val < 0:
+        raise SchemeError("stream-take count may not be negative")
+    if n.num_val == 0 or s.nullp():
+        return NULL
+    check_type(s, _streamp, 0, "stream-take")
+    return Pair(s.car, Promise(
+        lambda: scm_stream_take(scm_stream_cdr(s), Number(n.num_val - 1))))
+
+def scm_stream_to_list(s, n = None):
+    """A list of the elements of the stream S, or of its first N elements
+    if N is given."""
+    if n is not None:
+        check_type(n, scm_integerp, 1, "stream->list")
+        n = n.num_val
+    items = []
+    while not s.nullp() and (n is None or len(items) < n):
+        check_type(s, _streamp, 0, "stream->list")
+        items.append(s.car)
+        s = s.cdr.force()
+    return make_list(*items)
+
+##
+## Green threads
+##
+## A Scheduler interleaves many evaluations (Tasks) in one thread of
+## control, running each for a quantum of evaluation steps (or until it
+## blocks) in turn.  A task keeps no Python stack between turns: it carries
+## out its evaluation on a stack of Evaluations of its own, where the forms
+## through which control passes (calls, conditionals, sequences, bindings
+## and loops) are handled by generators that request the values of their
+## subexpressions from the task (see Task.advance) rather than computing
+## them by nested calls of step_to_value.  Other forms, and procedures
+## called by primitives other than apply, map and for-each (as by sort),
+## are evaluated as usual, in a single step of the task; a task waiting
+## inside one runs the other tasks until it can continue, and pauses at
+## the end of its quantum only once the step is done.
+
+class _Quantum(Budget):
+    """The Budget under which TASK runs, which ends TASK's turn every
+    QUANTUM steps, and charges the steps and pairs used to the Budget
+    PARENT (if not None) in effect where the task was spawned."""
+
+    def __init__(self, task, quantum, parent):
+        Budget.__init__(self)
+        self.task = task
+        self.CHECK_INTERVAL = quantum
+        self.parent = parent
+        self.charged = (0, 0)
+
+    def forward(self):
+        """Charge the steps and pairs used since the last call to PARENT."""
+        if self.parent is not None:
+            steps, conses = self.charged
+            self.parent.steps += self.steps - steps
+            self.parent.conses += self.conses - conses
+            self.charged = (self.steps, self.conses)
+
+    def check(self):
+        if self.parent is not None:
+            self.forward()
+            self.parent.check()
+            self.parent.allocate(0)
+        Budget.check(self)
+        self.task.expired = True
+
+def _simple(expr):
+    """True iff EXPR is a symbol, a literal, or a call of an InlinePrimitive
+    on simple expressions, whose evaluation can neither block nor take long
+    (and so need not be carried out by form handlers)."""
+    return not expr.pairp() or \
+        (type(expr.car) is InlinePrimitive and _simple_operands(expr.cdr))
+
+def _simple_operands(exprs):
+    """True iff the list EXPRS consists of simple expressions."""
+    while exprs.pairp():
+        if not _simple(exprs.car):
+            return False
+        exprs = exprs.cdr
+    return True
+
+class _Suspended(Exception):
+    """Raised by an operation that cannot yet complete, called directly by
+    the evaluation of a task (see Task.apply), once the task is queued to
+    be made ready when the operation may have become possible."""
+
+# The request of a Task's form handler to suspend the task until it is
+# resumed.
+_SUSPEND = object()
+
+class Task(SchemeValue):
+    """An evaluation run by SCHEDULER, begun by START, a function of the
+    Task and an Evaluation that returns a form handler (see advance) for
+    the evaluation, and charged to the Budget BUDGET (or None).  When DONE,
+    its result is VALUE, or the exception ERROR if it failed."""
+
+    # The greatest number of nested evaluations of a task.
+    MAX_DEPTH = 10000
+
+    def __init__(self, scheduler, start, budget = None):
+        self.scheduler = scheduler
+        self.value = self.error = None
+        self.done = False
+        self.runnable = True
+        # The tasks waiting in task-join, and the asyncio futures waiting
+        # in Scheduler.join_async, for SELF to finish.
+        self.joiners = deque()
+        self.futures = []
+        evaluation = Evaluation(None, None)
+        evaluation.handler = start(self, evaluation)
+        # The Evaluations that SELF is carrying out, each nested in the one
+        # before, and the value to send to the handler of the last when
+        # SELF resumes.
+        self.stack = [evaluation]
+        self.pending = None
+        self.quantum = _Quantum(self, scheduler.quantum, budget)
+        # Whether SELF's turn has ended, and whether SELF is calling an
+        # operation that may suspend it.
+        self.expired = False
+        self.direct = False
+
+    def type_name(self):
+        return "task"
+
+    def write(self, out):
+        print("#[task]", file=out, end="")
+
+    def run(self):
+        """Carry out SELF's evaluation until its quantum ends, it blocks, or
+        it finishes."""
+        outer = thread_state.task
+        thread_state.task = self
+        self.expired = False
+        quantum = self.quantum
+        try:
+            with self.scheduler.interp, quantum:
+                quantum.next_check = quantum.steps + quantum.CHECK_INTERVAL
+                self.done = self.advance()
+        except (SchemeError, Exception) as exc:
+            self.error = exc
+            self.done = True
+        finally:
+            quantum.forward()
+            thread_state.task = outer
+        if self.done:
+            self.stack = None
+
+    def advance(self):
+        """Step the Evaluations on SELF's stack until SELF's quantum ends or
+        it blocks (returning False), or the first is done (returning True).
+
+        A form handler is a generator that carries out the step of an
+        Evaluation: to get the value of a subexpression, it yields the
+        expression and the environment in which to evaluate it (or a new
+        Evaluation, as in call), and is sent the value; it yields _SUSPEND
+        after SELF has been suspended, and is sent None when SELF
+        resumes."""
+        stack = self.stack
+        budget = thread_state.budget
+        value = self.pending
+        self.pending = None
+        while True:
+            evaluation = stack[-1]
+            handler = evaluation.handler
+            if handler is None:
+                if evaluation.value is not None:
+                    stack.pop()
+                    if not stack:
+                        self.value = evaluation.value
+                        return True
+                    value = evaluation.value
+                    continue
+                if self.expired:
+                    return False
+                budget.steps += 1
+                if budget.steps >= budget.next_check:
+                    budget.check()
+                handler = self.start(evaluation)
+                if handler is None:
+                    continue
+                evaluation.handler = handler
+                value = None
+            while True:
+                try:
+                    request = handler.send(value)
+                except StopIteration:
+                    evaluation.handler = None
+                    break
+                if request is _SUSPEND:
+                    return False
+                if type(request) is tuple:
+                    # Carry out the first step of the evaluation at once,
+                    # since for most subexpressions it is the last.
+                    expr, env = request
+                    budget.steps += 1
+                    if budget.steps >= budget.next_check:
+                        budget.check()
+                    if type(expr) is Symbol:
+                        value = env[expr]
+                    elif expr.atomp():
+                        value = expr
+                    else:
+                        request = Evaluation(expr, env)
+                        request.handler = self.start(request)
+                        value = request.value
+                    if value is not None:
+                        if self.expired:
+                            self.pending = value
+                            return False
+                        continue
+                if len(stack) >= self.MAX_DEPTH:
+                    raise SchemeError("maximum recursion depth exceeded")
+                stack.append(request)
+                value = None
+                break
+
+    def start(self, evaluation):
+        """The form handler for the next step of EVALUATION, or None after
+        carrying out the step at once."""
+        expr = evaluation.expr
+        if not expr.pairp():
+            evaluation.step()
+            return None
+        op = expr.car
+        if type(op) is InlinePrimitive:
+            if _simple_operands(expr.cdr):
+                evaluation.step()
+                return None
+            return self.inline_form(evaluation)
+        if expr.analysis is None and not scm_listp(expr):
+            evaluation.step()
+            return None
+        if type(op) is Symbol:
+            if op is Evaluation._IF_SYM and expr.cdr.pairp() \
+               and _simple(expr.cdr.car):
+                evaluation.step()
+                return None
+            form = Task.FORMS.get(op)
+            if form is not None:
+                return form(self, evaluation)
+            if op in Evaluation.SPECIAL_FORMS:
+                evaluation.step()
+                return None
+        if _simple_operands(expr):
+            func = evaluation.operand_value(op)
+            if type(func) is not PrimitiveFunction or \
+               (func.func not in _BLOCKING and func.func not in Task.PRIMITIVES):
+                evaluation.do_call_form()
+                return None
+        return self.call_form(evaluation)
+
+    def result(self):
+        """The value of SELF, which is done, or its error, raised again."""
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    # Form handlers, which carry out the same steps as the corresponding
+    # methods of Evaluation.
+
+    def call_form(self, evaluation):
+        expr, env = evaluation.expr, evaluation.env
+        op = yield expr.car, env
+        args = []
+        rest = expr.cdr
+        while not rest.nullp():
+            args.append((yield rest.car, env))
+            rest = rest.cdr
+        if type(op) is PrimitiveFunction and \
+           (op.func in _BLOCKING or op.func in Task.PRIMITIVES):
+            yield from self.apply(op, args, evaluation)
+        else:
+            op.apply_step(args, evaluation)
+
+    def apply(self, op, args, evaluation):
+        """A form handler for the application of OP to the Python list of
+        values ARGS as the rest of EVALUATION."""
+        if type(op) is PrimitiveFunction and op.func in Task.PRIMITIVES:
+            try:
+                handler = Task.PRIMITIVES[op.func](self, evaluation, *args)
+            except TypeError:
+                raise SchemeError("{0} received an incorrect number of "
+                                  "arguments".format(repr(op.func)))
+            yield from handler
+            return
+        if type(op) is not PrimitiveFunction or op.func not in _BLOCKING:
+            op.apply_step(args, evaluation)
+            return
+        while True:
+            self.direct = True
+            try:
+                op.apply_step(args, evaluation)
+            except _Suspended:
+                pass
+            else:
+                return
+            finally:
+                self.direct = False
+            yield _SUSPEND
+
+    def call(self, func, args):
+        """The value of FUNC applied to the Python list of values ARGS, for
+        a form handler to get with yield from."""
+        evaluation = Evaluation(None, None)
+        evaluation.handler = self.apply(func, args, evaluation)
+        return (yield evaluation)
+
+    def inline_form(self, evaluation):
+        expr, env = evaluation.expr, evaluation.env
+        inline = expr.car
+        x = yield expr.cdr.car, env
+        if inline.arity == 1:
+            evaluation.set_value(inline.fast(x))
+        else:
+            y = yield expr.cdr.cdr.car, env
+            evaluation.set_value(inline.fast(x, y))
+
+    def sequence(self, evaluation, exprs, env = None, default = UNSPEC):
+        """A form handler for the expressions in the list EXPRS, evaluated
+        in ENV (by default, EVALUATION's environment) as the rest of
+        EVALUATION (as by evaluate_expr_seq_and_set_expr_as_last)."""
+        if exprs.nullp():
+            evaluation.set_expr(default)
+            return
+        env = env or evaluation.env
+        while exprs.cdr.pairp():
+            yield exprs.car, env
+            exprs = exprs.cdr
+        evaluation.set_expr(exprs.car, env)
+
+    def eval_sequence(self, evaluation, exprs):
+        """A form handler for the expressions in the Python list EXPRS,
+        each optimized and evaluated in turn, as by scm_eval, in the global
+        environment, as EVALUATION, whose value is the value of the last
+        (or UNSPEC)."""
+        env = current_context().env
+        value = UNSPEC
+        for expr in exprs:
+            value = yield optimize(expr, env), env
+        evaluation.set_value(value)
+
+    def if_form(self, evaluation):
+        evaluation.check_form(3, 4)
+        expr = evaluation.expr
+        if (yield expr.nth(1), evaluation.env):
+            evaluation.set_expr(expr.nth(2))
+        elif expr.length() == 3:
+            evaluation.set_expr(UNSPEC)
+        else:
+            evaluation.set_expr(expr.nth(3))
+
+    def and_form(self, evaluation):
+        evaluation.check_form(1)
+        rest_expr = evaluation.expr.cdr
+        if rest_expr.nullp():
+            evaluation.set_value(TRUE)
+            return
+        while rest_expr.cdr.pairp():
+            if not (yield rest_expr.car, evaluation.env):
+                evaluation.set_expr(rest_expr.car)
+                return
+            rest_expr = rest_expr.cdr
+        evaluation.set_expr(rest_expr.car)
+
+    def or_form(self, evaluation):
+        evaluation.check_form(1)
+        rest_expr = evaluation.expr.cdr
+        if rest_expr.nullp():
+            evaluation.set_value(FALSE)
+            return
+        while rest_expr.cdr.pairp():
+            if (yield rest_expr.car, evaluation.env):
+                evaluation.set_expr(rest_expr.car)
+                return
+            rest_expr = rest_expr.cdr
+        evaluation.set_expr(rest_expr.car)
+
+    def cond_form(self, evaluation):
+        evaluation.check_form(1)
+        clauses = evaluation.expr.cdr
+        while clauses.pairp():
+            clause = clauses.car
+            evaluation.check_form(1, expr = clause)
+            if clause.car is Evaluation._ELSE_SYM:
+                try:
+                    evaluation.check_form(2, expr = clause)
+                except SchemeError:
+                    raise SchemeError("badly formed else clause")
+                if not clauses.cdr.nullp():
+                    raise SchemeError("else clause must be the last clause in cond")
+                test = TRUE
+            else:
+                test = yield clause.car, evaluation.env
+            if test:
+                if clause.length() == 1:
+                    evaluation.set_value(test)
+                elif clause.cdr.car is Evaluation._ARROW_SYM:
+                    if clause.cdr.cdr.nullp():
+                        raise SchemeError("no function specified for 'cond'")
+                    evaluation.set_expr(make_list(clause.nth(2), test))
+                else:
+                    yield from self.sequence(evaluation, clause.cdr)
+                return
+            clauses = clauses.cdr
+        evaluation.set_value(UNSPEC)
+
+    def case_form(self, evaluation):
+        expr = evaluation.expr
+        table = expr.analysis
+        if table is None:
+            evaluation.check_form(2)
+            table = cache_analysis(expr, CaseTable(expr.cdr.cdr))
+        expr_seq = table.lookup((yield expr.cdr.car, evaluation.env))
+        if expr_seq is None:
+            evaluation.set_value(UNSPEC)
+        else:
+            yield from self.sequence(evaluation, expr_seq, default = TRUE)
+
+    def begin_form(self, evaluation):
+        evaluation.check_form(2)
+        yield from self.sequence(evaluation, evaluation.expr.cdr)
+
+    def define_form(self, evaluation):
+        evaluation.check_form(3)
+        target = evaluation.expr.nth(1)
+        if not target.symbolp():
+            # Defining a function evaluates nothing.
+            evaluation.do_define_form()
+            return
+        evaluation.check_form(3, 3)
+        env = evaluation.env
+        env.define(target, (yield evaluation.expr.nth(2), env))
+        if target in current_context().optimized_sites:
+            deoptimize(target)
+        evaluation.set_value(UNSPEC)
+
+    def set_bang_form(self, evaluation):
+        evaluation.check_form(3, 3)
+        to_set = evaluation.expr.nth(1)
+        new_value = yield evaluation.expr.nth(2), evaluation.env
+        if not to_set.symbolp():
+            raise SchemeError("first argument is not a symbol!")
+        evaluation.env.find(to_set).define(to_set, new_value)
+        if to_set in current_context().optimized_sites:
+            deoptimize(to_set)
+        evaluation.set_value(UNSPEC)
+
+    def let_form(self, evaluation):
+        expr, env = evaluation.expr, evaluation.env
+        if expr.cdr.pairp() and expr.cdr.car.symbolp():
+            # A named let, whose loop is made by calls of its procedure.
+            loop = _loop_analysis(expr)
+            vals = []
+            for init in loop.inits:
+                vals.append((yield init, env))
+            evaluation.call_named_let(loop, vals)
+            return
+        evaluation.check_form(3)
+        symbols = NULL
+        vals = []
+        for binding in _bindings(expr.cdr.car, 2, 2):
+            symbols = Pair(binding.car, symbols)
+            vals.append((yield binding.cdr.car, env))
+        let_frame = env.make_call_frame(symbols, list(reversed(vals)),
+                                        _let_analysis(expr))
+        yield from self.sequence(evaluation, expr.cdr.cdr, let_frame)
+
+    def let_star_form(self, evaluation):
+        evaluation.check_form(3)
+        expr = evaluation.expr
+        bindings = _bindings(expr.cdr.car, 2, 2)
+        let_frame = evaluation.env.make_call_frame(NULL, [],
+                                                   _let_analysis(expr))
+        for binding in bindings:
+            let_frame.define(binding.car, (yield binding.cdr.car, let_frame))
+        yield from self.sequence(evaluation, expr.cdr.cdr, let_frame)
+
+    def do_form(self, evaluation):
+        loop = _loop_analysis(evaluation.expr)
+        variables = loop.variables
+        env = evaluation.env
+        frame = EnvironFrame(env)
+        if not loop.native:
+            frame.scope = loop.scope
+        vals = []
+        for init in loop.inits:
+            vals.append((yield init, env))
+        while True:
+            inner = frame.inner
+            for k in range(len(vals)):
+                inner[variables[k]] = vals[k]
+            if (yield loop.test, frame):
+                break
+            for command in loop.commands:
+                yield command, frame
+            vals = []
+            for step in loop.steps:
+                vals.append((yield step, frame))
+            if not loop.native:
+                frame = EnvironFrame(env)
+                frame.scope = loop.scope
+        yield from self.sequence(evaluation, loop.results, frame)
+
+    # Handlers of the calls of predefined procedures that call procedures,
+    # which carry out the same steps as the Python functions.
+
+    def apply_primitive(self, evaluation, func, arg0, *other_args):
+        yield from self.apply(func, _apply_args(arg0, other_args), evaluation)
+
+    def map_primitive(self, evaluation, func, lst, *lists):
+        head = last = Pair(NULL, NULL)
+        for args in _operand_tuples((lst,) + lists, "map"):
+            last.cdr = last = Pair((yield from self.call(func, list(args))),
+                                   NULL)
+        evaluation.set_value(head.cdr)
+
+    def for_each_primitive(self, evaluation, func, lst, *lists):
+        for args in _operand_tuples((lst,) + lists, "for-each"):
+            yield from self.call(func, list(args))
+        evaluation.set_value(UNSPEC)
+
+    PRIMITIVES = {
+        scm_apply:    apply_primitive,
+        scm_for_each: for_each_primitive,
+        scm_map:      map_primitive,
+    }
+
+    FORMS = {
+        Evaluation._AND_SYM:      and_form,
+        Evaluation._BEGIN_SYM:    begin_form,
+        Evaluation._CASE_SYM:     case_form,
+        Evaluation._COND_SYM:     cond_form,
+        Evaluation._DEFINE_SYM:   define_form,
+        Evaluation._DO_SYM:       do_form,
+        Evaluation._IF_SYM:       if_form,
+        Evaluation._LET_SYM:      let_form,
+        Evaluation._LET_STAR_SYM: let_star_form,
+        Evaluation._OR_SYM:       or_form,
+        Evaluation._SET_BANG_SYM: set_bang_form,
+    }
+
+class Scheduler:
+    """Runs the Tasks of the Interpreter INTERP in turn, each for QUANTUM
+    steps at a time or until it blocks.  The scheduler is driven by the
+    thread that waits for a task or channel outside any task (see
+    wait_for), or by an asyncio event loop (see join_async); it must be
+    used from one thread."""
+
+    QUANTUM = 1000
+
+    def __init__(self, interp, quantum = None):
+        self.interp = interp
+        self.quantum = quantum or Scheduler.QUANTUM
+        self.ready = deque()
+        self.live = 0
+        # The asyncio task running drive, and the event that wakes it when
+        # a task becomes ready.
+        self.driver = None
+        self.wakeup = None
+
+    def spawn(self, start):
+        """A new Task begun by START (see Task), charged to the budget in
+        effect."""
+        budget = thread_state.budget
+        if isinstance(budget, _Quantum):
+            budget = budget.parent
+        task = Task(self, start, budget)
+        self.live += 1
+        self.make_ready(task)
+        return task
+
+    def make_ready(self, task):
+        """Let TASK run at its next turn."""
+        task.runnable = True
+        self.ready.append(task)
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def run_slice(self):
+        """Run the next ready task until it pauses or finishes.  Returns
+        False if no task is ready."""
+        if not self.ready:
+            return False
+        task = self.ready.popleft()
+        task.run()
+        if task.done:
+            self.live -= 1
+            while task.joiners:
+                self.make_ready(task.joiners.popleft())
+            for future in task.futures:
+                if not future.done():
+                    future.set_result(None)
+        elif task.runnable:
+            self.ready.append(task)
+        return True
+
+    def wait_for(self, condition, what):
+        """Run tasks until CONDITION() is true, raising a SchemeError if no
+        task can run before then.  WHAT names the operation waiting."""
+        while not condition():
+            if not self.run_slice():
+                raise SchemeError("{0}: deadlock (no task can run)"
+                                  .format(what))
+
+    async def join_async(self, task):
+        """The value of TASK once it is done, running the scheduler in the
+        running asyncio event loop meanwhile."""
+        if not task.done:
+            future = asyncio.get_running_loop().create_future()
+            task.futures.append(future)
+            if self.driver is None or self.driver.done():
+                self.driver = asyncio.ensure_future(self.drive())
+            await future
+        return task.result()
+
+    async def drive(self):
+        """Run tasks, letting the event loop run between slices, until no
+        task remains."""
+        self.wakeup = asyncio.Event()
+        try:
+            while self.live:
+                if self.run_slice():
+                    await asyncio.sleep(0)
+                else:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+        finally:
+            self.wakeup = None
+
+def _current_scheduler():
+    """The Scheduler of the current task, or else of the current
+    interpreter (created if necessary)."""
+    if thread_state.task is not None:
+        return thread_state.task.scheduler
+    interp = current_context()
+    if interp.scheduler is None:
+        interp.scheduler = Scheduler(interp)
+    return interp.scheduler
+
+def _wait_until(condition, waiters, what):
+    """Wait until CONDITION() is true: in an operation called directly by a
+    task (see Task.apply), by suspending the task on the deque WAITERS of
+    tasks to be made ready when the condition may have changed, to call the
+    operation again when resumed; elsewhere, by running the scheduler's
+    (other) tasks.  WHAT names the operation waiting."""
+    task = thread_state.task
+    if task is None or not task.direct:
+        _current_scheduler().wait_for(condition, what)
+    elif not condition():
+        task.runnable = False
+        waiters.append(task)
+        raise _Suspended()
+
+def _wake(waiters):
+    """Make the first task in the deque WAITERS ready, if there is one."""
+    if waiters:
+        task = waiters.popleft()
+        task.scheduler.make_ready(task)
+
+class Channel(SchemeValue):
+    """A queue of values passed between tasks, holding at most CAPACITY
+    values at once (any number if None)."""
+
+    def __init__(self, capacity = None):
+        self.capacity = capacity
+        self.items = deque()
+        self.receivers = deque()
+        self.senders = deque()
+
+    def type_name(self):
+        return "channel"
+
+    def write(self, out):
+        print("#[channel]", file=out, end="")
+
+    def send(self, value):
+        """Add VALUE to SELF, first waiting for room if SELF is full."""
+        _wait_until(lambda: self.capacity is None
+                            or len(self.items) < self.capacity,
+                    self.senders, "channel-send")
+        self.items.append(value)
+        _wake(self.receivers)
+
+    def receive(self):
+        """Remove and return the first value in SELF, first waiting for one
+        if SELF is empty."""
+        _wait_until(lambda: self.items, self.receivers, "channel-receive")
+        value = self.items.popleft()
+        _wake(self.senders)
+        return value
+
+def _procedurep(x):
+    return type(x).apply_step is not SchemeValue.apply_step
+
+def _taskp(x):
+    return isinstance(x, Task)
+
+def _channelp(x):
+    return isinstance(x, Channel)
+
+def scm_spawn(thunk):
+    """A new task that calls THUNK, a procedure of no arguments."""
+    check_type(thunk, _procedurep, 0, "spawn")
+    return _current_scheduler().spawn(
+        lambda task, evaluation: task.apply(thunk, [], evaluation))
+
+def scm_yield():
+    """Let the other ready tasks run (for a quantum each) before the
+    caller continues."""
+    task = thread_state.task
+    if task is not None:
+        task.expired = True
+    else:
+        scheduler = _current_scheduler()
+        for _ in range(len(scheduler.ready)):
+            scheduler.run_slice()
+    return UNSPEC
+
+def scm_task_join(task):
+    """The value of TASK once it finishes (raising its error, if any)."""
+    check_type(task, _taskp, 0, "task-join")
+    _wait_until(lambda: task.done, task.joiners, "task-join")
+    return task.result()
+
+def scm_taskp(x):
+    return boolify(_taskp(x))
+
+def scm_make_channel(capacity = None):
+    if capacity is not None:
+        check_type(capacity, scm_integerp, 0, "make-channel")
+        if capacity.num_val < 1:
+            raise SchemeError("make-channel: capacity must be positive")
+        capacity = capacity.num_val
+    return Channel(capacity)
+
+def scm_channel_send(channel, value):
+    check_type(channel, _channelp, 0, "channel-send")
+    channel.send(value)
+    return UNSPEC
+
+def scm_channel_receive(channel):
+    check_type(channel, _channelp, 0, "channel-receive")
+    return channel.receive()
+
+def scm_channelp(x):
+    return boolify(_channelp(x))
+
+# The primitives that may suspend a task that calls them (see Task.apply).
+_BLOCKING = { scm_channel_send, scm_channel_receive, scm_task_join }
+
+##
+## Parallel map
+##
+## pmap and pfor-each apply a function to the elements of a list in the pool
+## of worker processes of the interpreter, which is started when first
+## needed (from a fork server where there is one, since forking a process
+## that may be running other threads is unsafe) and then kept.  Each call
+## sends the workers the function, a share of the elements and the global
+## bindings that these may use (those of the symbols that occur in them,
+## and in the values of those bindings, and so on), and the values and
+## output come back, along with the resources used under the caller's
+## budget.  Values pass between processes in the
+## pickle format extended by _ValuePickler.
+
+# The constants that each process has exactly one of, and the names under
+# which _ValuePickler sends them.
+_CONSTANTS = { "null": NULL, "true": TRUE, "false": FALSE,
+               "unspecified": UNSPEC, "eof": THE_EOF_OBJECT }
+
+def _set_pairs(pair, state):
+    """Make PAIR the first pair of the list whose elements are the Python
+    list ITEMS and whose final cdr is TAIL, where STATE is (ITEMS, TAIL)."""
+    items, tail = state
+    pair.car = items[0]
+    if tail is NULL:
+        pair.cdr = compact_list(items[1:])
+    else:
+        for item in reversed(items[1:]):
+            tail = Pair(item, tail)
+        pair.cdr = tail
+
+class _ValuePickler(pickle.Pickler):
+    """Pickles Scheme values so that _ValueUnpickler reconstructs them in
+    another process: symbols are interned there, constants, primitives,
+    and the global environment are the receiving interpreter's own, and
+    lists are sent as sequences of elements, so that long lists take no
+    Python recursion (though pairs inside a list other than its first are
+    copied, not shared)."""
+
+    def __init__(self, file, symbols = None):
+        pickle.Pickler.__init__(self, file, pickle.HIGHEST_PROTOCOL)
+        self.global_env = current_context().env
+        self.symbols = symbols
+
+    def persistent_id(self, obj):
+        if type(obj) is Symbol:
+            if self.symbols is not None:
+                self.symbols.add(obj)
+            return ("symbol", obj.ident)
+        if obj is self.global_env:
+            return ("global",)
+        if type(obj) is PrimitiveFunction:
+            return ("primitive", _primitive_names()[obj.func])
+        if type(obj) is InlinePrimitive:
+            return ("inline", obj.sym.ident, obj.arity)
+        for name, value in _CONSTANTS.items():
+            if obj is value:
+                return ("constant", name)
+        return None
+
+    def reducer_override(self, obj):
+        if type(obj) is Pair or type(obj) is CompactList:
+            if type(obj) is CompactList and obj.intact():
+                return (Pair, (None, None), (obj.elements(), NULL),
+                        None, None, _set_pairs)
+            items, seen, p = [], set(), obj
+            while p.pairp() and id(p) not in seen:
+                seen.add(id(p))
+                items.append(p.car)
+                p = p.cdr
+            return (Pair, (None, None), (items, p), None, None, _set_pairs)
+        if type(obj) is LambdaFunction:
+            # The Closure analysis is left for the receiver to redo.
+            return (copyreg.__newobj__, (LambdaFunction,),
+                    { "formals": obj.formals, "body": obj.body,
+                      "env": obj.env })
+        if type(obj) is EnvironFrame:
+            return (copyreg.__newobj__, (EnvironFrame,),
+                    { "inner": obj.inner, "enclosing": obj.enclosing })
+        return NotImplemented
+
+class _ValueUnpickler(pickle.Unpickler):
+    """Reconstructs the values pickled by _ValuePickler in the current
+    interpreter."""
+
+    def persistent_load(self, pid):
+        kind = pid[0]
+        if kind == "symbol":
+            return Symbol.string_to_symbol(pid[1])
+        if kind == "global":
+            return current_context().env
+        if kind == "primitive":
+            return PrimitiveFunction(_primitive_functions()[pid[1]])
+        if kind == "inline":
+            sym = Symbol.string_to_symbol(pid[1])
+            return current_context().inline_primitives[sym][pid[2]]
+        return _CONSTANTS[pid[1]]
+
+_primitive_tables = []
+
+def _primitive_names():
+    """The mapping of each Python function implementing a predefined
+    procedure to the procedure's name."""
+    if not _primitive_tables:
+        names = {}
+        for name, func in _PRIMITIVES + VECTOR_PRIMITIVES + FASL_PRIMITIVES:
+            names.setdefault(func, name if type(name) is str else name[0])
+        _primitive_tables.append(names)
+        _primitive_tables.append({ name: func for func, name in names.items() })
+    return _primitive_tables[0]
+
+def _primitive_functions():
+    """The inverse of _primitive_names()."""
+    _primitive_names()
+    return _primitive_tables[1]
+
+def dump_values(value, symbols = None):
+    """VALUE, which may contain any Scheme values (not tasks or channels),
+    as bytes that load_values reconstructs in any interpreter.  The symbols
+    in VALUE are added to the set SYMBOLS, if given."""
+    out = BytesIO()
+    try:
+        _ValuePickler(out, symbols).dump(value)
+    except (pickle.PicklingError, TypeError, AttributeError,
+            RecursionError) as exc:
+        raise SchemeError("cannot send value to another process: {0}"
+                          .format(exc))
+    return out.getvalue()
+
+def load_values(data):
+    """The value encoded as the bytes DATA by dump_values."""
+    return _ValueUnpickler(BytesIO(data)).load()
+
+# The initial global bindings of a pmap worker process, to which those sent
+# with each job are added, or None outside workers.
+_pmap_initial_bindings = None
+
+def _init_pmap_worker():
+    """Prepare a pmap worker process to run jobs in a fresh interpreter."""
+    global _pmap_initial_bindings
+    thread_state.context = interp = Interpreter()
+    _pmap_initial_bindings = dict(interp.env.inner)
+
+def _pmap_chunk(job, bindings, keep, limits):
+    """Run the job in the bytes JOB from dump_values of (FUNC, ITEMS):
+    apply the function FUNC to each of the elements ITEMS, with the global
+    bindings of the caller in the bytes BINDINGS from dump_values of a
+    dictionary, within a Budget of the keyword arguments LIMITS, if not
+    None.  Returns the bytes from dump_values of
+    (VALUES, OUTPUT, ERROR, LIMITED, STATS): the values (if KEEP, else None)
+    or, if one failed, the message ERROR, LIMITED if that was a budget
+    limit, the output produced, and the budget's stats (or None)."""
+    interp = current_context()
+    interp.env.inner.clear()
+    interp.env.inner.update(_pmap_initial_bindings)
+    interp.output = interp.errors = out = StringIO()
+    interp.env.inner.update(load_values(bindings))
+    func, items = load_values(job)
+    budget = contextlib.nullcontext() if limits is None else Budget(**limits)
+    values, error, limited = [], None, False
+    try:
+        with budget:
+            call = _function_caller(func)
+            for x in items:
+                value = call(x)
+                if keep:
+                    values.append(value)
+    except SchemeError as exc:
+        error = exc.args[0] if exc.args and exc.args[0] else "Error"
+        limited = isinstance(exc, BudgetExceeded)
+    except RecursionError:
+        error = "maximum recursion depth exceeded"
+    stats = None if limits is None else budget.stats()
+    try:
+        return dump_values((values if keep else None, out.getvalue(), error,
+                            limited, stats))
+    except SchemeError as exc:
+        return dump_values((None, out.getvalue(), exc.args[0], False, stats))
+
+# The lock held while starting or stopping the pool of an interpreter.
+_pmap_pool_lock = threading.Lock()
+
+def _pmap_pool(interp):
+    """The pool of pmap worker processes of INTERP, started if need be."""
+    with _pmap_pool_lock:
+        if interp.pmap_pool is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+            else:
+                context = None
+            interp.pmap_pool = concurrent.futures.ProcessPoolExecutor(
+                multiprocessing.cpu_count(), mp_context=context,
+                initializer=_init_pmap_worker)
+        return interp.pmap_pool
+
+def _stop_pmap_pool(interp, pool):
+    """Kill the worker processes of POOL, a pool of INTERP, abandoning the
+    calls they are running; INTERP starts a new pool when next needed."""
+    with _pmap_pool_lock:
+        if interp.pmap_pool is pool:
+            interp.pmap_pool = None
+    # ProcessPoolExecutor cannot stop calls that are running, except by
+    # ending the processes running them.
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait = False, cancel_futures = True)
+    for process in processes:
+        process.kill()
+
+def _global_bindings(symbols, env):
+    """The bytes from dump_values of the bindings in the global frame ENV
+    that values containing the symbols SYMBOLS may use: those of SYMBOLS,
+    and those of the symbols in their values, and so on.  (Symbols made at
+    run time, as by string->symbol, are not found.)"""
+    inner = env.inner
+    bindings = {}
+    seen = set()
+    while symbols:
+        seen |= symbols
+        found = { sym: inner[sym] for sym in symbols
+                  if sym in inner
+                  and not isinstance(inner[sym], (Task, Channel)) }
+        bindings.update(found)
+        symbols = set()
+        dump_values(list(found.values()), symbols)
+        symbols -= seen
+    return dump_values(bindings)
+
+def _parallel_apply(func, lst, keep, name):
+    """The Python list of the values of FUNC applied to the elements of the
+    proper list LST (argument 1 of NAME) in the pool of worker processes of
+    the current interpreter, or None if not KEEP.  The workers' output is
+    written to the output port in the order of the elements, the first
+    error in that order is raised, and the workers are limited to (and
+    their resources charged to) the current budget, if any."""
+    items = list(_elements(lst, 1, name))
+    if _pmap_initial_bindings is not None or not items:
+        # Already in a worker, which runs the calls itself.
+        call = _function_caller(func)
+        values = [call(x) for x in items]
+        return values if keep else None
+    interp = current_context()
+    budget = thread_state.budget
+    limits = None if budget is None else budget.remaining()
+    size = -(-len(items) // (4 * multiprocessing.cpu_count()))
+    symbols = set()
+    jobs = [dump_values((func, items[start:start + size]), symbols)
+            for start in range(0, len(items), size)]
+    bindings = _global_bindings(symbols, interp.env)
+    pool = _pmap_pool(interp)
+    futures = [pool.submit(_pmap_chunk, job, bindings, keep, limits)
+               for job in jobs]
+    results = []
+    try:
+        for future in futures:
+            timeout = None
+            if budget is not None and budget.deadline is not None:
+                timeout = max(budget.deadline - time.monotonic(), 0)
+            try:
+                result = future.result(timeout)
+            except concurrent.futures.TimeoutError:
+                raise BudgetExceeded("evaluation timed out", budget)
+            except concurrent.futures.process.BrokenProcessPool:
+                _stop_pmap_pool(interp, pool)
+                raise SchemeError("{0}: a worker process died".format(name))
+            values, output, error, limited, stats = load_values(result)
+            output_port().write(output)
+            if stats is not None:
+                budget.absorb(stats)
+            if error is not None:
+                if limited:
+                    raise BudgetExceeded(error, budget)
+                raise SchemeError(error)
+            if budget is not None:
+                budget.check()
+            if keep:
+                results.extend(values)
+    finally:
+        for future in futures:
+            future.cancel()
+        if not all(future.done() for future in futures):
+            # Rather than leave the calls still running to occupy (perhaps
+            # forever) the workers that later calls need, end them.
+            _stop_pmap_pool(interp, pool)
+    return results if keep else None
+
+def scm_pmap(func, lst):
+    """The list of the values of FUNC applied to the elements of LST, as
+    for map, computed in parallel by processes that each start with a copy
+    of the global bindings that FUNC and LST may use (so side effects of
+    FUNC are not seen by the caller)."""
+    return compact_list(_parallel_apply(func, lst, True, "pmap"))
+
+def scm_pfor_each(func, lst):
+    """Apply FUNC to the elements of LST, as for for-each, in parallel (see
+    scm_pmap), for the sake of its output."""
+    _parallel_apply(func, lst, False, "pfor-each")
+    return UNSPEC
 
 def call_with_input_file(filename, proc):
     """Temporarily set the current input port to the file named by FILENAME,
@@ -605,88 +3400,195 @@ def call_with_input_source(source, proc):
     """Temporarily set the current input port to read lines from the
     SOURCE (an iterator returning lines or a string).  Always restores
     the input port when done."""
-    global input_port
-    input_port0 = input_port
+    interp = current_context()
+    input_port0 = interp.input_port
     try:
-        input_port = Buffer(tokenize_lines(source))
+        interp.input_port = Buffer(tokenize_lines(source))
         proc()
     finally:
-        input_port = input_port0
-    
-def read_eval_print(prompt = None):
+        interp.input_port = input_port0
+
+def read_eval_print(prompt = None, print_values = None):
     """Read and evaluate from the current input port until the end of file.
-    If PROMPT is not None, use it to prompt for input and print values of
-    each expression."""
+    If PROMPT is not None, use it to prompt for input.  Print the value of
+    each expression if PRINT_VALUES, which defaults to whether there is a
+    PROMPT.  Output is flushed only before prompting.  Errors are counted
+    in the current interpreter's error_count, and end the program if its
+    exit_on_error is set."""
+    interp = current_context()
+    if print_values is None:
+        print_values = prompt is not None
     gen_string = isinstance(prompt, GeneratorType)
     while True:
         try:
-            if gen_string:
-                print(next(prompt), end = " ")
-            elif prompt is not None:
-                print(prompt, end = "")
-            sys.stdout.flush()
+            if prompt is not None:
+                out = output_port()
+                if gen_string:
+                    print(next(prompt), end = " ", file=out)
+                else:
+                    print(prompt, end = "", file=out)
+                out.flush()
+                flush_drawing()
             expr = scm_read()  # Get the expression as objects
             if expr is THE_EOF_OBJECT:
                 return
             val = scm_eval(expr)   
-            if prompt is not None and val is not UNSPEC:
+            if print_values and val is not UNSPEC:
                 scm_write(val)
                 scm_newline()
-        except SchemeError as exc:
-            if not exc.args[0]:
-                print("Error", file=sys.stderr)
+        except BudgetExceeded:
+            # Nothing more can be evaluated under the exhausted budget.
+            raise
+        except (SchemeError, RecursionError) as exc:
+            if isinstance(exc, RecursionError):
+                message = "maximum recursion depth exceeded"
             else:
-                print("Error: {0}".format(exc.args[0]), file=sys.stderr)
-            sys.stderr.flush()
-
-def scm_read():
-    def read_tail():
-        """Assuming that input is positioned inside a Scheme list or pair,
-        immediately before a final parenthesis or another item in the list,
-        return the remainder of the list from that point.  Thus, returns
-        (2 3) when positioned at the carat in "(1 ^ 2 3)", returns
-        () when positioned at the carat in "(1 2 3 ^ )", and returns
-        the pair (2 . 3) when positioned at the carat in (1 ^ 2 . 3)."""
-        if input_port.current is None:
-            raise SchemeError("unexpected EOF")
-        syntax, val = input_port.current
-        if syntax == ")":
-            input_port.pop()
-            return NULL
-        elif syntax == ".":
-            input_port.pop()
-            # to recognize malformed pairs
-            rest = read_tail()
-            if rest.nullp() or not rest.cdr.nullp():
-                raise SchemeError("malformed pair")
+                message = exc.args[0] if exc.args else None
+            output_port().flush()
+            errors = error_port()
+            if not message:
+                print("Error", file=errors)
             else:
-                return rest.car
-        else:
-            return Pair(scm_read(), read_tail())
+                print("Error: {0}".format(message), file=errors)
+            errors.flush()
+            interp.error_count += 1
+            if interp.exit_on_error:
+                sys.exit(1)
+
+class _ListReader:
+    """A list being read by scm_read: the items read so far, whether the
+    list is the part of an enclosing list that follows a ".", which must
+    consist of exactly one item (the final cdr of the enclosing list), and
+    whether the list is inside a quotation (and so is data, not code)."""
+
+    def __init__(self, is_tail, quoted):
+        self.items = []
+        self.is_tail = is_tail
+        self.quoted = quoted
+
+    def value(self, tail = NULL):
+        """The list of SELF's items, ending in TAIL.  Quoted proper lists
+        are built compactly."""
+        if self.quoted and tail is NULL:
+            return compact_list(self.items)
+        result = tail
+        items = self.items
+        for k in range(len(items) - 1, -1, -1):
+            result = Pair(items[k], result)
+        return result
 
+def scm_read():
+    """The next datum from the current input port (THE_EOF_OBJECT at the end
+    of input).  Lists are read iteratively, so that neither their length nor
+    their depth is limited by the Python stack."""
+    input_port = current_context().input_port
     if input_port.current is None:
         return THE_EOF_OBJECT
 
-    syntax, val = input_port.pop()
-
-    if syntax == NUMERAL:
-        return Number(val)
-    elif syntax == BOOLEAN:
-        return boolify(val)
-    elif syntax == SYMBOL:
-        return Symbol.string_to_symbol(val)
-    elif syntax == "'":
-        return make_list(Evaluation._QUOTE_SYM, scm_read())
-    elif syntax == "(":
-        return read_tail()
-    else:
-        raise SchemeError("unexpected token: {0}".format(repr(val)))
+    # The lists being read (_ListReaders) and the quotations waiting for
+    # their datum (None), innermost last.
+    pending = []
+    while True:
+        if pending and input_port.current is None:
+            raise SchemeError("unexpected EOF")
+        syntax, val = input_port.pop()
+        inside_list = pending and pending[-1] is not None
+        quoted = bool(pending) and (pending[-1] is None or pending[-1].quoted)
+
+        if syntax == NUMERAL:
+            datum = Number(val)
+        elif syntax == BOOLEAN:
+            datum = boolify(val)
+        elif syntax == SYMBOL:
+            datum = val
+        elif syntax == "'":
+            pending.append(None)
+            continue
+        elif syntax == "(":
+            pending.append(_ListReader(False, quoted))
+            continue
+        elif syntax == "." and inside_list:
+            pending.append(_ListReader(True, quoted))
+            continue
+        elif syntax == ")" and inside_list:
+            reader = pending.pop()
+            datum = reader.value()
+            while reader.is_tail:
+                # to recognize malformed pairs
+                if datum.nullp() or not datum.cdr.nullp():
+                    raise SchemeError("malformed pair")
+                reader = pending.pop()
+                datum = reader.value(datum.car)
+        else:
+            raise SchemeError("unexpected token: {0}".format(repr(val)))
+
+        while pending and pending[-1] is None:
+            pending.pop()
+            datum = make_list(Evaluation._QUOTE_SYM, datum)
+        if not pending:
+            return datum
+        pending[-1].items.append(datum)
 
 def scm_load(sym):
     check_type(sym, scm_symbolp, 0, "load")
     call_with_input_file(str(sym), read_eval_print)
     return UNSPEC
 
+def eval_source(source, env = None, timeout = None, budget = None):
+    """Read and evaluate the Scheme expressions in the string SOURCE in
+    environment ENV (the global environment by default), stopping at the
+    first error, after TIMEOUT seconds, or when BUDGET (a Budget, by default
+    one with no limits other than TIMEOUT) is exceeded.  Returns a
+    dictionary giving everything printed ("output"), the written
+    representation of each value other than the unspecified value
+    ("values"), the last of these ("value", or None), the error message
+    ("error", or None), the time taken in seconds ("time"), and the
+    statistics of the budget ("stats", as for Budget.stats)."""
+    interp = current_context()
+    if env is None:
+        env = interp.env
+    if budget is None:
+        budget = Budget(seconds = timeout)
+    out = StringIO()
+    values = []
+
+    def read_eval():
+        while True:
+            expr = scm_read()
+            if expr is THE_EOF_OBJECT:
+                return
+            val = Evaluation(optimize(expr, env), env).step_to_value()
+            if val is not UNSPEC:
+                text = StringIO()
+                val.write(text)
+                values.append(text.getvalue())
+
+    result = { "output": None, "values": values, "value": None,
+               "error": None, "time": None }
+    start = time.perf_counter()
+    output, errors = interp.output, interp.errors
+    interp.output = interp.errors = out
+    try:
+        with budget:
+            call_with_input_source(source.splitlines(), read_eval)
+    except SchemeError as exc:
+        result["error"] = exc.args[0] if exc.args and exc.args[0] else "Error"
+    except RecursionError:
+        result["error"] = "maximum recursion depth exceeded"
+    except SystemExit:
+        result["error"] = "exit"
+        result["exit"] = True
+    except Exception as exc:
+        result["error"] = "internal error: {0!r}".format(exc)
+    finally:
+        interp.output, interp.errors = output, errors
+    result["time"] = time.perf_counter() - start
+    result["output"] = out.getvalue()
+    result["stats"] = budget.stats()
+    if values:
+        result["value"] = values[-1]
+    return result
+
 ##
 ## Initialization
 ##
@@ -704,6 +3606,7 @@ _PRIMITIVES = (
     ("car", scm_car),
     ("cdr", scm_cdr),
     ("length", scm_length),
+    ("list-ref", scm_list_ref),
     ("set-car!", scm_set_car),
     ("set-cdr!", scm_set_cdr),
     ("list", scm_list),
@@ -718,7 +3621,10 @@ _PRIMITIVES = (
     ("modulo", scm_modulo),
     ("remainder", scm_remainder),
     ("floor", scm_floor),
-    ("ceil", scm_ceil),
+    (["ceil", "ceiling"], scm_ceil),
+    ("exact->inexact", scm_exact_to_inexact),
+    ("expt", scm_expt),
+    ("sqrt", scm_sqrt),
     ("<", scm_lt),
     (">", scm_gt),
     ("=", scm_eq),
@@ -738,6 +3644,40 @@ _PRIMITIVES = (
     ("eval", scm_eval),
     ("apply", scm_apply),
 
+    ("map", scm_map),
+    ("for-each", scm_for_each),
+    ("filter", scm_filter),
+    ("fold", scm_fold),
+    ("fold-right", scm_fold_right),
+    ("reduce", scm_reduce),
+
+    ("force", scm_force),
+    ("make-promise", scm_make_promise),
+    ("promise?", scm_promisep),
+    ("stream-car", scm_stream_car),
+    ("stream-cdr", scm_stream_cdr),
+    ("stream-null?", scm_nullp),
+    ("stream-map", scm_stream_map),
+    ("stream-filter", scm_stream_filter),
+    ("stream-take", scm_stream_take),
+    ("stream->list", scm_stream_to_list),
+
+    ("memoize", scm_memoize),
+    ("memo-stats", scm_memo_stats),
+    ("memo-clear!", scm_memo_clear),
+
+    ("pmap", scm_pmap),
+    ("pfor-each", scm_pfor_each),
+
+    ("spawn", scm_spawn),
+    ("yield", scm_yield),
+    ("task-join", scm_task_join),
+    ("task?", scm_taskp),
+    ("make-channel", scm_make_channel),
+    ("channel-send", scm_channel_send),
+    ("channel-receive", scm_channel_receive),
+    ("channel?", scm_channelp),
+
     ("error", scm_error),
     (["exit", "bye"], scm_exit),
 
@@ -765,6 +3705,7 @@ _PRIMITIVES = (
     ('end_fill', tscm_end_fill),
     ('exitonclick', tscm_exitonclick),
     ('speed', tscm_speed),
+    ('save-drawing', tscm_save_drawing),
 )
 
 def define_primitives(frame, bindings):
@@ -774,19 +3715,184 @@ def define_primitives(frame, bindings):
         if type(names) is str:
             names = (names,)
         for name in names:
-            frame.define(Symbol.string_to_symbol(name),
+            frame.define(Symbol.pin(name),
                          PrimitiveFunction(func))
 
 def create_global_environment():
-    """Initialize the_global_environment to a fresh environment defining the
+    """Give the current interpreter a fresh global environment defining the
     predefined names."""
-    global the_global_environment
-
-    the_global_environment = EnvironFrame(None)
+    interp = current_context()
+    interp.env = EnvironFrame(None)
+    interp.optimized_sites = {}
+    interp.initial_globals = {}
     
     # Uncomment the following line after you finish with Problem 4.
     scm_load(Symbol.string_to_symbol(SCHEME_PRELUDE_FILE))
-    define_primitives(the_global_environment, _PRIMITIVES)
+    define_primitives(interp.env, _PRIMITIVES)
+    define_primitives(interp.env, VECTOR_PRIMITIVES)
+    define_primitives(interp.env, FASL_PRIMITIVES)
+    _find_pure_functions(interp)
+
+class Interpreter(Context):
+    """A Scheme interpreter with its own global environment ENV, input port
+    INPUT_PORT, and files OUTPUT and ERRORS to which its output and error
+    messages go (sys.stdout and sys.stderr if None).  Any number of
+    interpreters may exist in one process, each used by one thread at a
+    time, but several at once in different threads.
+
+    The module-level functions (scm_eval, eval_source, read_eval_print,
+    create_global_environment, ...) act on the current interpreter of the
+    calling thread (current_context()), which is the one most recently
+    entered with a with statement in that thread, or else the default
+    interpreter.  The methods
+    below enter SELF themselves.  Unless INITIALIZE is false, SELF starts
+    with a fresh global environment."""
+
+    def __init__(self, output = None, errors = None, initialize = True):
+        self.output = output
+        self.errors = errors
+        self.env = None
+        self.input_port = None
+        # The number of errors reported by read_eval_print, and whether the
+        # first of them should end the program (with exit status 1).
+        self.error_count = 0
+        self.exit_on_error = False
+        # Maps each symbol in _PURE_NAMES whose initial global value is pure
+        # to the set of symbols (including itself) that must keep their
+        # initial values for it to remain pure.
+        self.pure_functions = {}
+        # Maps symbols to dictionaries from numbers of operands to the
+        # InlinePrimitive operators that replace calls on the symbol's
+        # initial global value.
+        self.inline_primitives = {}
+        # The initial global values of the symbols in pure_functions and
+        # inline_primitives.
+        self.initial_globals = {}
+        # Maps symbols to WeakKeyDictionaries.  The keys of the dictionary
+        # for symbol S are the Pairs created by optimize on the assumption
+        # that S keeps its initial global value, and the values are the
+        # Pairs they replaced.
+        self.optimized_sites = {}
+        # The Scheduler of SELF's tasks, created when first needed.
+        self.scheduler = None
+        # The ProcessPoolExecutor of SELF's pmap workers, created when first
+        # needed.
+        self.pmap_pool = None
+        # The interpreters that SELF replaced as current when entered.
+        self._outer = []
+        if initialize:
+            with self:
+                create_global_environment()
+
+    def __enter__(self):
+        self._outer.append(thread_state.context)
+        thread_state.context = self
+        return self
+
+    def __exit__(self, *exc_info):
+        thread_state.context = self._outer.pop()
+
+    def eval(self, expr):
+        """The value of the Scheme expression EXPR in SELF's global
+        environment."""
+        with self:
+            return scm_eval(expr)
+
+    def eval_source(self, source, timeout = None, budget = None):
+        """The result of eval_source on SOURCE in SELF's global
+        environment."""
+        with self:
+            return eval_source(source, None, timeout, budget)
+
+    def load(self, filename):
+        """Read and evaluate the Scheme source in the file FILENAME."""
+        with self:
+            scm_load(Symbol.string_to_symbol(filename))
+
+    async def eval_async(self, expr):
+        """The value of the Scheme expression EXPR (or of the last of the
+        expressions in the string EXPR) in SELF's global environment,
+        evaluated as a task of SELF's scheduler, which runs in the running
+        asyncio event loop, interleaved with SELF's other tasks."""
+        with self:
+            if isinstance(expr, str):
+                exprs = []
+                def read_all():
+                    while True:
+                        datum = scm_read()
+                        if datum is THE_EOF_OBJECT:
+                            return
+                        exprs.append(datum)
+                call_with_input_source(expr.splitlines(), read_all)
+            else:
+                exprs = [expr]
+            scheduler = _current_scheduler()
+            task = scheduler.spawn(lambda task, evaluation:
+                                   task.eval_sequence(evaluation, exprs))
+        return await scheduler.join_async(task)
+
+scheme_primitives.default_context = Interpreter(initialize = False)
+
+##
+## Batch evaluation
+##
+
+# Bindings of the initial global environment in a batch worker process,
+# restored before each program it runs.
+_initial_bindings = None
+
+def _init_batch_worker():
+    """Prepare a batch worker process, initializing the global environment
+    unless it was inherited (by forking) from the parent."""
+    global _initial_bindings
+    env = current_context().env
+    if env is None:
+        create_global_environment()
+        env = current_context().env
+    _initial_bindings = dict(env.inner)
+
+def _batch_worker_eval(source, timeout, limits):
+    """Evaluate SOURCE with eval_source in a fresh copy of the initial
+    global environment."""
+    env = current_context().env
+    env.inner.clear()
+    env.inner.update(_initial_bindings)
+    return eval_source(source, budget = Budget(seconds = timeout, **limits))
+
+def batch_eval(sources, workers = None, timeout = None, limits = None):
+    """Evaluate each of the Scheme programs (strings) in the iterable SOURCES
+    with eval_source, each in a fresh copy of the initial global environment,
+    using a pool of WORKERS processes (by default, one per CPU).  Generates
+    pairs (k, result) as the programs complete, where K is the index of the
+    program in SOURCES and RESULT is as for eval_source.  Each program is
+    limited to TIMEOUT seconds, if not None, and to the other limits of
+    Budget given by the keyword arguments in the dictionary LIMITS."""
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = None
+    workers = workers or multiprocessing.cpu_count()
+    limits = limits or {}
+    sources = enumerate(sources)
+    # Keep a bounded number of programs in flight, so that SOURCES may be
+    # arbitrarily long (or generated lazily).
+    pending = {}
+    with concurrent.futures.ProcessPoolExecutor(
+            workers, mp_context=context,
+            initializer=_init_batch_worker) as pool:
+        while True:
+            for k, source in sources:
+                future = pool.submit(_batch_worker_eval, source, timeout,
+                                     limits)
+                pending[future] = k
+                if len(pending) >= 4 * workers:
+                    break
+            if not pending:
+                return
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
 
 def gen_prompt_string():
     with open(PROMPT_FILE) as prompt_file:
@@ -794,24 +3900,118 @@ def gen_prompt_string():
     while True:
         yield choice(prompt_strings)
 
-input_port = None
+
+def save_drawing(filename):
+    """Save the turtle drawing in the file FILENAME, reporting any error."""
+    try:
+        tscm_save_drawing(Symbol.string_to_symbol(filename))
+    except SchemeError as exc:
+        print("Error: {0}".format(exc.args[0]), file=sys.stderr)
 
 @main
 def run(*argv):
-    global input_port
 
-    if argv:
+    parser = argparse.ArgumentParser(prog="scheme.py",
+                                     description="A Scheme interpreter.")
+    parser.add_argument("file", nargs="?", help="Scheme source to run")
+    parser.add_argument("--file", dest="file_option", metavar="FILE",
+                        help="Scheme source to run (as for FILE)")
+    parser.add_argument("-c", dest="command", metavar="EXPR",
+                        help="evaluate the expressions in EXPR")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="do not print the values of expressions")
+    parser.add_argument("--on-error", choices=("continue", "exit"),
+                        default="continue",
+                        help="after an error in batch mode, continue and exit "
+                             "with status 1 at the end (the default), or exit "
+                             "with status 1 at once")
+    parser.add_argument("--turtle", choices=("tk", "headless"),
+                        help="draw turtle graphics in a Tk window, or record "
+                             "them without a display (by default, whichever "
+                             "suits the display)")
+    parser.add_argument("--turtle-output", metavar="FILE",
+                        help="save the turtle drawing in FILE (SVG, or "
+                             "PostScript if FILE ends in .ps or .eps) at exit; "
+                             "implies --turtle headless unless --turtle is "
+                             "given")
+    parser.add_argument("--serve", metavar="SOCKET",
+                        help="serve evaluation requests on SOCKET (a Unix "
+                             "socket path, PORT, or HOST:PORT)")
+    parser.add_argument("--max-clients", type=int, default=64,
+                        help="number of clients served at once")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="seconds allowed for the program (or for each "
+                             "served request)")
+    parser.add_argument("--max-steps", type=int, default=None,
+                        help="evaluation steps allowed for the program (or "
+                             "for each served request)")
+    parser.add_argument("--max-depth", type=int, default=None,
+                        help="deepest nesting of evaluations allowed")
+    parser.add_argument("--max-conses", type=int, default=None,
+                        help="pairs the program (or each served request) "
+                             "may allocate")
+    args = parser.parse_args(argv)
+    limits = { "steps": args.max_steps, "depth": args.max_depth,
+               "conses": args.max_conses }
+
+    if args.serve is not None:
+        import scheme_server
+        try:
+            scheme_server.serve(args.serve, args.timeout, args.max_clients,
+                                limits)
+        except ValueError as exc:
+            parser.error(str(exc))
+        return
+
+    filename = args.file_option or args.file
+    if args.file is not None and args.file_option is not None:
+        parser.error("give FILE or --file, not both")
+    if filename is not None and args.command is not None:
+        parser.error("give a file or -c, not both")
+
+    if args.command is not None:
+        input_file = args.command.splitlines()
+    elif filename is not None:
         try:
-            input_file = open(argv[0])
+            input_file = open(filename)
         except IOError as exc:
-            print("could not open {0}: {1}".format(argv[0], exc.args[0]),
+            print("could not open {0}: {1}".format(filename, exc.args[0]),
                   file=sys.stderr)
             sys.exit(1)
     else:
         input_file = sys.stdin
-        
-    input_port = Buffer(tokenize_lines(input_file))
+
+    if args.turtle is not None or args.turtle_output is not None:
+        set_turtle_backend(args.turtle or "headless")
+    if args.turtle_output is not None:
+        atexit.register(save_drawing, args.turtle_output)
+
+    interp = current_context()
     create_global_environment()
-    # Change to customize prompt string
-    read_eval_print(gen_prompt_string())
+    interp.input_port = Buffer(tokenize_lines(input_file))
+    if args.timeout is None and all(v is None for v in limits.values()):
+        budget = contextlib.nullcontext()
+    else:
+        budget = Budget(seconds = args.timeout, **limits)
+    try:
+        with budget:
+            if input_file is sys.stdin and sys.stdin.isatty():
+                # Change to customize prompt string
+                read_eval_print(gen_prompt_string(), not args.quiet)
+                return
 
+            # Batch mode: no prompts, and standard output is flushed only
+            # when needed to keep it in order with error messages, or at
+            # exit.
+            interp.exit_on_error = args.on_error == "exit"
+            if hasattr(sys.stdout, "reconfigure"):
+                sys.stdout.reconfigure(line_buffering=False)
+            read_eval_print(print_values = not args.quiet)
+    except BudgetExceeded as exc:
+        sys.stdout.flush()
+        print("Error: {0} ({steps} steps, depth {depth}, {conses} pairs, "
+              "{time:.3f} s)".format(exc.args[0], **budget.stats()),
+              file=sys.stderr)
+        sys.exit(3)
+    if interp.error_count:
+        sys.exit(1)
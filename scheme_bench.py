@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+
+"""Benchmarks for the Scheme interpreter.
+
+Usage: python3 scheme_bench.py [NAME ...]
+
+Runs the benchmarks named NAME (by default, all of them).  Each benchmark
+times an operation at a series of sizes and prints the time per element, so
+that an operation that scales linearly shows a roughly constant time per
+element.
+"""
+
+import sys
+import time
+import tracemalloc
+from ucb import main
+from scheme_primitives import *
+import scheme
+import scheme_fasl
+
+# Sizes at which the scaling benchmarks are run.
+SIZES = (10**4, 10**5, 10**6)
+
+# Maps the name of each benchmark to the function that runs it.
+BENCHMARKS = {}
+
+def benchmark(fn):
+    """Register FN as the benchmark named after it."""
+    BENCHMARKS[fn.__name__] = fn
+    return fn
+
+def timed(thunk):
+    """The time taken in seconds to call THUNK, and its value."""
+    start = time.perf_counter()
+    value = thunk()
+    return time.perf_counter() - start, value
+
+def report_scaling(name, run, sizes = SIZES):
+    """Print the time taken by RUN(N), which should return a function of no
+    arguments to be timed, for each N in SIZES."""
+    for n in sizes:
+        thunk = run(n)
+        seconds, _ = timed(thunk)
+        print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} ns/element"
+              .format(name, n, seconds, seconds / n * 1e9))
+
+def scheme_eval(source):
+    """The value of the last expression in the Scheme source string SOURCE,
+    evaluated in the global environment (created if necessary)."""
+    interp = scheme.current_context()
+    if interp.env is None:
+        scheme.create_global_environment()
+    interp.input_port = scheme.Buffer(scheme.tokenize_lines([source]))
+    value = UNSPEC
+    while True:
+        expr = scheme.scm_read()
+        if expr is THE_EOF_OBJECT:
+            return value
+        value = scheme.scm_eval(expr)
+
+def _words(n):
+    """A Scheme list of N symbols."""
+    sym = Symbol.string_to_symbol("word")
+    return make_list(*([sym] * n))
+
+@benchmark
+def sentence():
+    """sentence on two lists and a word, of N elements in all."""
+    word = Symbol.string_to_symbol("and")
+    def run(n):
+        half = _words(n // 2)
+        return lambda: sscm_sentence(half, word, half)
+    report_scaling("sentence", run)
+
+@benchmark
+def append():
+    """append on ten lists of N elements in all."""
+    def run(n):
+        parts = [_words(n // 10) for _ in range(10)]
+        return lambda: scm_append(*parts)
+    report_scaling("append", run)
+
+@benchmark
+def word():
+    """word on N one-letter symbols."""
+    def run(n):
+        letters = [Symbol.string_to_symbol("a")] * n
+        return lambda: sscm_word(*letters)
+    report_scaling("word", run)
+
+@benchmark
+def butlast():
+    """butlast and last on a list of N elements."""
+    def run(n):
+        words = _words(n)
+        return lambda: (sscm_butlast(words), sscm_last(words))
+    report_scaling("butlast", run)
+
+@benchmark
+def case():
+    """10,000 evaluations of a case form with N single-datum clauses,
+    selecting the last clause.  Dispatch takes constant time, so the time
+    per evaluation should not grow with N."""
+    repetitions = 10000
+    for n in (10, 100, 1000):
+        clauses = " ".join("(({0}) {0})".format(k) for k in range(n))
+        scheme_eval("(define (dispatch k) (case k {0} (else #f)))"
+                    .format(clauses))
+        scheme_eval("""(define (loop i) (if (= i 0) 'done
+                                            (begin (dispatch {0})
+                                                   (loop (- i 1)))))"""
+                    .format(n - 1))
+        seconds, _ = timed(lambda: scheme_eval("(loop {0})"
+                                               .format(repetitions)))
+        print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} ns/evaluation"
+              .format("case", n, seconds, seconds / repetitions * 1e9))
+
+@benchmark
+def loops():
+    """A summing loop of N iterations, written as a named let, a do loop,
+    and a recursive procedure."""
+    scheme_eval("""(define (named-let-sum n)
+                     (let loop ((i 0) (acc 0))
+                       (if (= i n) acc (loop (+ i 1) (+ acc i)))))""")
+    scheme_eval("""(define (do-sum n)
+                     (do ((i 0 (+ i 1)) (acc 0 (+ acc i))) ((= i n) acc)))""")
+    scheme_eval("""(define (recursive-sum n)
+                     (define (loop i acc)
+                       (if (= i n) acc (loop (+ i 1) (+ acc i))))
+                     (loop 0 0))""")
+    for name in ("named-let-sum", "do-sum", "recursive-sum"):
+        report_scaling(name, lambda n: lambda: scheme_eval(
+                           "({0} {1})".format(name, n)),
+                       (10**4, 10**5))
+
+@benchmark
+def mapping():
+    """map of a primitive and of a lambda over a list of N numbers, natively
+    and with a map written in Scheme."""
+    scheme_eval("""(define (scheme-map f L)
+                     (define (helper sofar L)
+                       (if (null? L) (reverse sofar)
+                           (helper (cons (f (car L)) sofar) (cdr L))))
+                     (helper '() L))""")
+    scheme_eval("(define (numbers n) (do ((i n (- i 1)) (L '() (cons i L))) "
+                "((= i 0) L)))")
+    scheme_eval("(define L (numbers {0}))".format(10**5))
+    for mapper in ("map", "scheme-map"):
+        for kind, func in (("primitive", "-"),
+                           ("lambda", "(lambda (x) (* x x))")):
+            report_scaling("{0}/{1}".format(mapper, kind),
+                           lambda n: lambda: scheme_eval(
+                               "({0} {1} L)".format(mapper, func)),
+                           (10**5,))
+
+@benchmark
+def compact():
+    """Memory used by a quoted list of N symbols, stored compactly and as
+    ordinary pairs, before and after it is traversed."""
+    for n in SIZES:
+        source = "'({0})".format(" ".join(["word"] * n))
+        for kind, build in (("compact", lambda: scheme_eval(source)),
+                            ("pairs", lambda: _words(n))):
+            tracemalloc.start()
+            lst = build()
+            built, _ = tracemalloc.get_traced_memory()
+            lst.length() if kind == "pairs" else Pair.length(lst)
+            walked, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print("{0:<12} n={1:<9} {2:8.1f} bytes/element built, "
+                  "{3:8.1f} traversed".format(kind, n, built / n, walked / n))
+            del lst
+
+@benchmark
+def arith():
+    """N direct calls of the arithmetic and comparison primitives on two
+    operands and on three, and a loop of N iterations whose body calls
+    them through the interpreter."""
+    x, y, z = Number(3), Number(4), Number(5)
+    n = 10**6
+    for name, func in (("+", scm_add), ("-", scm_sub), ("*", scm_mul),
+                       ("<", scm_lt), ("=", scm_eq)):
+        for args in ((x, y), (x, y, z)) if name in "+-*" else ((x, y),):
+            seconds, _ = timed(lambda: [func(*args) for _ in range(n)])
+            print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} ns/call"
+                  .format("({0} {1})".format(name, " ".join(map(str, args))),
+                          n, seconds, seconds / n * 1e9))
+    scheme_eval("""(define (arith-loop n)
+                     (define (loop i acc)
+                       (if (< i n) (loop (+ i 1) (- (* acc 3) (* i 2)))
+                           (= acc acc)))
+                     (loop 0 0))""")
+    report_scaling("arith-loop", lambda n: lambda: scheme_eval(
+                       "(arith-loop {0})".format(n)), (10**5,))
+
+@benchmark
+def symbols():
+    """Generation of N distinct symbols with word, reporting the number of
+    entries left in the symbol table afterwards."""
+    scheme_eval("""(define (make-symbols n)
+                     (if (> n 0)
+                         (begin (word 'sym n) (make-symbols (- n 1)))))""")
+    for n in SIZES[:2]:
+        before = len(Symbol.symbols)
+        seconds, _ = timed(lambda: scheme_eval("(make-symbols {0})".format(n)))
+        print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} ns/symbol, "
+              "{4} symbols added".format("symbols", n, seconds,
+                                         seconds / n * 1e9,
+                                         len(Symbol.symbols) - before))
+
+@benchmark
+def vectors():
+    """Summing and elementwise addition of N numbers, in an f64vector with
+    the vector primitives and in a list with apply and map (skipped if NumPy
+    is missing)."""
+    if not scheme.VECTOR_PRIMITIVES:
+        print("vectors: NumPy is not installed")
+        return
+    scheme_eval("(define (numbers n) (do ((i n (- i 1)) (L '() (cons i L))) "
+                "((= i 0) L)))")
+    for n in SIZES[:2]:
+        scheme_eval("(define L (numbers {0}))".format(n))
+        scheme_eval("(define V (list->f64vector L))")
+        for name, source in (("vector-sum", "(vector-sum V)"),
+                             ("list-sum", "(apply + L)"),
+                             ("vector+", "(vector+ V V)"),
+                             ("list+", "(map + L L)")):
+            seconds, _ = timed(lambda: scheme_eval(source))
+            print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} ns/element"
+                  .format(name, n, seconds, seconds / n * 1e9))
+
+@benchmark
+def budget():
+    """A loop of N iterations run without a budget and under one with every
+    limit set (but not reached)."""
+    scheme_eval("""(define (budget-loop n)
+                     (define (loop i acc)
+                       (if (= i n) acc (loop (+ i 1) (cons i acc))))
+                     (length (loop 0 '())))""")
+    for n in SIZES[:2]:
+        seconds, _ = timed(lambda: scheme_eval("(budget-loop {0})".format(n)))
+        print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} ns/iteration"
+              .format("unlimited", n, seconds, seconds / n * 1e9))
+        with scheme.Budget(steps=10**9, seconds=3600, depth=10**4,
+                           conses=10**9) as limits:
+            seconds, _ = timed(lambda: scheme_eval("(budget-loop {0})"
+                                                   .format(n)))
+        print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} ns/iteration, "
+              "{4[steps]} steps, {4[conses]} pairs"
+              .format("budgeted", n, seconds, seconds / n * 1e9,
+                      limits.stats()))
+
+@benchmark
+def interpreters():
+    """N programs, each run in a fresh Interpreter, on one thread and on a
+    pool of four threads."""
+    from concurrent.futures import ThreadPoolExecutor
+    source = """(define (loop i acc) (if (= i 0) acc (loop (- i 1) (+ acc i))))
+                (loop 1000 0)"""
+    def run_one(_):
+        return scheme.Interpreter().eval_source(source)["value"]
+    n = 100
+    for threads in (1, 4):
+        with ThreadPoolExecutor(threads) as pool:
+            seconds, values = timed(lambda: list(pool.map(run_one, range(n))))
+        assert values == ["500500"] * n
+        print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} us/program"
+              .format("threads={0}".format(threads), n, seconds,
+                      seconds / n * 1e6))
+
+@benchmark
+def turtle():
+    """A drawing of N segments made with the headless turtle backend, and
+    its rendering to SVG and PostScript."""
+    set_turtle_backend("headless")
+    scheme_eval("""(define (spiral n)
+                     (if (> n 0) (begin (fd n) (rt 91) (spiral (- n 1)))))""")
+    for n in SIZES[:2]:
+        seconds, _ = timed(lambda: scheme_eval("(spiral {0})".format(n)))
+        print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} ns/segment"
+              .format("draw", n, seconds, seconds / n * 1e9))
+        recorder = scheme.current_context().turtle
+        for name, render in (("svg", recorder.svg),
+                             ("postscript", recorder.postscript)):
+            seconds, text = timed(render)
+            print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} ns/segment, "
+                  "{4} bytes".format(name, n, seconds, seconds / n * 1e9,
+                                     len(text)))
+        scheme_eval("(clear)")
+    set_turtle_backend()
+
+@benchmark
+def tasks():
+    """N messages passed along a ring of tasks connected by channels, and
+    N steps of tasks that only compute, switched every quantum."""
+    scheme_eval("""(define (ring size n)
+                     (define first (make-channel))
+                     (define (relay in k)
+                       (if (= k 0)
+                           in
+                           (let ((out (make-channel)))
+                             (spawn (lambda ()
+                                      (define (loop)
+                                        (channel-send out
+                                                      (+ (channel-receive in) 1))
+                                        (loop))
+                                      (loop)))
+                             (relay out (- k 1)))))
+                     (define last (relay first size))
+                     (define (pump i total)
+                       (if (= i n)
+                           total
+                           (begin (channel-send first 0)
+                                  (pump (+ i 1)
+                                        (+ total (channel-receive last))))))
+                     (pump 0 0))
+                   (define (spin n)
+                     (define (loop i) (if (< i n) (loop (+ i 1)) i))
+                     (loop 0))
+                   (define (spinners k n)
+                     (define (start k)
+                       (if (= k 0)
+                           '()
+                           (cons (spawn (lambda () (spin n))) (start (- k 1)))))
+                     (map task-join (start k)))""")
+    for n in SIZES[:2]:
+        n //= 10
+        seconds, _ = timed(lambda: scheme_eval("(ring 10 {0})".format(n)))
+        print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} us/message"
+              .format("ring", n, seconds, seconds / n / 10 * 1e6))
+        seconds, _ = timed(lambda: scheme_eval("(spin {0})".format(n * 10)))
+        print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} ns/iteration"
+              .format("spin", n * 10, seconds, seconds / n / 10 * 1e9))
+        seconds, _ = timed(lambda: scheme_eval("(spinners 10 {0})".format(n)))
+        print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} ns/iteration"
+              .format("spinners", n * 10, seconds, seconds / n / 10 * 1e9))
+
+@benchmark
+def pmap():
+    """A list of N elements mapped with map and with pmap, by a function
+    taking about as long as 20 iterations of a loop, also with a global
+    list of 300000 elements defined that the function does not use, and
+    the encoding and decoding of a list of N values as sent between
+    processes."""
+    scheme_eval("""(define (spin n)
+                     (define (loop i) (if (< i n) (loop (+ i 1)) i))
+                     (loop 0))
+                   (define (work x) (spin 20))
+                   (define (numbers n acc)
+                     (if (= n 0) acc (numbers (- n 1) (cons n acc))))""")
+    for n in SIZES[:2]:
+        n //= 10
+        scheme_eval("(define xs (numbers {0} '()))".format(n))
+        for name in ("map", "pmap"):
+            seconds, _ = timed(lambda: scheme_eval("({0} work xs)".format(name)))
+            print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} us/element"
+                  .format(name, n, seconds, seconds / n * 1e6))
+        scheme_eval("(define unused (numbers 300000 '()))")
+        seconds, _ = timed(lambda: scheme_eval("(pmap work xs)"))
+        print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} us/element"
+              .format("pmap+global", n, seconds, seconds / n * 1e6))
+        scheme_eval("(define unused #f)")
+        value = scheme_eval("(map (lambda (x) (list x 'x (/ x 2))) xs)")
+        seconds, data = timed(lambda: scheme.dump_values(value))
+        print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} us/element, {4} bytes"
+              .format("dump", n, seconds, seconds / n * 1e6, len(data)))
+        seconds, _ = timed(lambda: scheme.load_values(data))
+        print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} us/element"
+              .format("load", n, seconds, seconds / n * 1e6))
+
+@benchmark
+def fasl():
+    """A list of N records (each a list of an integer, a symbol, a real and
+    a boolean) encoded and decoded with fasl, and written and read back as
+    text."""
+    scheme_eval("""(define (records n acc)
+                     (if (= n 0)
+                         acc
+                         (records (- n 1)
+                                  (cons (list n 'record (/ n 3) (> n 5))
+                                        acc))))""")
+    for n in SIZES[:2]:
+        value = scheme_eval("(records {0} '())".format(n))
+        seconds, data = timed(lambda: scheme_fasl.dumps(value))
+        print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} us/record, {4} bytes"
+              .format("fasl-write", n, seconds, seconds / n * 1e6, len(data)))
+        seconds, _ = timed(lambda: scheme_fasl.loads(data))
+        print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} us/record"
+              .format("fasl-read", n, seconds, seconds / n * 1e6))
+        def write():
+            out = scheme.StringIO()
+            value.write(out)
+            return out.getvalue()
+        seconds, text = timed(write)
+        print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} us/record, {4} bytes"
+              .format("write", n, seconds, seconds / n * 1e6, len(text)))
+        def read():
+            scheme.current_context().input_port = \
+                scheme.Buffer(scheme.tokenize_lines([text]))
+            return scheme.scm_read()
+        seconds, _ = timed(read)
+        print("{0:<12} n={1:<9} {2:9.4f} s  {3:8.1f} us/record"
+              .format("read", n, seconds, seconds / n * 1e6))
+
+@main
+def run_benchmarks(*names):
+    """Run the benchmarks in NAMES (by default, all of them)."""
+    for name in names or BENCHMARKS:
+        if name not in BENCHMARKS:
+            print("unknown benchmark: {0}".format(name), file=sys.stderr)
+            sys.exit(1)
+        BENCHMARKS[name]()
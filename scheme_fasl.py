@@ -0,0 +1,231 @@
+"""A compact binary encoding ("fasl", for fast load) of Scheme data.
+
+    (fasl-write VALUE FILE)
+        writes VALUE to the file named by the symbol FILE;
+    (fasl-read FILE)
+        the value written to the file named by the symbol FILE.
+
+The Python functions dump(VALUE, FILE) and load(FILE) do the same with
+binary file objects, and dumps(VALUE) and loads(DATA) with bytes.  Values
+are made of pairs, numbers, symbols, booleans and the empty list; pairs
+that are shared, or that form cycles, are shared and form cycles in the
+value read.
+
+An encoded value consists of
+
+    the magic bytes MAGIC and the byte VERSION;
+    the number of symbols, then the length and UTF-8 bytes of each name;
+    the number of pairs, then the car and cdr references of each pair;
+    the reference to the value itself,
+
+where every number is an unsigned LEB128 varint, and a reference is a
+byte that is either a small non-negative integer plus SMALL_INT, or one of
+the tags below followed by its operand.  Reading creates the pairs first
+and then fills them in, so neither reading nor writing uses recursion,
+however deep the value.
+"""
+
+import struct
+from scheme_primitives import *
+
+MAGIC = b"SCMFASL"
+VERSION = 1
+
+# The tags of references.  A reference to pair K + 1 from the cdr of pair K
+# (as in a list) is NEXT_PAIR, without an operand.
+NULL_TAG, TRUE_TAG, FALSE_TAG = 0, 1, 2
+INT_TAG = 3          # operand: the zigzag-encoded integer
+FLOAT_TAG = 4        # operand: an IEEE double, little-endian
+SYMBOL_TAG = 5       # operand: the index of the symbol
+PAIR_TAG = 6         # operand: the index of the pair
+NEXT_PAIR = 7
+SMALL_INT = 128      # tags from SMALL_INT on are the integers from 0
+
+_DOUBLE = struct.Struct("<d")
+
+# The types of the pairs and of the other values that can be encoded.
+_PAIR_TYPES = (Pair, CompactList)
+_ATOM_TYPES = (Number, Bool, Null)
+
+def _varint(out, n):
+    """Append the unsigned integer N to the bytearray OUT as a varint."""
+    while n >= 0x80:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+
+def dumps(value):
+    """The encoding of the Scheme value VALUE, as bytes."""
+    symbols, pairs = {}, {}
+    # The pairs in order of their indices, which also keeps them (and so
+    # their ids) alive while encoding.
+    order = []
+    work = [value]
+    while work:
+        x = work.pop()
+        # Follow the cdrs of a list here, stacking only its elements.
+        while type(x) in _PAIR_TYPES and id(x) not in pairs:
+            pairs[id(x)] = len(order)
+            order.append(x)
+            work.append(x.car)
+            x = x.cdr
+        t = type(x)
+        if t is Symbol:
+            if x not in symbols:
+                symbols[x] = len(symbols)
+        elif t not in _PAIR_TYPES and t not in _ATOM_TYPES:
+            raise SchemeError("fasl-write: cannot encode a {0}"
+                              .format(x.type_name()))
+
+    out = bytearray(MAGIC)
+    out.append(VERSION)
+    _varint(out, len(symbols))
+    for sym in symbols:
+        name = sym.ident.encode("utf-8")
+        _varint(out, len(name))
+        out += name
+
+    def ref(x):
+        """Append the reference to X."""
+        t = type(x)
+        if t is Number:
+            n = x.num_val
+            if type(n) is float:
+                out.append(FLOAT_TAG)
+                out.extend(_DOUBLE.pack(n))
+            elif 0 <= n < 256 - SMALL_INT:
+                out.append(SMALL_INT + n)
+            else:
+                out.append(INT_TAG)
+                _varint(out, 2 * n if n >= 0 else -2 * n - 1)
+        elif t is Symbol:
+            out.append(SYMBOL_TAG)
+            _varint(out, symbols[x])
+        elif t in _PAIR_TYPES:
+            out.append(PAIR_TAG)
+            _varint(out, pairs[id(x)])
+        elif x is NULL:
+            out.append(NULL_TAG)
+        else:
+            out.append(TRUE_TAG if x else FALSE_TAG)
+
+    _varint(out, len(order))
+    for k, pair in enumerate(order, 1):
+        ref(pair.car)
+        cdr = pair.cdr
+        if k < len(order) and cdr is order[k]:
+            out.append(NEXT_PAIR)
+        else:
+            ref(cdr)
+    ref(value)
+    return bytes(out)
+
+def loads(data):
+    """The Scheme value encoded in the bytes DATA by dumps."""
+    if data[:len(MAGIC)] != MAGIC:
+        raise SchemeError("fasl-read: not fasl data")
+    pos = len(MAGIC)
+    if pos >= len(data) or data[pos] != VERSION:
+        raise SchemeError("fasl-read: unsupported fasl version")
+    pos += 1
+    try:
+        return _decode(data, pos)
+    except (IndexError, struct.error, UnicodeDecodeError):
+        raise SchemeError("fasl-read: truncated or malformed data")
+
+def _decode(data, pos):
+    """The value encoded in the bytes DATA from the symbol table, at
+    position POS, on."""
+    def varint():
+        nonlocal pos
+        n = shift = 0
+        while True:
+            b = data[pos]
+            pos += 1
+            n |= (b & 0x7f) << shift
+            if b < 0x80:
+                return n
+            shift += 7
+
+    def count(size):
+        """A varint counting items of at least SIZE bytes each, which must
+        all fit in the rest of DATA."""
+        n = varint()
+        if n * size > len(data) - pos:
+            raise SchemeError("fasl-read: truncated or malformed data")
+        return n
+
+    symbols = []
+    for _ in range(count(1)):
+        size = varint()
+        if pos + size > len(data):
+            raise IndexError
+        symbols.append(Symbol.string_to_symbol(
+            data[pos:pos + size].decode("utf-8")))
+        pos += size
+    # Each pair has at least a one-byte reference for its car and its cdr.
+    pairs = [Pair(NULL, NULL) for _ in range(count(2))]
+    constants = (NULL, TRUE, FALSE)
+
+    def ref():
+        nonlocal pos
+        tag = data[pos]
+        pos += 1
+        if tag >= SMALL_INT:
+            return Number(tag - SMALL_INT)
+        if tag == PAIR_TAG:
+            return pairs[varint()]
+        if tag == SYMBOL_TAG:
+            return symbols[varint()]
+        if tag == INT_TAG:
+            n = varint()
+            return Number(n >> 1 if n & 1 == 0 else -(n >> 1) - 1)
+        if tag == FLOAT_TAG:
+            pos += 8
+            return Number(_DOUBLE.unpack_from(data, pos - 8)[0])
+        if tag <= FALSE_TAG:
+            return constants[tag]
+        raise SchemeError("fasl-read: unknown tag {0}".format(tag))
+
+    for k, pair in enumerate(pairs, 1):
+        pair.car = ref()
+        if data[pos] == NEXT_PAIR:
+            pos += 1
+            pair.cdr = pairs[k]
+        else:
+            pair.cdr = ref()
+    value = ref()
+    if pos != len(data):
+        raise SchemeError("fasl-read: extra data after value")
+    return value
+
+def dump(value, file):
+    """Write the encoding of VALUE to the binary file object FILE."""
+    file.write(dumps(value))
+
+def load(file):
+    """The value encoded in the rest of the binary file object FILE."""
+    return loads(file.read())
+
+def scm_fasl_write(value, filename):
+    check_type(filename, scm_symbolp, 1, "fasl-write")
+    data = dumps(value)
+    try:
+        with open(str(filename), "wb") as outfile:
+            outfile.write(data)
+    except OSError as exc:
+        raise SchemeError("fasl-write: {0}".format(exc))
+    return UNSPEC
+
+def scm_fasl_read(filename):
+    check_type(filename, scm_symbolp, 0, "fasl-read")
+    try:
+        with open(str(filename), "rb") as infile:
+            return load(infile)
+    except OSError as exc:
+        raise SchemeError("fasl-read: {0}".format(exc))
+
+FASL_PRIMITIVES = (
+    ("fasl-write", scm_fasl_write),
+    ("fasl-read", scm_fasl_read),
+)
@@ -43,9 +43,6 @@
         ((= n 0) L)
         (else (error |index argument to list-tail may not be negative|))))
 
-(define (list-ref L n)
-  (car (list-tail L n)))
-
 (define (assq key L)
   (cond ((null? L) #f)
         ((eq? key (caar L)) (car L))
@@ -108,3 +105,6 @@
     (if (null? L) sofar
         (reverse-tail (cons (car L) sofar) (cdr L))))
   (reverse-tail '() L))
+
+;; The empty stream.
+(define the-empty-stream (quote ()))
@@ -1,17 +1,60 @@
 from operator import *
-from math import floor, ceil
+from math import floor, ceil, isqrt, sqrt, pow as fpow
 from scheme_utils import *
+import scheme_tokens
 from scheme_tokens import symbol_escaped
 from io import StringIO
+import threading
+import weakref
+import scheme_turtle
 
-try:
-    import turtle
-except:
-    print("warning: could not import the turtle module.", file=sys.stderr)
+class Context:
+    """The state that the primitives keep for one interpreter: the files to
+    which output and error messages go (OUTPUT and ERRORS, which stand for
+    sys.stdout and sys.stderr when None), and the turtle backend TURTLE,
+    created when first needed, whose name is TURTLE_BACKEND_NAME (None for
+    the default).  The primitives use the Context of the interpreter
+    running in the current thread (see current_context); scheme.Interpreter
+    extends it."""
+
+    output = None
+    errors = None
+    turtle = None
+    turtle_backend_name = None
+
+class _ThreadState(threading.local):
+    """The state of the interpreter running in a thread: its Context
+    (CONTEXT, or default_context if None), the scheme.Budget in effect, if
+    any, and the scheme.Task that the thread runs, if any."""
+
+    context = None
+    budget = None
+    task = None
+
+thread_state = _ThreadState()
+
+# The Context used in threads that have not set one.
+default_context = Context()
+
+def current_context():
+    """The Context of the interpreter running in the current thread."""
+    return thread_state.context or default_context
+
+def output_port():
+    """The file to which the current interpreter's output goes."""
+    return current_context().output or sys.stdout
+
+def error_port():
+    """The file to which the current interpreter's error messages go."""
+    return current_context().errors or sys.stderr
+
+scheme_tokens.error_port = error_port
 
 class SchemeValue:
     """A value manipulated by a Scheme program."""
 
+    __slots__ = ()
+
     def __bool__(self):
         """All Scheme values other than #f are considered true in Python as
         well as Scheme."""
@@ -43,6 +86,16 @@ class SchemeValue:
     def equalp(self, other):
         return self.eqvp(other)
 
+    def eqv_key(self):
+        """A hashable Python value such that the keys of two Scheme values
+        are equal iff the values are eqv?."""
+        return self
+
+    def equal_key(self):
+        """A hashable Python value such that the keys of two Scheme values
+        are equal iff the values are equal?."""
+        return self.eqv_key()
+
     def atomp(self):
         return TRUE
 
@@ -92,6 +145,8 @@ class S_Expr(SchemeValue):
     Other Scheme values can only result from the evaluation of functions or
     forms (e.g., the values of lambda expressions)."""
 
+    __slots__ = ()
+
 def make_list(*args):
     r = list(args)
     result = NULL
@@ -100,6 +155,13 @@ def make_list(*args):
     return result
 
 class Pair(S_Expr):
+    # The result of analyzing SELF as a special form, cached by the
+    # evaluator so that the analysis is done only once, or None.
+    analysis = None
+    # Whether SELF is part of a form whose analysis has been cached (see
+    # cache_analysis).
+    in_form = False
+
     def __init__(self, x, y):
         self.car = x
         self.cdr = y
@@ -114,9 +176,20 @@ class Pair(S_Expr):
         return TRUE
 
     def equalp(self, other):
-        if not other.pairp():
-            return FALSE
-        return self.car.equalp(other.car) and self.cdr.equalp(other.cdr)
+        # Iterates down the cdrs, so that long lists can be compared.
+        while self.pairp():
+            if not other.pairp() or not self.car.equalp(other.car):
+                return FALSE
+            self, other = self.cdr, other.cdr
+        return self.equalp(other)
+
+    def equal_key(self):
+        keys = []
+        p = self
+        while p.pairp():
+            keys.append(p.car.equal_key())
+            p = p.cdr
+        return (Pair, tuple(keys), p.equal_key())
 
     def __repr__(self):
         return "cons({0}, {1})".format(repr(self.car), repr(self.cdr))
@@ -176,7 +249,161 @@ class Pair(S_Expr):
                 return x.car
             x = x.cdr
             k -= 1
-            
+
+# Proper lists at least this long are built by the reader (for quoted data)
+# and by list as CompactLists.
+COMPACT_MIN_LENGTH = 8
+
+class _CompactStore:
+    """The elements shared by the CompactLists that are views of one list.
+    BROKEN is the largest position whose cdr has been replaced, or -1 if the
+    list is intact; LINKS maps each such position to its new cdr.  VIEWS
+    holds the view of each position after the first that is still in use,
+    so that each position has at most one view at a time."""
+
+    __slots__ = ("items", "broken", "links", "views", "in_form")
+
+    def __init__(self, items):
+        self.items = items
+        self.broken = -1
+        self.links = None
+        self.views = None
+        self.in_form = False
+
+    def view(self, k):
+        """The CompactList for position K > 0."""
+        if self.views is None:
+            self.views = weakref.WeakValueDictionary()
+        result = self.views.get(k)
+        if result is None:
+            result = self.views[k] = CompactList(self, k)
+        return result
+
+class CompactList(S_Expr):
+    """A pair that is position INDEX of a proper list whose elements are
+    stored in the Python list STORE.items.  Views are made on demand as the
+    list is traversed and disappear when no longer referenced, so that a
+    list of N elements that is not being traversed costs little more than
+    N references.  Until some cdr at or after SELF is replaced with
+    set-cdr!, the length and nth of SELF take constant time; after that,
+    SELF behaves like an ordinary pair.  (A CompactList has slots rather
+    than a dictionary, and so is not a subclass of Pair.)"""
+
+    __slots__ = ("_store", "_index", "analysis", "__weakref__")
+
+    def __init__(self, store, index = 0):
+        self._store = store
+        self._index = index
+        self.analysis = None
+
+    type_name = Pair.type_name
+    atomp = Pair.atomp
+    pairp = Pair.pairp
+    equalp = Pair.equalp
+    equal_key = Pair.equal_key
+    __repr__ = Pair.__repr__
+    __str__ = Pair.__str__
+    write = Pair.write
+    display = Pair.display
+
+    @property
+    def in_form(self):
+        # Marks the whole list, which is conservative.
+        return self._store.in_form
+
+    @in_form.setter
+    def in_form(self, flag):
+        self._store.in_form = flag
+
+    @property
+    def car(self):
+        return self._store.items[self._index]
+
+    @car.setter
+    def car(self, x):
+        self._store.items[self._index] = x
+
+    @property
+    def cdr(self):
+        store, k = self._store, self._index
+        if k <= store.broken and k in store.links:
+            return store.links[k]
+        k += 1
+        if k == len(store.items):
+            return NULL
+        return store.view(k)
+
+    @cdr.setter
+    def cdr(self, y):
+        store = self._store
+        if store.links is None:
+            store.links = {}
+        store.links[self._index] = y
+        store.broken = max(store.broken, self._index)
+
+    def intact(self):
+        """True iff the list starting at SELF is still the elements of its
+        store from SELF's position on."""
+        return self._index > self._store.broken
+
+    def elements(self):
+        """The elements of SELF, as a Python list.  Assumes SELF is
+        intact."""
+        return self._store.items[self._index:]
+
+    def length(self):
+        if self.intact():
+            return len(self._store.items) - self._index
+        return Pair.length(self)
+
+    def nth(self, k):
+        if not self.intact():
+            return Pair.nth(self, k)
+        if k < 0:
+            raise SchemeError("negative index into list")
+        k += self._index
+        if k >= len(self._store.items):
+            raise SchemeError("list index out of bounds")
+        return self._store.items[k]
+
+# The forms whose analyses are cached.  Since a pair can be part of any
+# number of forms, replacing the car or cdr of a pair in any of them
+# discards the analyses of all.
+_analyzed_forms = weakref.WeakSet()
+_analyzed_forms_lock = threading.Lock()
+
+def cache_analysis(expr, analysis):
+    """Cache ANALYSIS, the result of analyzing the form EXPR, in EXPR until
+    set-car! or set-cdr! changes a pair of EXPR, and return it."""
+    seen = {}
+    work = [expr]
+    while work:
+        x = work.pop()
+        while isinstance(x, (Pair, CompactList)) and id(x) not in seen:
+            # SEEN keeps the views of a CompactList, and so their ids, alive.
+            seen[id(x)] = x
+            x.in_form = True
+            work.append(x.car)
+            x = x.cdr
+    with _analyzed_forms_lock:
+        expr.analysis = analysis
+        _analyzed_forms.add(expr)
+    return analysis
+
+def discard_analyses():
+    """Discard the analyses cached by cache_analysis."""
+    with _analyzed_forms_lock:
+        for expr in _analyzed_forms:
+            expr.analysis = None
+        _analyzed_forms.clear()
+
+def compact_list(items):
+    """A Scheme list of the values in the Python list ITEMS, which becomes
+    the storage of the result if it is long enough to be a CompactList."""
+    if len(items) < COMPACT_MIN_LENGTH:
+        return make_list(*items)
+    return CompactList(_CompactStore(items))
+
 class Null(S_Expr):
     def __str__(self):
         return "()"
@@ -227,7 +454,7 @@ class Number(S_Expr):
         self.num_val = val
 
     def type_name(self):
-        return "integer" if type(self.num_val is int) else "real"
+        return "integer" if type(self.num_val) is int else "real"
 
     def atomp(self):
         return TRUE
@@ -244,14 +471,31 @@ class Number(S_Expr):
     def eqvp(self, other):
         return boolify(other.integerp() and self.num_val == other.num_val)
 
+    def eqv_key(self):
+        if type(self.num_val) is int:
+            return (Number, self.num_val)
+        return self
+
     def __str__(self):
         return str(self.num_val)
 
 class Symbol(S_Expr):
+    __slots__ = ("ident", "_escaped", "__weakref__")
+
     def __init__(self, ident):
-        # ident and escaped are strings representing the object
+        # ident is the string naming the symbol; _escaped is its escaped
+        # form (see escaped), or None if not yet computed.
         self.ident = ident
-        self.escaped = symbol_escaped(ident)
+        self._escaped = None
+
+    @property
+    def escaped(self):
+        """The name of SELF, escaped so that the reader reconstructs SELF
+        from it.  Computed when first needed, since most symbols are never
+        written."""
+        if self._escaped is None:
+            self._escaped = symbol_escaped(self.ident)
+        return self._escaped
 
     def type_name(self):
         return "symbol"
@@ -268,10 +512,22 @@ class Symbol(S_Expr):
     @staticmethod
     def string_to_symbol(name):
         """The Symbol whose string value is NAME.  Always returns the same
-        Symbol object when given the same string."""
-        result = Symbol.symbols.get(name, None)
+        Symbol object when given the same string, for as long as that
+        object is in use."""
+        result = Symbol.symbols.get(name)
         if result is None:
-            result = Symbol.symbols[name] = Symbol(name)
+            with Symbol.lock:
+                result = Symbol.symbols.get(name)
+                if result is None:
+                    result = Symbol.symbols[name] = Symbol(name)
+        return result
+
+    @staticmethod
+    def pin(name):
+        """The Symbol whose string value is NAME, which is kept in the symbol
+        table for the life of the interpreter."""
+        result = Symbol.string_to_symbol(name)
+        Symbol.pinned.add(result)
         return result
 
     def atomp(self):
@@ -286,8 +542,22 @@ class Symbol(S_Expr):
     def display(self, f):
         print(self.ident, file=f, end="")
 
-    # The mapping of names to symbols.
-    symbols = {}
+    # The mapping of names to symbols.  A symbol that is no longer referenced
+    # is dropped, so that programs that generate symbols from data (e.g.,
+    # with word) do not fill the table, and a fresh Symbol is created if the
+    # name is used again.  Nothing can tell the two apart.
+    symbols = weakref.WeakValueDictionary()
+
+    # Symbols that remain in the table even while unreferenced: the names of
+    # special forms and predefined functions.
+    pinned = set()
+
+    # Held while adding to the table, which interpreters running in
+    # different threads share.
+    lock = threading.Lock()
+
+# The tokenizer produces interned Symbols directly.
+scheme_tokens.make_symbol = Symbol.string_to_symbol
 
 class Unspecified(SchemeValue):
     """A class whose sole instance is the "unspecified value", which is 
@@ -368,6 +638,9 @@ def scm_nullp(x):
     return x.nullp()
 
 def scm_listp(x):
+    if type(x) is CompactList and x.intact():
+        return TRUE
+    # P1 advances one pair for every two that X advances.
     p1 = x
     while not x.nullp():
         if not x.pairp():
@@ -376,10 +649,10 @@ def scm_listp(x):
             return TRUE
         if not x.cdr.pairp():
             return FALSE
-        if p1 is x.cdr or p1 is x.cdr.cdr:
+        x = x.cdr.cdr
+        p1 = p1.cdr
+        if p1 is x:
             return FALSE
-        p1 = x.cdr
-        x = p1.cdr
     return TRUE
 
 def scm_length(x):
@@ -397,38 +670,60 @@ def scm_cdr(x):
     check_type(x, scm_pairp, 0, 'cdr')
     return x.cdr
 
+def scm_list_ref(x, k):
+    check_type(k, scm_integerp, 1, "list-ref")
+    return x.nth(k.num_val)
+
 def scm_set_car(x, y):
     check_type(x, scm_pairp, 0, "set-car")
     x.car = y
+    if x.in_form:
+        discard_analyses()
     return UNSPEC
 
 def scm_set_cdr(x, y):
     check_type(x, scm_pairp, 0, "set-cdr")
     x.cdr = y
+    if x.in_form:
+        discard_analyses()
     return UNSPEC
 
 def scm_list(*members):
-    result = NULL
-    for i in range(len(members)-1, -1, -1):
-        result = scm_cons(members[i], result)
-    return result
+    return compact_list(list(members))
+
+def _copy_onto(last, x):
+    """Append copies of the elements of the proper list X after the pair
+    LAST, returning the last pair added (LAST if X is empty), or None if X
+    is not a proper list.  Makes a single pass over X."""
+    if type(x) is CompactList and x.intact():
+        for item in x.elements():
+            last.cdr = last = Pair(item, NULL)
+        return last
+    slow = x
+    while x.pairp():
+        last.cdr = last = Pair(x.car, NULL)
+        x = x.cdr
+        if not x.pairp():
+            break
+        last.cdr = last = Pair(x.car, NULL)
+        x = x.cdr
+        slow = slow.cdr
+        if x is slow:
+            return None # circular
+    if not x.nullp():
+        return None
+    return last
 
 def scm_append(*vals):
     if len(vals) == 0:
         return NULL
-    result = vals[-1]
-    for i in range(len(vals)-2, -1, -1):
-        v = vals[i]
-        check_type(v, scm_listp, i, "append")
-        if not v.nullp():
-            r = p = scm_cons(v.car, result)
-            v = v.cdr
-            while v.pairp():
-                p.cdr = scm_cons(v.car, result)
-                p = p.cdr
-                v = v.cdr
-            result = r
-    return result
+    head = last = Pair(NULL, NULL)
+    for i in range(len(vals)-1):
+        last = _copy_onto(last, vals[i])
+        if last is None:
+            check_type(vals[i], scm_listp, i, "append")
+    last.cdr = vals[-1]
+    return head.cdr
 
 ##
 ## Operations on symbols
@@ -448,32 +743,51 @@ def scm_integerp(x):
     return x.integerp()
 
 def _check_nums(*vals, pred = scm_numberp):
-    """Check that all arguments in VALS satisfy PRED. TYPE_NAME is used
-    for error messages."""
-    for i in range(len(vals)):
-        if not vals[i].numberp():
+    """Check that all arguments in VALS satisfy PRED, which is scm_numberp or
+    scm_integerp."""
+    for i, val in enumerate(vals):
+        if not pred(val):
             msg = "an integer" if pred is scm_integerp else "a number"
             raise SchemeError("operand #{0} is not {1}.".format(i, msg))
 
+def _given(x, y, vals):
+    """The operands of a primitive whose parameters are X = None, Y = None,
+    and *VALS: all of them, omitting X and Y if they were not supplied."""
+    if y is None:
+        return () if x is None else (x,)
+    return (x, y) + vals
+
 def _arith(op, init, vals):
     """Perform the OP operation on the integer values of VALS, with INIT as
     the value when VALS is empty. Returns the result as a Scheme value."""
-    _check_nums(*vals)
     s = init
-    for i in range(len(vals)):
-        s = op(s, vals[i].num_val)
+    for val in vals:
+        if type(val) is not Number:
+            _check_nums(*vals)
+        s = op(s, val.num_val)
     return Number(s)
 
-def scm_add(*vals):
-    return _arith(add, 0, vals)
+# The arithmetic operations and comparisons take their first operands as
+# separate parameters, so that the common two-operand case neither packs nor
+# checks a tuple of operands.
 
-def scm_sub(val0, *vals):
-    if len(vals) == 0:
-        return Number(-val0.num_val)
-    return _arith(sub, val0.num_val, vals)
+def scm_add(x = None, y = None, *vals):
+    if type(x) is Number and type(y) is Number and not vals:
+        return Number(x.num_val + y.num_val)
+    return _arith(add, 0, _given(x, y, vals))
 
-def scm_mul(*vals):
-    return _arith(mul, 1, vals)
+def scm_sub(x, y = None, *vals):
+    if type(x) is Number and type(y) is Number and not vals:
+        return Number(x.num_val - y.num_val)
+    _check_nums(x)
+    if y is None:
+        return Number(-x.num_val)
+    return _arith(sub, x.num_val, (y,) + vals)
+
+def scm_mul(x = None, y = None, *vals):
+    if type(x) is Number and type(y) is Number and not vals:
+        return Number(x.num_val * y.num_val)
+    return _arith(mul, 1, _given(x, y, vals))
 
 def scm_div(val0, val1):
     _check_nums(val0, val1)
@@ -506,26 +820,67 @@ def scm_floor(val):
 
 def scm_ceil(val):
     _check_nums(val)
-    return Number(floor(val.num_val))
+    return Number(ceil(val.num_val))
 
-def _numcomp(op, x, y):
-    _check_nums(x, y)
-    return boolify(op(x.num_val, y.num_val))
+def scm_exact_to_inexact(val):
+    _check_nums(val)
+    return Number(float(val.num_val))
+
+def scm_expt(base, power):
+    _check_nums(base, power)
+    b, p = base.num_val, power.num_val
+    if type(b) is int and type(p) is int and p >= 0:
+        return Number(b ** p)
+    if b == 0 and p < 0:
+        raise SchemeError("attempt to divide by zero!")
+    try:
+        return Number(fpow(b, p))
+    except ValueError:
+        raise SchemeError("expt: result is not a real number")
+    except OverflowError:
+        raise SchemeError("expt: result is too large")
+
+def scm_sqrt(val):
+    _check_nums(val)
+    x = val.num_val
+    if x < 0:
+        raise SchemeError("sqrt: result is not a real number")
+    if type(x) is int:
+        root = isqrt(x)
+        if root * root == x:
+            return Number(root)
+    try:
+        return Number(sqrt(x))
+    except OverflowError:
+        raise SchemeError("sqrt: operand is too large")
+
+def _numcomp(op, vals):
+    """Whether OP holds between each pair of adjacent values in VALS, all of
+    which must be numbers."""
+    _check_nums(*vals)
+    for x, y in zip(vals, vals[1:]):
+        if not op(x.num_val, y.num_val):
+            return FALSE
+    return TRUE
 
-def scm_eq(x, y):
-    return _numcomp(eq, x, y)
+def scm_eq(x, y, *vals):
+    if type(x) is Number and type(y) is Number and not vals:
+        return TRUE if x.num_val == y.num_val else FALSE
+    return _numcomp(eq, (x, y) + vals)
 
-def scm_lt(x, y):
-    return _numcomp(lt, x, y)
+def scm_lt(x, y, *vals):
+    if type(x) is Number and type(y) is Number and not vals:
+        return TRUE if x.num_val < y.num_val else FALSE
+    return _numcomp(lt, (x, y) + vals)
 
-def scm_gt(x, y):
-    return _numcomp(gt, x, y)
+def scm_gt(x, y, *vals):
+    return _numcomp(gt, (x, y) + vals)
 
-def scm_le(x, y):
-    return _numcomp(le, x, y)
+def scm_le(x, y, *vals):
+    return _numcomp(le, (x, y) + vals)
 
-def scm_ge(x, y):
-    return _numcomp(ge, x, y)
+def scm_ge(x, y, *vals):
+    return _numcomp(ge, (x, y) + vals)
 
 ##
 ## Other type tests
@@ -545,16 +900,15 @@ def scm_eof_objectp(x):
 ##
 
 def scm_display(val):
-    val.display(sys.stdout)
+    val.display(output_port())
     return UNSPEC
 
 def scm_newline():
-    print()
-    sys.stdout.flush()
+    print(file=output_port())
     return UNSPEC
 
 def scm_write(val):
-    val.write(sys.stdout)
+    val.write(output_port())
     return UNSPEC
 
 
@@ -585,14 +939,11 @@ def scm_exit(code = None):
 def sscm_word(*words):
     """The atom resulting from concatenating the representations of the atoms
     in WORDS."""
-    result = ""
     for w in words:
-        if scm_symbolp(w) or scm_numberp(w):
-            result += str(w)
-        else:
+        if not (w.symbolp() or w.numberp()):
             raise SchemeError("bad argument type to word: {0}"
                               .format(w.type_name()))
-    return string_to_atom(result)
+    return string_to_atom("".join(map(str, words)))
 
 
 def sscm_first(x):
@@ -619,9 +970,9 @@ def sscm_last(x):
     """If X is a list, its last element.  If it is a symbol or number, the
     symbol or number denoted by the last character in its string value."""
     if x.pairp():
-        while x.pairp() and not x.cdr.nullp():
+        while x.cdr.pairp():
             x = x.cdr
-        if x.pairp():
+        if x.cdr.nullp():
             return x.car
     elif x.symbolp() or x.numberp():
         return string_to_atom(str(x)[-1])
@@ -632,74 +983,88 @@ def sscm_butlast(x):
     If it is a symbol or number, the symbol or number denoted by all but
     the last character in its string denotation."""
     if x.pairp():
-        result = NULL
-        while x.pairp() and not x.cdr.nullp():
-            if result.nullp():
-                result = last = scm_cons(x.car, NULL)
-            else:
-                last.cdr = scm_cons(x.car, NULL)
-                last = last.cdr
+        head = last = Pair(NULL, NULL)
+        while x.cdr.pairp():
+            last.cdr = last = Pair(x.car, NULL)
             x = x.cdr
-        if x.pairp():
-            return result
+        if x.cdr.nullp():
+            return head.cdr
     elif x.symbolp() or x.numberp():
         return string_to_atom(str(x)[0:-1])
     raise SchemeError("bad argument to butlast")
 
 def sscm_sentence(*vals):
     """Creates a list out of the integers, symbols, and lists in VALS, treating
-    the atoms as single-element lists and concatenating the values together."""
-    result = NULL
-    for i in range(len(vals)-1, -1, -1):
-        v = vals[i]
-        if scm_listp(v):
-            result = scm_append(v, result)
+    the atoms as single-element lists and concatenating the values together.
+    Makes a single pass over each list."""
+    head = last = Pair(NULL, NULL)
+    for v in vals:
+        if v.pairp() or v.nullp():
+            last = _copy_onto(last, v)
+            if last is None:
+                raise SchemeError("bad argument to sentence")
         elif v.integerp() or v.symbolp():
-            result = scm_cons(v, result)
+            last.cdr = last = Pair(v, NULL)
         else:
             raise SchemeError("bad argument to sentence")
-    return result
+    return head.cdr
 
 ##
 ## Turtle graphics (non-standard)
 ##
 
-_turtle_screen_on = False
+def set_turtle_backend(name = None):
+    """Make the current interpreter draw with the turtle backend NAME ("tk"
+    or "headless", or by default whichever suits the display) from now on,
+    discarding any drawing made so far.  (The Tk backend draws in the one
+    window of the turtle module, which all interpreters share.)"""
+    if name is not None and name not in scheme_turtle.BACKENDS:
+        raise ValueError("unknown turtle backend: {0}".format(name))
+    context = current_context()
+    context.turtle, context.turtle_backend_name = None, name
+
+def flush_drawing():
+    """Bring the current interpreter's turtle window (if any) up to date."""
+    turtle = current_context().turtle
+    if turtle is not None:
+        turtle.flush()
 
 def _tscm_prep():
-    global _turtle_screen_on
-    if not _turtle_screen_on:
-        _turtle_screen_on = True
-        turtle.title("Scheme Turtles")
-        turtle.mode('logo')
+    """The turtle backend of the current interpreter, created if
+    necessary."""
+    context = current_context()
+    if context.turtle is None:
+        try:
+            context.turtle = scheme_turtle.make_backend(
+                context.turtle_backend_name)
+        except Exception as exc:
+            raise SchemeError("could not start turtle graphics: {0}"
+                              .format(exc))
+    return context.turtle
 
 def tscm_forward(n):
     """Move the turtle forward a distance N units on the current heading."""
     _check_nums(n)
-    _tscm_prep()
-    turtle.forward(n.num_val)
+    _tscm_prep().forward(n.num_val)
     return UNSPEC
 
 def tscm_backward(n):
     """Move the turtle backward a distance N units on the current heading,
     without changing direction."""
     _check_nums(n)
-    _tscm_prep()
-    turtle.backward(n.num_val)
+    _tscm_prep().backward(n.num_val)
     return UNSPEC
 
 def tscm_left(n):
     """Rotate the turtle's heading N degrees counterclockwise."""
     _check_nums(n)
-    _tscm_prep()
-    turtle.left(n.num_val)
+    _tscm_prep().left(n.num_val)
     return UNSPEC
 
 def tscm_right(n):
     """Rotate the turtle's heading N degrees clockwise."""
     _check_nums(n)
-    _tscm_prep()
-    turtle.right(n.num_val)
+    _tscm_prep().right(n.num_val)
     return UNSPEC
     
 def tscm_circle(r, extent = None):
@@ -712,80 +1077,70 @@ def tscm_circle(r, extent = None):
         _check_nums(r)
     else:
         _check_nums(r, extent)
-    _tscm_prep()
-    turtle.circle(r.num_val, extent and extent.num_val)
+    _tscm_prep().circle(r.num_val, extent and extent.num_val)
     return UNSPEC
     
 def tscm_setposition(x, y):
     """Set turtle's position to (X,Y), heading unchanged."""
     _check_nums(x, y)
-    _tscm_prep()
-    turtle.setposition(x.num_val, y.num_val)
+    _tscm_prep().setposition(x.num_val, y.num_val)
     return UNSPEC
 
 def tscm_setheading(h):
     """Set the turtle's heading H degrees clockwise from north (up)."""
     _check_nums(h)
-    _tscm_prep()
-    turtle.setheading(h.num_val)
+    _tscm_prep().setheading(h.num_val)
     return UNSPEC
 
 def tscm_penup():
     """Raise the pen, so that the turtle does not draw."""
-    _tscm_prep()
-    turtle.penup()
+    _tscm_prep().penup()
     return UNSPEC
 
 def tscm_pendown():
     """Lower the pen, so that the turtle starts drawing."""
-    _tscm_prep()
-    turtle.pendown()
+    _tscm_prep().pendown()
     return UNSPEC
 
 def tscm_showturtle():
     """Make turtle visible."""
-    _tscm_prep()
-    turtle.showturtle()
+    _tscm_prep().showturtle()
     return UNSPEC
 
 def tscm_hideturtle():
     """Make turtle visible."""
-    _tscm_prep()
-    turtle.hideturtle()
+    _tscm_prep().hideturtle()
     return UNSPEC
 
 def tscm_clear():
     """Clear the drawing, leaving the turtle unchanged."""
-    _tscm_prep()
-    turtle.clear()
+    _tscm_prep().clear()
     return UNSPEC
 
 def tscm_color(c):
     """Set the color to C, a symbol such as red or '#ffc0c0' (representing
     hexadecimal red, green, and blue values."""
-    _tscm_prep()
     check_type(c, scm_symbolp, 0, "color")
-    turtle.color(str(c))
+    _tscm_prep().color(str(c))
     return UNSPEC
 
 def tscm_begin_fill():
     """Start a sequence of moves that outline a shape to be filled."""
-    _tscm_prep()
-    turtle.begin_fill()
+    _tscm_prep().begin_fill()
     return UNSPEC
 
 def tscm_end_fill():
     """Fill in shape drawn since last begin_fill."""
-    _tscm_prep()
-    turtle.end_fill()
+    _tscm_prep().end_fill()
     return UNSPEC
 
 def tscm_exitonclick():
     """Wait for a click on the turtle window, and then close it."""
-    global _turtle_screen_on
-    if _turtle_screen_on:
-        turtle.exitonclick()
-        _turtle_screen_on = False
+    context = current_context()
+    if context.turtle is not None:
+        context.turtle.exitonclick()
+        if isinstance(context.turtle, scheme_turtle.TkBackend):
+            context.turtle = None
     return UNSPEC
 
 def tscm_speed(s):
@@ -793,6 +1148,17 @@ def tscm_speed(s):
     0-10, with 0 indicating no animation (lines draw instantly), and 1-10
     indicating faster and faster movement."""
     check_type(s, scm_integerp, 0, "speed")
-    _tscm_prep()
-    turtle.speed(s.num_val)
+    _tscm_prep().speed(s.num_val)
+    return UNSPEC
+
+def tscm_save_drawing(filename):
+    """Save the drawing in the file named by the symbol FILENAME: as
+    PostScript if it ends in .ps or .eps, and otherwise as SVG (which the
+    Tk backend cannot produce)."""
+    check_type(filename, scm_symbolp, 0, "save-drawing")
+    turtle = _tscm_prep()
+    try:
+        turtle.save(str(filename))
+    except (OSError, ValueError) as exc:
+        raise SchemeError("save-drawing: {0}".format(exc))
     return UNSPEC
@@ -0,0 +1,168 @@
+"""A long-running Scheme interpreter server.
+
+    python3 scheme.py --serve SOCKET
+
+starts a server that loads the global environment (including the prelude)
+once, and then evaluates Scheme source on behalf of its clients.  SOCKET is
+either the path of a Unix-domain socket, or PORT or HOST:PORT for a TCP
+socket on the loopback interface (a HOST that is not on the loopback
+interface is refused, since anyone who can connect can run any code).
+
+Requests and responses are JSON objects, one per line.  A request
+
+    {"id": 1, "source": "(define x 3) (display x) (+ x 1)"}
+
+reads and evaluates each expression in SOURCE in turn, stopping at the first
+error, and is answered by
+
+    {"id": 1, "output": "3", "values": ["4"], "value": "4", "error": null,
+     "time": 0.0004, "stats": {"steps": 9, "depth": 3, "conses": 0,
+     "time": 0.0003}}
+
+with the fields described in scheme.eval_source: OUTPUT is everything printed,
+VALUES holds the written representation of each value other than the
+unspecified value, and ERROR is null or an error message.  The request
+
+    {"op": "reset"}
+
+discards the client's definitions.
+
+Each client has its own session frame, enclosed by the shared global frame,
+so that top-level definitions made by one client are invisible to the others.
+(Since the global frame is shared, set! on a predefined name, and define
+inside eval, affect every client.)  All clients share the one interpreter
+that owns that frame, so evaluations are carried out one at a time on a
+single thread.
+"""
+
+import asyncio
+import ipaddress
+import json
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+import scheme
+
+# Longest request line, in bytes.
+MAX_REQUEST_SIZE = 1 << 24
+
+class Session:
+    """The state of one client: an environment frame enclosed by the shared
+    global environment."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Discard all definitions made in SELF."""
+        self.env = scheme.EnvironFrame(scheme.current_context().env)
+
+    def evaluate(self, source, timeout = None, limits = None):
+        """Read and evaluate the Scheme expressions in the string SOURCE in
+        SELF's environment, stopping at the first error, when TIMEOUT
+        seconds have passed, or when a limit of Budget given by the keyword
+        arguments in LIMITS is exceeded.  Returns the response as a
+        dictionary."""
+        return scheme.eval_source(
+            source, self.env, budget = scheme.Budget(seconds = timeout,
+                                                     **(limits or {})))
+
+class Server:
+    """Serves evaluation requests from up to MAX_CLIENTS concurrently
+    connected clients, abandoning each evaluation after TIMEOUT seconds or
+    when it exceeds the other LIMITS of Budget (a dictionary of its keyword
+    arguments)."""
+
+    def __init__(self, timeout = None, max_clients = 64, limits = None):
+        self.timeout = timeout
+        self.max_clients = max_clients
+        self.limits = limits or {}
+        self.num_clients = 0
+        # All evaluation happens on this executor's single thread.
+        self.executor = ThreadPoolExecutor(1)
+
+    async def handle_client(self, reader, writer):
+        """Answer the requests of one client until it disconnects."""
+        if self.num_clients >= self.max_clients:
+            await self.send(writer, { "error": "too many clients" })
+            writer.close()
+            return
+        self.num_clients += 1
+        session = Session()
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    await self.send(writer, { "error": "request too long" })
+                    break
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError
+                except ValueError:
+                    await self.send(writer, { "error": "malformed request" })
+                    continue
+                if request.get("op") == "reset":
+                    session.reset()
+                    response = { "error": None }
+                else:
+                    response = await loop.run_in_executor(
+                        self.executor, session.evaluate,
+                        str(request.get("source", "")), self.timeout,
+                        self.limits)
+                if "id" in request:
+                    response["id"] = request["id"]
+                await self.send(writer, response)
+                if response.get("exit"):
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.num_clients -= 1
+            writer.close()
+
+    @staticmethod
+    async def send(writer, response):
+        """Write RESPONSE to WRITER as a line of JSON."""
+        writer.write(json.dumps(response).encode() + b"\n")
+        await writer.drain()
+
+    async def serve(self, address):
+        """Accept clients on ADDRESS (see the module documentation) until
+        cancelled."""
+        host, sep, port = address.rpartition(":")
+        if address.isdigit() or (sep and port.isdigit()):
+            check_loopback(host or "127.0.0.1")
+            server = await asyncio.start_server(
+                self.handle_client, host or "127.0.0.1", int(port or address),
+                limit=MAX_REQUEST_SIZE)
+        else:
+            server = await asyncio.start_unix_server(
+                self.handle_client, address, limit=MAX_REQUEST_SIZE)
+        async with server:
+            await server.serve_forever()
+
+def check_loopback(host):
+    """Raise ValueError unless every address of HOST is a loopback
+    address."""
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except socket.gaierror as exc:
+        raise ValueError("cannot resolve {0}: {1}".format(host, exc))
+    for info in infos:
+        # An IPv6 address may carry a scope, as in fe80::1%eth0.
+        if not ipaddress.ip_address(info[4][0].partition("%")[0]).is_loopback:
+            raise ValueError("{0} is not a loopback address".format(host))
+
+def serve(address, timeout = None, max_clients = 64, limits = None):
+    """Initialize the global environment and serve evaluation requests on
+    ADDRESS until interrupted."""
+    scheme.create_global_environment()
+    try:
+        asyncio.run(Server(timeout, max_clients, limits).serve(address))
+    except KeyboardInterrupt:
+        pass
@@ -2,9 +2,9 @@
 
 """Unit testing framework for the Logo interpreter
 .
-Usage: python3 scheme_test.py FILE
+Usage: python3 scheme_test.py [-j JOBS] FILE ...
 
-Interprets FILE as interactive Scheme source code, and compares each line
+Interprets each FILE as interactive Scheme source code, and compares each line
 of printed output from the read-eval-print loop and from any output functions
 to an expected output described in a comment.  For example,
 
@@ -12,73 +12,174 @@ to an expected output described in a comment.  For example,
 ; expect 5
 
 Differences between printed and expected outputs are printed with line numbers.
+
+Each file is split into sections at its top-level section markers
+
+;; -- BEGIN TEST -- ;;
+;; -- END TEST -- ;;
+
+and each section is run in a fresh copy of the initial global environment,
+so that definitions made in one section are not seen by the next.
+Sections are run in parallel by a pool of JOBS worker processes (by default,
+one per CPU), which are forked after the global environment is initialized.
 """
 
 """This file has been modified to be check for arbitrary hexadecimal
 memory locations using regex.
 """
 
+import argparse
 import io
+import multiprocessing
+import re
 import sys
+import traceback
 from ucb import main
+import scheme
 from scheme import call_with_input_source, create_global_environment, \
-                   read_eval_print
+                   current_context, read_eval_print
 from re import sub
 
-def summarize(output, expected_output):
-    """Summarize results of running tests."""
-    num_failed, num_expected = 0, len(expected_output)
-    for (actual, (expected, line_number)) in zip(output, expected_output):
+def summarize(results, src_file = None):
+    """Summarize results of running tests.  RESULTS is a list of
+    (actual, expected, line_number) triples.  If SRC_FILE is not None, it
+    is used to label the report."""
+    prefix = "" if src_file is None else "{0}: ".format(src_file)
+    num_failed, num_expected = 0, len(results)
+    for actual, expected, line_number in results:
         if expected.startswith("Error"):
             if not actual.startswith("Error"):
                 num_failed += 1
-                print('test failed at line {0}'.format(line_number))
+                print('{0}test failed at line {1}'.format(prefix, line_number))
                 print('  expected an error indication')
                 print('   printed: {0}'.format(actual))
         elif actual != expected:
             num_failed += 1
-            print('test failed at line {0}'.format(line_number))
+            print('{0}test failed at line {1}'.format(prefix, line_number))
             print('  expected: {0}'.format(expected))
             print('   printed: {0}'.format(actual))
-    print('{0} tested; {1} failed.'.format(num_expected, num_failed))
+    print('{0}{1} tested; {2} failed.'.format(prefix, num_expected, num_failed))
+    return num_failed
 
 EXPECT_STRING = '; expect'
 
-@main
-def run_tests(src_file = 'tests.scm'):
-    """Run a read-eval loop that reads from src_file and collects outputs."""
+_BEGIN_TEST = re.compile(r"\s*;+\s*-- BEGIN TEST\b")
+_END_TEST = re.compile(r"\s*;+\s*-- END TEST\b")
+
+def split_sections(src_file):
+    """The sections of the file named SRC_FILE, as a list of lists of
+    (line_number, line) pairs.  A new section starts at each section marker;
+    sections that contain nothing but comments and whitespace are dropped."""
+    sections, section = [], []
+    with open(src_file) as src:
+        for line_number, line in enumerate(src, 1):
+            if _BEGIN_TEST.match(line) or _END_TEST.match(line):
+                sections.append(section)
+                section = []
+            section.append((line_number, line))
+    sections.append(section)
+    return [s for s in sections
+            if any(line.split(';', 1)[0].strip() for _, line in s)]
+
+# Bindings of the initial global environment, saved before any test section
+# runs so that each section can start from a fresh copy.
+_initial_bindings = None
+
+def _reset_global_environment():
+    """Restore the global environment to its state after initialization,
+    initializing it first if this has not been done."""
+    global _initial_bindings
+    if _initial_bindings is None:
+        create_global_environment()
+        _initial_bindings = dict(current_context().env.inner)
+    env = current_context().env
+    env.inner.clear()
+    env.inner.update(_initial_bindings)
+
+def run_section(section):
+    """Run a read-eval loop over SECTION, a list of (line_number, line)
+    pairs, in a fresh global environment, and collect its outputs.  Returns
+    a pair (results, failure), where RESULTS is a list of (actual, expected,
+    line_number) triples and FAILURE is None or a description of the
+    unhandled exception that terminated the section."""
     expected_output = []
     line_number = 0
 
-    def read_lines(src):
-        """Creates a generator that returns the lines of src, filtering out
+    def read_lines():
+        """Creates a generator that returns the lines of SECTION, filtering out
         '; expect' strings and collecting them into expected_output with their
         line numbers.  The variable line_number gives the number of the last
         line returned for diagnostic purposes."""
         nonlocal line_number
-        while True:
-            line_number += 1
-            line = src.readline()
+        for line_number, line in section:
             if line.lstrip().startswith(EXPECT_STRING):
                 # Replace hex memory locations with %*HEX_MEMORY*%
-                expected = sub("0x[0-9a-f]+","%*HEX_MEMORYo%",line).split(EXPECT_STRING, 1)[1][1:-1]
+                expected = sub("0x[0-9a-f]+","%*HEX_MEMORYo%",line).split(EXPECT_STRING, 1)[1][1:].rstrip('\n')
                 expected_output.append((expected, line_number))
                 continue
-            if not line:
-                return
             yield line
 
-    sys.stderr = sys.stdout = io.StringIO() # Collect output to stdout and stderr
-    create_global_environment()
+    _reset_global_environment()
+    out = io.StringIO()
+    interp = current_context()
+    interp.output = interp.errors = out # Collect output and error messages
+    failure = None
     try:
-        call_with_input_source(read_lines(open(src_file)),
-                               lambda: read_eval_print(""))
-    except BaseException as exc:
-        sys.stderr = sys.__stderr__
-        print("Tests terminated due to unhandled exception "
-              "after line {0}:\n>>>".format(line_number),
-              file=sys.stderr)
-        raise
-    output = sub("0x[0-9a-f]+","%*HEX_MEMORYo%",sys.stdout.getvalue()).split('\n')
-    sys.stdout = sys.__stdout__  # Revert stdout
-    summarize(output, expected_output)
+        call_with_input_source(read_lines(), lambda: read_eval_print(""))
+    except BaseException:
+        failure = "Tests terminated due to unhandled exception " \
+                  "after line {0}:\n>>>\n{1}".format(line_number,
+                                                     traceback.format_exc())
+    finally:
+        interp.output = interp.errors = None
+    output = sub("0x[0-9a-f]+","%*HEX_MEMORYo%",out.getvalue()).split('\n')
+    results = [(actual, expected, n)
+               for actual, (expected, n) in zip(output, expected_output)]
+    return results, failure
+
+def _run_sections(sections, jobs):
+    """The results of run_section on each of SECTIONS, in order, using a pool
+    of JOBS processes forked from an initialized global environment when
+    more than one is requested and fork is available."""
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = min(jobs, len(sections))
+    if jobs <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return [run_section(s) for s in sections]
+    _reset_global_environment()
+    with multiprocessing.get_context("fork").Pool(jobs) as pool:
+        return pool.map(run_section, sections, chunksize=1)
+
+@main
+def run_tests(*argv):
+    """Run the test files named in ARGV (default tests.scm), summarize
+    their results, and exit with status 1 if any test failed."""
+    parser = argparse.ArgumentParser(prog="scheme_test.py",
+                                     description="Run Scheme test files.")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of worker processes (default: CPUs)")
+    parser.add_argument("src_files", nargs="*", default=["tests.scm"],
+                        metavar="FILE")
+    args = parser.parse_args(argv)
+
+    sections, owners = [], []
+    for src_file in args.src_files:
+        for section in split_sections(src_file):
+            sections.append(section)
+            owners.append(src_file)
+    outcomes = _run_sections(sections, args.jobs)
+
+    num_failed = 0
+    for src_file in args.src_files:
+        results = []
+        for owner, (section_results, failure) in zip(owners, outcomes):
+            if owner != src_file:
+                continue
+            results.extend(section_results)
+            if failure is not None:
+                print("{0}: {1}".format(src_file, failure), file=sys.stderr)
+                num_failed += 1
+        label = src_file if len(args.src_files) > 1 else None
+        num_failed += summarize(results, label)
+    if num_failed:
+        sys.exit(1)
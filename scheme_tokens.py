@@ -3,9 +3,9 @@ for converting (iterators producing) strings into (iterators producing)
 lists of token descriptors.  A "token descriptor" here refers to a pair (syntax, value), where
 
    * value is either value denoted by the token (an integer in the case of
-     numeric tokens, a boolean value in the case of boolean tokens) or the
-     text of the token itself (in all other cases).  the value of the token
-     (a string, integer, or boolean value),
+     numeric tokens, a boolean value in the case of boolean tokens, the
+     result of make_symbol on the symbol's name in the case of symbols) or
+     the text of the token itself (in all other cases).
    * type indicates the "syntactic category" of the token: whether it
      is a parenthesis, symbol, etc.  The possible types are SYMBOL,
      NUMERAL, BOOLEAN, "(", ")", ".", and "\'".
@@ -95,6 +95,18 @@ SYMBOL  = 1
 NUMERAL = 2
 BOOLEAN = 3
 
+# The function applied to the name of each symbol token to give its value.
+# The scheme_primitives module sets it to the function that returns the
+# interned Symbol with that name, so that the reader need not look the
+# name up again.
+make_symbol = str
+
+# The function giving the file to which warnings are printed.  The
+# scheme_primitives module sets it to the function that gives the error
+# output of the interpreter running in the current thread.
+def error_port():
+    return sys.stderr
+
 def _token_to_string(tok):
     """Given that TOK is the text of a non-standard symbol (minus the enclosing
     '|'s), returns the Python string containing the designated sequence of
@@ -125,11 +137,12 @@ def tokenize_line(line):
             if text in _ONECHAR_TOKENS:
                 result.append((text, text))
             elif text == '+' or text == '-':
-                result.append((SYMBOL, text))
+                result.append((SYMBOL, make_symbol(text)))
             elif text == '#f' or text == '#t':
                 result.append((BOOLEAN, text == '#t'))
             elif text[0] == '|':
-                result.append((SYMBOL, _token_to_string(text[1:-1])))
+                result.append((SYMBOL,
+                               make_symbol(_token_to_string(text[1:-1]))))
             elif text[0] in _NUMERAL_STARTS:
                 try: 
                     result.append((NUMERAL, int(text)))
@@ -139,13 +152,14 @@ def tokenize_line(line):
                     except ValueError:
                         raise SchemeError("invalid numeral: '{0}'".format(text))
             elif text[0] in _SYMBOL_STARTS:
-                result.append((SYMBOL, text.lower()))
+                result.append((SYMBOL, make_symbol(text.lower())))
             else:  # catches all improper expressions
                 raise SchemeError("invalid token: '{0}'".format(text))
         except SchemeError as exc:
-            print("warning: " + exc.args[0], file=sys.stderr)
-            print("    ", line, file=sys.stderr)
-            print(" " * (i+3), "^", file=sys.stderr)
+            errors = error_port()
+            print("warning: " + exc.args[0], file=errors)
+            print("    ", line, file=errors)
+            print(" " * (i+3), "^", file=errors)
 
     return result
 
@@ -0,0 +1,415 @@
+"""Backends for the turtle graphics primitives of the Scheme interpreter.
+
+The primitives in scheme_primitives (forward, left, circle, ...) drive
+whichever backend make_backend chooses:
+
+    Recorder
+        a headless turtle, which needs no display.  It records each stroke
+        as a few numbers in a single array, and renders the whole drawing to
+        SVG or (Encapsulated) PostScript in one pass when it is saved.
+    TkBackend
+        the standard turtle module, drawing in a Tk window.  Tracing is off,
+        so that the window is redrawn at most every UPDATE_INTERVAL seconds
+        (and whenever the interpreter prompts for input) rather than after
+        every move, unless a nonzero speed is requested.
+
+Both use Logo conventions: headings are in degrees clockwise from north,
+and the turtle starts at (0, 0) facing north with the pen down.
+"""
+
+import math
+import os
+import sys
+import time
+from array import array
+
+# Commands in a Recorder's command array, each followed by its operands:
+# MOVE X Y and LINE X Y move the pen to (X, Y), without and with drawing;
+# ARC CX CY R ANGLE X Y draws an arc of ANGLE degrees (at most 180, and
+# counterclockwise if positive) around (CX, CY) from the current point to
+# (X, Y); COLOR K strokes with color K; FILL K begins the outline of a
+# region filled with color K, ended by END_FILL.  Colors are indices into
+# the Recorder's list of color names.
+MOVE, LINE, ARC, COLOR, FILL, END_FILL = range(6)
+
+# The number of operands of each command.
+OPERANDS = (2, 2, 6, 1, 1, 0)
+
+# RGB values of the commonly used color names (as in Tk).  Other names are
+# passed through to SVG unchanged, and drawn in black in PostScript.
+COLOR_NAMES = {
+    "black": (0, 0, 0), "white": (255, 255, 255), "red": (255, 0, 0),
+    "green": (0, 255, 0), "blue": (0, 0, 255), "yellow": (255, 255, 0),
+    "cyan": (0, 255, 255), "magenta": (255, 0, 255),
+    "orange": (255, 165, 0), "purple": (160, 32, 240),
+    "brown": (165, 42, 42), "pink": (255, 192, 203),
+    "gray": (190, 190, 190), "grey": (190, 190, 190),
+}
+
+# Margin left around a drawing when it is rendered.
+MARGIN = 10
+
+def rgb(color):
+    """The (red, green, blue) values (0-255) of the color named COLOR, which
+    is one of COLOR_NAMES or of the form #RGB or #RRGGBB, or None if it is
+    not understood."""
+    color = color.lower()
+    if color in COLOR_NAMES:
+        return COLOR_NAMES[color]
+    digits = color[1:]
+    if color.startswith("#") and len(digits) in (3, 6):
+        width = len(digits) // 3
+        try:
+            return tuple(int(digits[k:k+width], 16) * (17 if width == 1 else 1)
+                         for k in range(0, len(digits), width))
+        except ValueError:
+            return None
+    return None
+
+def _num(x):
+    """X formatted compactly to two decimal places."""
+    text = "{0:.2f}".format(x).rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+class Recorder:
+    """A headless turtle, which records its drawing in the array COMMANDS
+    (see the commands above)."""
+
+    def __init__(self):
+        self.x = self.y = 0.0
+        self.heading = 0.0
+        self.pen = True
+        self.visible = True
+        self.colors = []
+        self.color_indices = {}
+        self.color_index = self._color("black")
+        self.clear()
+
+    def _color(self, name):
+        """The index of the color NAME in SELF.colors, adding it if new."""
+        if name not in self.color_indices:
+            self.color_indices[name] = len(self.colors)
+            self.colors.append(name)
+        return self.color_indices[name]
+
+    def clear(self):
+        """Erase the drawing, leaving the turtle unchanged."""
+        self.commands = array("d", (COLOR, self.color_index))
+        self.bounds = [self.x, self.y, self.x, self.y]
+        # The commands and outline of a fill in progress (see end_fill).
+        self.strokes = self.outline = None
+        self.drawing = self.commands
+        self.placed = False
+
+    def _include(self, x, y, r = 0):
+        bounds = self.bounds
+        bounds[0] = min(bounds[0], x - r)
+        bounds[1] = min(bounds[1], y - r)
+        bounds[2] = max(bounds[2], x + r)
+        bounds[3] = max(bounds[3], y + r)
+
+    def _stroke(self, command, *operands):
+        """Record the drawing command COMMAND, moving to the end point given
+        by its last two OPERANDS."""
+        x, y = operands[-2], operands[-1]
+        if self.outline is not None:
+            self.outline.append(command)
+            self.outline.extend(operands)
+        if self.pen:
+            if not self.placed:
+                self.drawing.extend((MOVE, self.x, self.y))
+                self.placed = True
+            self.drawing.append(command)
+            self.drawing.extend(operands)
+        else:
+            self.placed = False
+        self.x, self.y = x, y
+        self._include(x, y)
+
+    def forward(self, distance):
+        angle = math.radians(self.heading)
+        self._stroke(LINE, self.x + distance * math.sin(angle),
+                     self.y + distance * math.cos(angle))
+
+    def backward(self, distance):
+        self.forward(-distance)
+
+    def left(self, angle):
+        self.heading = (self.heading - angle) % 360
+
+    def right(self, angle):
+        self.heading = (self.heading + angle) % 360
+
+    def circle(self, radius, extent = None):
+        if extent is None:
+            extent = 360
+        if radius == 0:
+            self.left(extent)
+            return
+        heading = math.radians(self.heading)
+        cx = self.x - radius * math.cos(heading)
+        cy = self.y + radius * math.sin(heading)
+        r = abs(radius)
+        self._include(cx, cy, r)
+        # Counterclockwise turn around the center.
+        turn = extent if radius > 0 else -extent
+        pieces = max(1, math.ceil(abs(turn) / 180))
+        for _ in range(pieces):
+            angle = turn / pieces
+            start = math.atan2(self.y - cy, self.x - cx) + math.radians(angle)
+            self._stroke(ARC, cx, cy, r, angle,
+                         cx + r * math.cos(start), cy + r * math.sin(start))
+        self.left(turn)
+
+    def setposition(self, x, y):
+        self._stroke(LINE, x, y)
+
+    def setheading(self, heading):
+        self.heading = heading % 360
+
+    def penup(self):
+        self.pen = False
+        self.placed = False
+
+    def pendown(self):
+        self.pen = True
+
+    def showturtle(self):
+        self.visible = True
+
+    def hideturtle(self):
+        self.visible = False
+
+    def color(self, name):
+        self.color_index = self._color(name)
+        self.drawing.extend((COLOR, self.color_index))
+
+    def begin_fill(self):
+        if self.outline is None:
+            self.strokes = array("d", (COLOR, self.color_index))
+            self.outline = array("d", (MOVE, self.x, self.y))
+            self.drawing = self.strokes
+            self.placed = False
+
+    def end_fill(self):
+        """Record the filled region, followed by the strokes drawn while it
+        was outlined, so that they are drawn over it."""
+        if self.outline is not None:
+            commands = self.commands
+            commands.extend((FILL, self.color_index))
+            commands.extend(self.outline)
+            commands.append(END_FILL)
+            commands.extend(self.strokes)
+            self.strokes = self.outline = None
+            self.drawing = commands
+
+    def speed(self, speed):
+        pass
+
+    def flush(self):
+        pass
+
+    def exitonclick(self):
+        pass
+
+    def _render(self, start, path, move, line, arc, color, fill):
+        """Call the rendering functions for each command, in one pass.
+        MOVE(X, Y), LINE(X, Y), ARC(CX, CY, R, ANGLE, X0, Y0, X, Y) add to the
+        current path (ARC also giving its start point), which is passed to
+        PATH(COLOR, FILLED) when it ends.  COLOR(NAME) and FILL(NAME) precede
+        the commands of each stroked and filled path.  START(X, Y) begins
+        each path."""
+        commands, colors = self.commands, self.colors
+        x = y = 0.0
+        stroke_color = None
+        empty = True
+        k, end = 0, len(commands)
+        while k < end:
+            command = int(commands[k])
+            operands = commands[k+1:k+1+OPERANDS[command]]
+            k += 1 + OPERANDS[command]
+            if command == MOVE:
+                x, y = operands
+                if not empty:
+                    move(x, y)
+                continue
+            if command == COLOR or command == FILL:
+                if not empty:
+                    path(stroke_color, False)
+                name = colors[int(operands[0])]
+                if command == COLOR and name == stroke_color:
+                    continue
+                if command == COLOR:
+                    stroke_color = name
+                    color(name)
+                else:
+                    fill(name)
+                start(x, y)
+                empty = True
+                continue
+            if command == END_FILL:
+                if not empty:
+                    path(name, True)
+                color(stroke_color)
+                start(x, y)
+                empty = True
+                continue
+            if empty:
+                empty = False
+                move(x, y)
+            if command == LINE:
+                x, y = operands
+                line(x, y)
+            else:
+                cx, cy, r, angle, x1, y1 = operands
+                arc(cx, cy, r, angle, x, y, x1, y1)
+                x, y = x1, y1
+        if not empty:
+            path(stroke_color, False)
+
+    def svg(self):
+        """The drawing as an SVG document."""
+        x0, y0, x1, y1 = self.bounds
+        parts = ['<svg xmlns="http://www.w3.org/2000/svg" viewBox="{0} {1} '
+                 '{2} {3}">\n'.format(_num(x0 - MARGIN), _num(-y1 - MARGIN),
+                                      _num(x1 - x0 + 2 * MARGIN),
+                                      _num(y1 - y0 + 2 * MARGIN))]
+        data = []
+
+        def color_value(name):
+            value = rgb(name)
+            return name if value is None else "#{0:02x}{1:02x}{2:02x}".format(
+                *value)
+
+        def path(name, filled):
+            if filled:
+                style = 'fill="{0}" stroke="none"'.format(color_value(name))
+            else:
+                style = ('fill="none" stroke="{0}" stroke-linecap="round" '
+                         'stroke-linejoin="round"'.format(color_value(name)))
+            parts.append('<path d="{0}" {1}/>\n'.format(" ".join(data), style))
+            data.clear()
+
+        def arc(cx, cy, r, angle, x0, y0, x, y):
+            # The y axis points down in SVG, reversing the sweep direction.
+            data.append("A{0} {0} 0 0 {1} {2} {3}".format(
+                _num(r), 0 if angle > 0 else 1, _num(x), _num(-y)))
+
+        self._render(lambda x, y: None, path,
+                     lambda x, y: data.append("M{0} {1}".format(_num(x),
+                                                                _num(-y))),
+                     lambda x, y: data.append("L{0} {1}".format(_num(x),
+                                                                _num(-y))),
+                     arc, lambda name: None, lambda name: None)
+        parts.append("</svg>\n")
+        return "".join(parts)
+
+    def postscript(self):
+        """The drawing as an Encapsulated PostScript document."""
+        x0, y0, x1, y1 = self.bounds
+        parts = ["%!PS-Adobe-3.0 EPSF-3.0\n",
+                 "%%BoundingBox: 0 0 {0} {1}\n".format(
+                     math.ceil(x1 - x0 + 2 * MARGIN),
+                     math.ceil(y1 - y0 + 2 * MARGIN)),
+                 "{0} {1} translate\n".format(_num(MARGIN - x0),
+                                              _num(MARGIN - y0)),
+                 "1 setlinewidth 1 setlinecap 1 setlinejoin\n"]
+
+        def set_color(name):
+            red, green, blue = rgb(name) or (0, 0, 0)
+            parts.append("{0} {1} {2} setrgbcolor\n".format(
+                _num(red / 255), _num(green / 255), _num(blue / 255)))
+
+        def arc(cx, cy, r, angle, x0, y0, x, y):
+            start = math.degrees(math.atan2(y0 - cy, x0 - cx))
+            parts.append("{0} {1} {2} {3} {4} {5}\n".format(
+                _num(cx), _num(cy), _num(r), _num(start), _num(start + angle),
+                "arc" if angle > 0 else "arcn"))
+
+        self._render(lambda x, y: parts.append("newpath\n"),
+                     lambda name, filled: parts.append(
+                         "fill\n" if filled else "stroke\n"),
+                     lambda x, y: parts.append("{0} {1} moveto\n".format(
+                         _num(x), _num(y))),
+                     lambda x, y: parts.append("{0} {1} lineto\n".format(
+                         _num(x), _num(y))),
+                     arc, set_color, set_color)
+        parts.append("showpage\n")
+        return "".join(parts)
+
+    def save(self, filename):
+        """Write the drawing to the file FILENAME, as PostScript if its name
+        ends in .ps or .eps and otherwise as SVG."""
+        if filename.lower().endswith((".ps", ".eps")):
+            text = self.postscript()
+        else:
+            text = self.svg()
+        with open(filename, "w") as outfile:
+            outfile.write(text)
+
+class TkBackend:
+    """The standard turtle module, with tracing turned off."""
+
+    # Longest time in seconds between redraws of the window.
+    UPDATE_INTERVAL = 0.05
+
+    def __init__(self):
+        import turtle
+        self.turtle = turtle
+        turtle.title("Scheme Turtles")
+        turtle.mode("logo")
+        turtle.tracer(0)
+        self.next_update = 0
+
+    def __getattr__(self, name):
+        """The drawing operation NAME of the turtle module, followed by a
+        redraw if one is due."""
+        operation = getattr(self.turtle, name)
+        def draw(*args):
+            operation(*args)
+            now = time.monotonic()
+            if now >= self.next_update:
+                self.turtle.update()
+                self.next_update = now + self.UPDATE_INTERVAL
+        return draw
+
+    def speed(self, speed):
+        """Animate each move at SPEED (1-10), or, if SPEED is 0, draw
+        without animation."""
+        self.turtle.speed(speed)
+        self.turtle.tracer(1 if speed else 0)
+
+    def flush(self):
+        """Redraw the window."""
+        self.turtle.update()
+
+    def exitonclick(self):
+        self.flush()
+        self.turtle.exitonclick()
+
+    def save(self, filename):
+        """Write the drawing to the file FILENAME, which must be
+        PostScript."""
+        if not filename.lower().endswith((".ps", ".eps")):
+            raise ValueError("the Tk turtle can save only PostScript")
+        self.flush()
+        self.turtle.getcanvas().postscript(file=filename)
+
+# The names of the backends, and the classes implementing them.
+BACKENDS = { "headless": Recorder, "tk": TkBackend }
+
+def default_backend():
+    """The name of the backend used by default: tk if there seems to be a
+    display and the turtle module can be imported, and headless otherwise."""
+    if sys.platform.startswith("linux") or "bsd" in sys.platform:
+        if not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")):
+            return "headless"
+    try:
+        import turtle
+    except ImportError:
+        return "headless"
+    return "tk"
+
+def make_backend(name = None):
+    """A new turtle backend called NAME (by default, default_backend())."""
+    return BACKENDS[name or default_backend()]()
@@ -0,0 +1,266 @@
+"""Numeric vectors for the Scheme interpreter, backed by NumPy arrays.
+
+An f64vector holds 64-bit floating-point numbers and an s64vector holds
+64-bit signed integers, as in SRFI 4.  Besides the SRFI 4 procedures
+(make-f64vector, f64vector, f64vector?, f64vector-length, f64vector-ref,
+f64vector-set!, list->f64vector, f64vector->list, and the same for
+s64vector), there are
+
+    (read-f64vector FILE), (read-s64vector FILE)
+        the whitespace-separated numbers in the file named by the symbol FILE;
+    (vector+ V ...), (vector- V ...), (vector* V ...), (vector/ V ...)
+        elementwise arithmetic;
+    (vector= V1 V2), (vector< V1 V2), ...
+        elementwise comparisons, giving s64vectors of 1s and 0s;
+    (vector-sum V), (vector-dot V1 V2)
+        the sum of the elements of V, and the dot product of V1 and V2;
+    (vector-slice V START [END])
+        the elements of V from START up to END, sharing V's storage.
+
+The operands of the arithmetic and comparison operations may be numbers as
+well as vectors; a number stands for a vector whose elements all equal it.
+Integer arithmetic on s64vectors wraps around on overflow.
+
+These procedures are defined only if NumPy can be imported, in which case
+VECTOR_PRIMITIVES holds their (name, function) bindings; it is empty
+otherwise.  Their tests are in tests_vectors.scm.
+"""
+
+from operator import add, sub, mul, truediv, eq, lt, gt, le, ge
+from scheme_primitives import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class NumericVector(SchemeValue):
+    """A vector of numbers stored in the one-dimensional NumPy array ARRAY,
+    whose type is one of those in DTYPES."""
+
+    def __init__(self, array):
+        self.array = array
+
+    @property
+    def kind(self):
+        """The name of SELF's element type ("f64" or "s64")."""
+        return "f64" if self.array.dtype.kind == "f" else "s64"
+
+    def type_name(self):
+        return self.kind + "vector"
+
+    def write(self, out):
+        print("#{0}(".format(self.kind), file=out, end="")
+        print(" ".join(map(str, self.array.tolist())), file=out, end="")
+        print(")", file=out, end="")
+
+    def equalp(self, other):
+        return boolify(isinstance(other, NumericVector)
+                       and self.kind == other.kind
+                       and numpy.array_equal(self.array, other.array))
+
+    def equal_key(self):
+        return (NumericVector, self.kind, tuple(self.array.tolist()))
+
+    def __repr__(self):
+        return "NumericVector({0})".format(repr(self.array))
+
+if numpy is not None:
+    # Maps the name of each kind of vector to the type of its elements.
+    DTYPES = { "f64": numpy.float64, "s64": numpy.int64 }
+
+# The range of the elements of an s64vector.
+S64_MIN, S64_MAX = -2**63, 2**63 - 1
+
+def _vectorp(x):
+    return isinstance(x, NumericVector)
+
+def _operand(x, k, name):
+    """The NumPy array or Python number represented by X, which must be a
+    numeric vector or a number (argument K of NAME)."""
+    if isinstance(x, NumericVector):
+        return x.array
+    if x.numberp():
+        return x.num_val
+    raise SchemeError("argument {0} of {1} has wrong type ({2})"
+                      .format(k, name, x.type_name()))
+
+def _result(value):
+    """The Scheme value of the NumPy array or scalar VALUE."""
+    if isinstance(value, numpy.ndarray):
+        if value.dtype.kind == "f":
+            return NumericVector(value.astype(numpy.float64, copy=False))
+        return NumericVector(value.astype(numpy.int64, copy=False))
+    if isinstance(value, numpy.generic):
+        value = value.item()
+    return Number(value)
+
+def _elementwise(op, name):
+    """The primitive NAME, which combines its operands from left to right
+    with the NumPy operation OP."""
+    def primitive(x, *others):
+        result = _operand(x, 0, name)
+        for k in range(len(others)):
+            operand = _operand(others[k], k + 1, name)
+            if op is truediv and numpy.any(numpy.asarray(operand) == 0):
+                raise SchemeError("attempt to divide by zero!")
+            try:
+                result = op(result, operand)
+            except ValueError:
+                raise SchemeError("{0}: vectors of different lengths"
+                                  .format(name))
+            except OverflowError:
+                raise SchemeError("{0}: number out of range".format(name))
+        return _result(result)
+    return primitive
+
+def _comparison(op, name):
+    """The primitive NAME, which compares its two operands elementwise with
+    the NumPy operation OP."""
+    def primitive(x, y):
+        try:
+            result = op(_operand(x, 0, name), _operand(y, 1, name))
+        except ValueError:
+            raise SchemeError("{0}: vectors of different lengths".format(name))
+        except OverflowError:
+            raise SchemeError("{0}: number out of range".format(name))
+        return _result(numpy.asarray(result, dtype=numpy.int64))
+    return primitive
+
+def _index(v, k, name, end = False):
+    """The Python value of the Scheme integer K, which must be a valid index
+    into the vector V (or, if END, at most its length)."""
+    check_type(k, scm_integerp, 1, name)
+    limit = len(v.array) if end else len(v.array) - 1
+    if not 0 <= k.num_val <= limit:
+        raise SchemeError("{0}: index out of range".format(name))
+    return k.num_val
+
+def _element(kind, x, k, name):
+    """The Python value of X as an element of a KIND vector (argument K of
+    NAME), which must be representable in one."""
+    check_type(x, scm_integerp if kind == "s64" else scm_numberp, k, name)
+    value = x.num_val
+    if kind == "s64":
+        if not S64_MIN <= value <= S64_MAX:
+            raise SchemeError("{0}: number out of range for an s64vector"
+                              .format(name))
+    elif type(value) is int:
+        try:
+            float(value)
+        except OverflowError:
+            raise SchemeError("{0}: number out of range for an f64vector"
+                              .format(name))
+    return value
+
+def _kind_primitives(kind):
+    """The (name, function) bindings of the SRFI 4 procedures for vectors of
+    the kind KIND."""
+    dtype = DTYPES[kind]
+    vector = kind + "vector"
+
+    def is_kind(x):
+        return isinstance(x, NumericVector) and x.kind == kind
+
+    def check(v, name):
+        check_type(v, is_kind, 0, name)
+
+    def make(n, fill = None):
+        check_type(n, scm_integerp, 0, "make-" + vector)
+        if n.num_val < 0:
+            raise SchemeError("make-{0}: negative length".format(vector))
+        value = 0 if fill is None else _element(kind, fill, 1, "make-" + vector)
+        return NumericVector(numpy.full(n.num_val, value, dtype=dtype))
+
+    def from_list(lst, name = "list->" + vector):
+        check_type(lst, scm_listp, 0, name)
+        values = []
+        while not lst.nullp():
+            values.append(_element(kind, lst.car, len(values), name))
+            lst = lst.cdr
+        return NumericVector(numpy.array(values, dtype=dtype))
+
+    def construct(*vals):
+        return from_list(make_list(*vals), vector)
+
+    def predicate(x):
+        return boolify(is_kind(x))
+
+    def length(v):
+        check(v, vector + "-length")
+        return Number(len(v.array))
+
+    def ref(v, k):
+        check(v, vector + "-ref")
+        return Number(v.array[_index(v, k, vector + "-ref")].item())
+
+    def set_bang(v, k, x):
+        check(v, vector + "-set!")
+        v.array[_index(v, k, vector + "-set!")] = \
+            _element(kind, x, 2, vector + "-set!")
+        return UNSPEC
+
+    def to_list(v):
+        check(v, vector + "->list")
+        return make_list(*map(Number, v.array.tolist()))
+
+    def read(filename):
+        check_type(filename, scm_symbolp, 0, "read-" + vector)
+        try:
+            with open(str(filename)) as infile:
+                words = infile.read().split()
+            return NumericVector(numpy.array(words, dtype=dtype))
+        except (OSError, ValueError, OverflowError) as exc:
+            raise SchemeError("read-{0}: {1}".format(vector, exc))
+
+    return (
+        ("make-" + vector, make),
+        (vector, construct),
+        (vector + "?", predicate),
+        (vector + "-length", length),
+        (vector + "-ref", ref),
+        (vector + "-set!", set_bang),
+        ("list->" + vector, from_list),
+        (vector + "->list", to_list),
+        ("read-" + vector, read),
+    )
+
+def scm_vector_sum(v):
+    check_type(v, _vectorp, 0, "vector-sum")
+    return _result(v.array.sum())
+
+def scm_vector_dot(v, w):
+    check_type(v, _vectorp, 0, "vector-dot")
+    check_type(w, _vectorp, 1, "vector-dot")
+    if len(v.array) != len(w.array):
+        raise SchemeError("vector-dot: vectors of different lengths")
+    return _result(numpy.dot(v.array, w.array))
+
+def scm_vector_slice(v, start, end = None):
+    check_type(v, _vectorp, 0, "vector-slice")
+    start = _index(v, start, "vector-slice", True)
+    if end is None:
+        end = len(v.array)
+    else:
+        end = _index(v, end, "vector-slice", True)
+        if end < start:
+            raise SchemeError("vector-slice: end precedes start")
+    return NumericVector(v.array[start:end])
+
+if numpy is None:
+    VECTOR_PRIMITIVES = ()
+else:
+    VECTOR_PRIMITIVES = _kind_primitives("f64") + _kind_primitives("s64") + (
+        ("vector+", _elementwise(add, "vector+")),
+        ("vector-", _elementwise(sub, "vector-")),
+        ("vector*", _elementwise(mul, "vector*")),
+        ("vector/", _elementwise(truediv, "vector/")),
+        ("vector=", _comparison(eq, "vector=")),
+        ("vector<", _comparison(lt, "vector<")),
+        ("vector>", _comparison(gt, "vector>")),
+        ("vector<=", _comparison(le, "vector<=")),
+        ("vector>=", _comparison(ge, "vector>=")),
+        ("vector-sum", scm_vector_sum),
+        ("vector-dot", scm_vector_dot),
+        ("vector-slice", scm_vector_slice),
+    )
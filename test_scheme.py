@@ -0,0 +1,329 @@
+"""Tests of the interpreter's Python interfaces, which the Scheme test
+files (tests.scm and the others, run by scheme_test.py) cannot reach.
+
+    python3 -m unittest test_scheme
+"""
+
+import asyncio
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+import weakref
+
+import scheme
+import scheme_fasl
+import scheme_server
+from scheme_primitives import *
+
+class ServerTest(unittest.TestCase):
+    """Requests to a server listening on a temporary Unix-domain socket."""
+
+    def test_requests(self):
+        scheme.create_global_environment()
+        with tempfile.TemporaryDirectory() as directory:
+            address = os.path.join(directory, "socket")
+            responses = asyncio.run(self.exchange(address, [
+                { "id": 1, "source": "(define x 3) (display x) (+ x 1)" },
+                { "id": 2, "source": "(car '())" },
+                { "id": 3, "op": "reset" },
+                { "id": 4, "source": "x" },
+                { "id": 5, "source": "(define (f) (f)) (f)" },
+            ]))
+        eval_, error, reset, after_reset, limited = responses
+        self.assertEqual(eval_["id"], 1)
+        self.assertEqual(eval_["output"], "3")
+        self.assertEqual(eval_["values"], ["4"])
+        self.assertIsNone(eval_["error"])
+        self.assertIn("car", error["error"])
+        self.assertEqual(reset, { "id": 3, "error": None })
+        self.assertEqual(after_reset["error"], "unknown identifier: x")
+        self.assertEqual(limited["error"], "step limit exceeded")
+        self.assertGreaterEqual(limited["stats"]["steps"], 10000)
+
+    async def exchange(self, address, requests):
+        """The responses to REQUESTS from a server started on ADDRESS."""
+        server = scheme_server.Server(limits = { "steps": 10000 })
+        serving = asyncio.ensure_future(server.serve(address))
+        while not os.path.exists(address):
+            await asyncio.sleep(0.01)
+        reader, writer = await asyncio.open_unix_connection(address)
+        responses = []
+        for request in requests:
+            writer.write(json.dumps(request).encode() + b"\n")
+            await writer.drain()
+            responses.append(json.loads(await reader.readline()))
+        writer.close()
+        serving.cancel()
+        return responses
+
+    def test_loopback_only(self):
+        server = scheme_server.Server()
+        for address in ["0.0.0.0:9000", ":::9000"]:
+            with self.assertRaises(ValueError):
+                asyncio.run(server.serve(address))
+        scheme_server.check_loopback("127.0.0.1")
+        scheme_server.check_loopback("localhost")
+
+class BatchEvalTest(unittest.TestCase):
+    """Programs evaluated by batch_eval in worker processes."""
+
+    def test_batch(self):
+        scheme.create_global_environment()
+        sources = ["(define x 2) (display 'hi) (* x 21)",
+                   "x",
+                   "(car 1)",
+                   "(define (f) (f)) (f)",
+                   "(+ 1 2) (+ 3 4)"]
+        results = dict(scheme.batch_eval(sources, workers = 2,
+                                         limits = { "steps": 10000 }))
+        self.assertEqual(sorted(results), list(range(len(sources))))
+        self.assertEqual(results[0]["value"], "42")
+        self.assertEqual(results[0]["output"], "hi")
+        # Each program starts with a fresh global environment.
+        self.assertEqual(results[1]["error"], "unknown identifier: x")
+        self.assertEqual(results[2]["error"],
+                         "argument 0 of car has wrong type (integer)")
+        self.assertEqual(results[3]["error"], "step limit exceeded")
+        self.assertEqual(results[4]["values"], ["3", "7"])
+        self.assertIsNone(results[4]["error"])
+
+class ClosureEnvironmentTest(unittest.TestCase):
+    """Closures keep alive only the bindings that they may use."""
+
+    def handler_and_data(self, body):
+        """A closure made by a function with the body BODY, called with a
+        list of numbers bound to DATA, and a weak reference to the list."""
+        interp = scheme.Interpreter()
+        interp.eval_source("(define (make data) (define total (apply + data))"
+                           " {0})".format(body))
+        make = interp.env[Symbol.string_to_symbol("make")]
+        data = make_list(*map(Number, range(1000)))
+        ref = weakref.ref(data)
+        with interp:
+            handler = scheme.apply_function(make, [data])
+        del data
+        gc.collect()
+        return handler, ref
+
+    def test_unused_binding_released(self):
+        handler, ref = self.handler_and_data("(lambda (x) (+ x total))")
+        self.assertIsNone(ref())
+        with scheme.Interpreter():
+            value = scheme.apply_function(handler, [Number(1)])
+        self.assertEqual(value.num_val, 499501)
+
+    def test_used_binding_kept(self):
+        handler, ref = self.handler_and_data("(lambda (x) (cons x data))")
+        self.assertIsNotNone(ref())
+
+class BudgetTest(unittest.TestCase):
+    """Each limit of a Budget stops an evaluation that exceeds it."""
+
+    def setUp(self):
+        self.interp = scheme.Interpreter()
+        self.interp.eval_source("""
+            (define (forever) (forever))
+            (define (depth n) (if (= n 0) 0 (+ 1 (depth (- n 1)))))
+            (define (conses n acc)
+              (if (= n 0) acc (conses (- n 1) (cons n acc))))""")
+
+    def run_with(self, source, **limits):
+        """The result of eval_source on SOURCE with a Budget of LIMITS."""
+        budget = scheme.Budget(**limits)
+        return self.interp.eval_source(source, budget = budget)
+
+    def test_steps(self):
+        result = self.run_with("(forever)", steps = 5000)
+        self.assertEqual(result["error"], "step limit exceeded")
+        self.assertEqual(result["stats"]["steps"], 5001)
+        self.assertIsNone(self.run_with("(depth 10)", steps = 5000)["error"])
+
+    def test_time(self):
+        result = self.run_with("(forever)", seconds = 0.2)
+        self.assertEqual(result["error"], "evaluation timed out")
+        self.assertGreaterEqual(result["stats"]["time"], 0.2)
+        self.assertLess(result["stats"]["time"], 5)
+
+    def test_depth(self):
+        result = self.run_with("(depth 100)", depth = 50)
+        self.assertEqual(result["error"], "depth limit exceeded")
+        self.assertEqual(result["stats"]["depth"], 50)
+        result = self.run_with("(depth 10)", depth = 50)
+        self.assertEqual(result["value"], "10")
+
+    def test_conses(self):
+        result = self.run_with("(conses 2000 '())", conses = 1000)
+        self.assertEqual(result["error"], "cons limit exceeded")
+        self.assertEqual(result["stats"]["conses"], 1001)
+        # Lists built by list count one pair per element.
+        result = self.run_with("(list 1 2 3 4 5 6 7 8 9 10)", conses = 5)
+        self.assertEqual(result["error"], "cons limit exceeded")
+        result = self.run_with("(length (conses 500 '()))", conses = 1000)
+        self.assertEqual(result["value"], "500")
+
+    def test_constructors_restored(self):
+        pair_init = Pair.__init__
+        store_init = scheme._CompactStore.__init__
+        outer = scheme.Budget()
+        with outer:
+            self.assertIsNot(Pair.__init__, pair_init)
+            try:
+                with scheme.Budget(steps = 10):
+                    with self.interp:
+                        self.interp.eval_source("(forever)",
+                                                budget = thread_state.budget)
+                        raise RuntimeError
+            except RuntimeError:
+                pass
+            # The outer budget still counts pairs.
+            self.assertIsNot(Pair.__init__, pair_init)
+        self.assertIs(Pair.__init__, pair_init)
+        self.assertIs(scheme._CompactStore.__init__, store_init)
+        self.assertIs(thread_state.budget, None)
+
+    def test_command_line(self):
+        command = [sys.executable, scheme.__file__]
+        result = subprocess.run(
+            command + ["--max-steps", "1000", "-c", "(define (f) (f)) (f)"],
+            capture_output = True, text = True, timeout = 60)
+        self.assertEqual(result.returncode, 3)
+        self.assertIn("step limit exceeded", result.stderr)
+        # Without limits, nested evaluations run as deep as without budgets.
+        result = subprocess.run(
+            command + ["-c", "(define (d n) (if (= n 0) 0 (+ 1 (d (- n 1)))))"
+                             " (d 240)"],
+            capture_output = True, text = True, timeout = 60)
+        self.assertEqual((result.returncode, result.stdout), (0, "240\n"))
+
+class PmapTest(unittest.TestCase):
+    """pmap runs within the caller's budget, in a pool that persists."""
+
+    def setUp(self):
+        self.interp = scheme.Interpreter()
+        self.interp.eval_source("""
+            (define (spin x) (spin x))
+            (define (square x) (* x x))""")
+
+    def test_budget(self):
+        budget = scheme.Budget(seconds = 30, steps = 20000)
+        result = self.interp.eval_source("(pmap spin '(1 2))",
+                                         budget = budget)
+        self.assertEqual(result["error"], "step limit exceeded")
+        self.assertGreater(result["stats"]["steps"], 20000)
+        self.assertLess(result["stats"]["time"], 20)
+        budget = scheme.Budget(seconds = 0.5)
+        result = self.interp.eval_source("(pmap spin '(1 2))",
+                                         budget = budget)
+        self.assertEqual(result["error"], "evaluation timed out")
+        self.assertLess(result["stats"]["time"], 20)
+        result = self.interp.eval_source("(pmap square '(1 2 3))")
+        self.assertEqual(result["value"], "(1 4 9)")
+
+    def test_pool_reused(self):
+        self.interp.eval_source("(pmap square '(1 2))")
+        pool = self.interp.pmap_pool
+        self.assertIsNotNone(pool)
+        self.interp.eval_source("(pmap square '(3 4))")
+        self.assertIs(self.interp.pmap_pool, pool)
+
+    def test_bindings_sent(self):
+        self.interp.eval_source("""
+            (define (numbers n acc)
+              (if (= n 0) acc (numbers (- n 1) (cons n acc))))
+            (define unused (numbers 300000 '()))
+            (define offset 10)
+            (define (shift x) (+ x offset))
+            (define (shift-square x) (shift (square x)))""")
+        result = self.interp.eval_source("(pmap shift-square '(1 2 3))")
+        self.assertEqual(result["value"], "(11 14 19)")
+        symbols = { Symbol.string_to_symbol("shift-square") }
+        with self.interp:
+            bindings = scheme.load_values(
+                scheme._global_bindings(symbols, self.interp.env))
+        self.assertEqual(sorted(str(sym) for sym in bindings),
+                         ["offset", "shift", "shift-square", "square"])
+
+    def test_threads(self):
+        results = {}
+        def run(k):
+            interp = scheme.Interpreter()
+            source = "(pmap (lambda (x) (+ x {0})) '(1 2 3))".format(k)
+            results[k] = interp.eval_source(source)["value"]
+        threads = [threading.Thread(target = run, args = (k,))
+                   for k in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, { k: "({0} {1} {2})".format(k + 1, k + 2,
+                                                              k + 3)
+                                    for k in range(4) })
+
+class TaskTest(unittest.TestCase):
+    """Tasks wait on stacks of evaluations, without threads of their own."""
+
+    def setUp(self):
+        self.interp = scheme.Interpreter()
+        self.interp.eval_source("""
+            (define (receivers ch n)
+              (do ((k 0 (+ k 1))
+                   (tasks '() (cons (spawn (lambda () (channel-receive ch)))
+                                    tasks)))
+                  ((= k n) tasks)))""")
+
+    def test_blocked_tasks(self):
+        threads = threading.active_count()
+        self.interp.eval_source("""
+            (define ch (make-channel))
+            (define tasks (receivers ch 3000))
+            (task-join (spawn (lambda () 'waiting)))""")
+        self.assertEqual(threading.active_count(), threads)
+        result = self.interp.eval_source("""
+            (for-each (lambda (task) (channel-send ch 1)) tasks)
+            (apply + (map task-join tasks))""")
+        self.assertEqual(result["value"], "3000")
+
+    def test_blocked_task_collected(self):
+        self.interp.eval_source("""
+            (define task (car (receivers (make-channel) 1)))
+            (task-join (spawn (lambda () 'waiting)))""")
+        ref = weakref.ref(self.interp.env[Symbol.string_to_symbol("task")])
+        self.interp.eval_source("(define task #f)")
+        gc.collect()
+        self.assertIsNone(ref())
+
+    def test_eval_async(self):
+        self.interp.eval_source("(define ch (make-channel))")
+        async def run():
+            receive = asyncio.ensure_future(
+                self.interp.eval_async("(+ 1 (channel-receive ch))"))
+            value = await self.interp.eval_async("(channel-send ch 41) 'sent")
+            return value, await receive
+        value, received = asyncio.run(run())
+        self.assertEqual(str(value), "sent")
+        self.assertEqual(received.num_val, 42)
+
+class FaslTest(unittest.TestCase):
+    """Malformed fasl data is rejected without reading past its end."""
+
+    def assertMalformed(self, data):
+        with self.assertRaises(SchemeError) as caught:
+            scheme_fasl.loads(data)
+        self.assertEqual(str(caught.exception),
+                         "fasl-read: truncated or malformed data")
+
+    def test_counts_beyond_data(self):
+        header = scheme_fasl.MAGIC + bytes([scheme_fasl.VERSION])
+        # A count of about 2**32 pairs, or of symbols, in a few bytes.
+        self.assertMalformed(header + b"\x00\xff\xff\xff\xff\x0f")
+        self.assertMalformed(header + b"\xff\xff\xff\xff\x0f")
+        # Two pairs need at least four bytes.
+        self.assertMalformed(header + b"\x00\x02\x00\x00\x86")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1257,4 +1257,1000 @@ stuff
 ; expect -69745
 
 
+;; -- END TEST -- ;;
+
+;; -- BEGIN TEST -- ;;
+
+;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+;; Memoization ;;
+;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+
+(define-memoized (fib n)
+  (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+
+(fib 80)
+; expect 23416728348467685
+
+(memo-stats fib)
+; expect (78 81 81 10000)
+
+(fib 80)
+; expect 23416728348467685
+
+(car (memo-stats fib))
+; expect 79
+
+(define-memoized (count-paths rows cols)
+  (if (or (= rows 0) (= cols 0))
+      1
+      (+ (count-paths (- rows 1) cols) (count-paths rows (- cols 1)))))
+
+(count-paths 30 30)
+; expect 118264581564861424
+
+(define calls 0)
+(define-memoized (lookup L)
+  (set! calls (+ calls 1))
+  (length L))
+
+(lookup '(a (b c) d))
+; expect 3
+
+(lookup (list 'a (list 'b 'c) 'd))
+; expect 3
+
+calls
+; expect 1
+
+(define small (memoize (lambda (x) (set! calls (+ calls 1)) x) 2 eqv?))
+
+(small 1)
+; expect 1
+
+(small 2)
+; expect 2
+
+(small 3)
+; expect 3
+
+(small 1)
+; expect 1
+
+calls
+; expect 5
+
+(memo-stats small)
+; expect (0 4 2 2)
+
+(memo-clear! small)
+(memo-stats small)
+; expect (0 0 0 2)
+
+(define-memoized square (lambda (x) (* x x)))
+
+(square 12)
+; expect 144
+
+(memoize car 0)
+; expect Error
+
+(memoize car 10 eq?)
+; expect Error
+
+(memo-stats car)
+; expect Error
+
+(define-memoized 3 4)
+; expect Error
+
+(define-memoized (count-down n) (if (= n 0) 'done (count-down (- n 1))))
+(count-down 5000)
+; expect done
+
+(define-memoized (cube x) 2 eqv? (* x x x))
+(cube 2)
+; expect 8
+(cube 3)
+; expect 27
+(cube 4)
+; expect 64
+(cube 4)
+; expect 64
+(memo-stats cube)
+; expect (1 3 2 2)
+
+(define-memoized (len L) eqv? (length L))
+(len '(1 2))
+; expect 2
+(len (list 1 2))
+; expect 2
+(memo-stats len)
+; expect (0 2 2 10000)
+
+(define-memoized (five x) 5)
+(five 1)
+; expect 5
+
+(define-memoized none 0 (lambda (x) x))
+; expect Error
+
+;; -- END TEST -- ;;
+
+;; -- BEGIN TEST -- ;;
+
+;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+;; Constant folding and deoptimization ;;
+;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+
+(define (seconds-per-day) (* 60 60 24))
+(seconds-per-day)
+; expect 86400
+
+(define (pick) (if (< 1 2) 'yes 'no))
+(pick)
+; expect yes
+
+(define (classify) (cond ((= 1 2) 'equal) ((> 1 2) 'greater) (else 'less)))
+(classify)
+; expect less
+
+(define (second) (cadr '(1 2 3)))
+(second)
+; expect 2
+
+(define (bad-car) (car (car '(1 2))))
+(bad-car)
+; expect Error
+
+(define (shadow car) (car '(1 2)))
+(shadow cdr)
+; expect (2)
+
+(define (fresh) (list 'a 'b))
+(set-car! (fresh) 'c)
+(fresh)
+; expect (a b)
+
+(define old* *)
+(define (* . args) 'redefined)
+(seconds-per-day)
+; expect redefined
+
+(define old< <)
+(set! < >)
+(pick)
+; expect no
+
+(define (cdr x) '(mine))
+(second)
+; expect mine
+
+(define (= x y) #t)
+(classify)
+; expect equal
+
+(begin (define (- x y) 'minus) (- 2 1))
+; expect minus
+
+;; -- END TEST -- ;;
+
+;; -- BEGIN TEST -- ;;
+
+;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+;; Inlined primitive calls ;;
+;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+
+(define (sum L)
+  (define (sum-tail L acc)
+    (if (null? L) acc (sum-tail (cdr L) (+ acc (car L)))))
+  (sum-tail L 0))
+(sum '(1 2 3 4 5))
+; expect 15
+
+(define (show-first L) (car L))
+show-first
+; expect <(lambda (l) (car l)), <Global frame at 0x0>>
+
+(show-first 3)
+; expect Error
+
+(define (negate x) (- x))
+(negate 4)
+; expect -4
+
+(define (compare a b) (list (< a b) (= a b) (>= a b) (eq? a a) (not a)))
+(compare 1 2)
+; expect (#t #f #f #t #f)
+
+(compare 'a 2)
+; expect Error
+
+(define old-car car)
+(define (car x) 'new-car)
+(show-first '(1 2))
+; expect new-car
+
+(set! car old-car)
+(show-first '(1 2))
+; expect 1
+
+(define (+ a b) (* a b))
+(sum '(1 2 3))
+; expect 0
+
+;; -- END TEST -- ;;
+
+;; -- BEGIN TEST -- ;;
+
+;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+;; Long argument lists and the reader ;;
+;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+
+(define (iota n)
+  (define (iota-tail k sofar)
+    (if (< k 0) sofar (iota-tail (- k 1) (cons k sofar))))
+  (iota-tail (- n 1) '()))
+
+(define big (iota 20000))
+
+(apply + big)
+; expect 199990000
+
+(define (count . args) (length args))
+(apply count big)
+; expect 20000
+
+(define (count-rest a b . rest) (list a b (length rest)))
+(apply count-rest big)
+; expect (0 1 19998)
+
+(count-rest 1)
+; expect Error
+
+(define (two a b) a)
+(two 1 2 3)
+; expect Error
+
+(length (apply list big))
+; expect 20000
+
+(equal? big (apply list big))
+; expect #t
+
+'(1 . 2)
+; expect (1 . 2)
+
+'(1 2 . (3 4))
+; expect (1 2 3 4)
+
+'(1 . 2 3)
+; expect Error
+
+'(1 . 2 . 3)
+; expect Error
+
+'(a 'b (c . d))
+; expect (a (quote b) (c . d))
+
+''a
+; expect (quote a)
+
+;; -- END TEST -- ;;
+
+;; -- BEGIN TEST -- ;;
+
+;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+;; Simply Scheme words and sentences ;;
+;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+
+(se 'hello '(big world) '() 3 '(a b))
+; expect (hello big world 3 a b)
+
+(sentence)
+; expect ()
+
+(se '(1 . 2))
+; expect Error
+
+(se 1.5)
+; expect Error
+
+(word 'foo 12 'bar)
+; expect foo12bar
+
+(word 1 2 3)
+; expect 123
+
+(word '(a))
+; expect Error
+
+(append '(1 2) '() '(3) 4)
+; expect (1 2 3 . 4)
+
+(append)
+; expect ()
+
+(append '(1 . 2) '(3))
+; expect Error
+
+(define circular (list 1 2 3))
+(set-cdr! (cdr (cdr circular)) circular)
+(append circular '(4))
+; expect Error
+
+(last '(a b c))
+; expect c
+
+(last 'abc)
+; expect c
+
+(last '(a . b))
+; expect Error
+
+(bl '(a b c))
+; expect (a b)
+
+(bl '(a))
+; expect ()
+
+(butlast 1234)
+; expect 123
+
+(bl '(a b . c))
+; expect Error
+
+;; -- END TEST -- ;;
+
+;; -- BEGIN TEST -- ;;
+
+;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+;; Hash-dispatched case ;;
+;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+
+(define (kind x)
+  (case x
+    ((0 2 4 6 8) 'even)
+    ((1 3 5 7 9) 'odd)
+    ((a e i o u) 'vowel)
+    ((#t #f) 'boolean)
+    ((()) 'empty)
+    (else 'other)))
+
+(list (kind 4) (kind 7) (kind 'e) (kind #f) (kind '()) (kind 'z) (kind 12))
+; expect (even odd vowel boolean empty other other)
+
+(kind 4.0)
+; expect even
+
+(kind 4.5)
+; expect other
+
+(case 2
+  ((2.0) 'real)
+  (else 'no))
+; expect no
+
+(case 1
+  ((1) 'first)
+  ((1) 'second))
+; expect first
+
+(define (early x)
+  (case x
+    ((1) 'one)
+    (else)
+    ((2) 'two)))
+
+(early 1)
+; expect one
+
+(early 2)
+; expect Error
+
+(define (misplaced x)
+  (case x
+    ((1) 'one)
+    (else 'other)
+    ((2) 'two)))
+
+(misplaced 1)
+; expect one
+
+(misplaced 2)
+; expect Error
+
+(define (count-vowels L n)
+  (if (null? L)
+      n
+      (count-vowels (cdr L)
+                    (+ n (case (car L) ((a e i o u) 1) (else 0))))))
+(count-vowels '(s c h e m e i s f u n) 0)
+; expect 4
+
+(define form (list 'case 'x '((1) 'one) '((2) 'two)))
+(define x 2)
+(eval form)
+; expect two
+(set-car! (cddr form) '((2) 'changed))
+(eval form)
+; expect changed
+
+(define maker (list 'lambda '(y) (list 'let '((z 1)) '(+ y z))))
+((eval maker) 1)
+; expect 2
+(set-car! (cddr (caddr maker)) '(* y 10 z))
+((eval maker) 1)
+; expect 10
+
+;; -- END TEST -- ;;
+
+;; -- BEGIN TEST -- ;;
+;;;; Compact lists ;;
+
+(define digits '(0 1 2 3 4 5 6 7 8 9))
+(length digits)
+; expect 10
+(list-ref digits 7)
+; expect 7
+(eq? (cdr digits) (cdr digits))
+; expect #t
+(eq? (list-tail digits 4) (cdr (cdr (cdr (cdr digits)))))
+; expect #t
+(equal? digits (list 0 1 2 3 4 5 6 7 8 9))
+; expect #t
+(list? (cddr digits))
+; expect #t
+(apply + digits)
+; expect 45
+(append digits '(10))
+; expect (0 1 2 3 4 5 6 7 8 9 10)
+
+(define squares (list 0 1 4 9 16 25 36 49 64 81))
+(set-car! (list-tail squares 3) 'nine)
+squares
+; expect (0 1 4 nine 16 25 36 49 64 81)
+(list-ref squares 3)
+; expect nine
+
+(define tail (list-tail digits 5))
+(set-cdr! (list-tail digits 2) '(two-and-a-half))
+digits
+; expect (0 1 2 two-and-a-half)
+(length digits)
+; expect 4
+(list-ref digits 3)
+; expect two-and-a-half
+(list-ref digits 4)
+; expect Error
+(length tail)
+; expect 5
+(set-cdr! (list-tail tail 4) tail)
+(list? digits)
+; expect #t
+(list? tail)
+; expect #f
+(list-ref tail 12)
+; expect 7
+
+'(a b c d e f g h . i)
+; expect (a b c d e f g h . i)
+
+;; -- END TEST -- ;;
+
+;; -- BEGIN TEST -- ;;
+;;;; Named let and do ;;
+
+(define (sum-to n)
+  (let loop ((i 0) (acc 0))
+    (if (> i n) acc (loop (+ i 1) (+ acc i)))))
+(sum-to 100)
+; expect 5050
+(sum-to 20000)
+; expect 200010000
+
+(let loop ((i 0) (acc '()))
+  (cond ((= i 6) acc)
+        ((= (remainder i 2) 0) (loop (+ i 1) (cons i acc)))
+        (else (loop (+ i 1) acc))))
+; expect (4 2 0)
+
+(let loop ((i 0) (acc '()))
+  (if (= i 3)
+      acc
+      (let ((sq (* i i)))
+        (loop (+ i 1) (cons sq acc)))))
+; expect (4 1 0)
+
+(let loop ((i 0))
+  (if (< i 3) (+ 1 (loop (+ i 1))) 0))
+; expect 3
+
+(let outer ((i 0) (acc '()))
+  (if (= i 2)
+      acc
+      (let inner ((j 0) (acc acc))
+        (if (= j 2)
+            (outer (+ i 1) acc)
+            (inner (+ j 1) (cons (list i j) acc))))))
+; expect ((1 1) (1 0) (0 1) (0 0))
+
+(define (call-all procs)
+  (if (null? procs) '() (cons ((car procs)) (call-all (cdr procs)))))
+(call-all (let loop ((i 0) (procs '()))
+            (if (= i 3) procs (loop (+ i 1) (cons (lambda () i) procs)))))
+; expect (2 1 0)
+
+(let loop ((i 0) (f #f))
+  (cond ((= i 2) (f 5 f))
+        ((> i 2) i)
+        (else (loop (+ i 1) loop))))
+; expect 5
+
+(let loop ((i 0)) (if (< i 3) (loop) i))
+; expect Error
+(let loop ((i 0) (i 1)) i)
+; expect Error
+(let loop ((i)) i)
+; expect Error
+
+(do ((i 0 (+ i 1))
+     (acc '() (cons i acc)))
+    ((= i 5) acc))
+; expect (4 3 2 1 0)
+
+(do ((i 0 (+ i 1)))
+    ((= i 3) 'a 'done)
+  (display i))
+; expect 012done
+
+(define total 0)
+(do ((lst '(1 2 3 4) (cdr lst)))
+    ((null? lst))
+  (set! total (+ total (car lst))))
+total
+; expect 10
+
+(do ((i 0 (+ i 1)) (s 0)) ((= i 4) s) (set! s (+ s i)))
+; expect 6
+
+(call-all (do ((i 0 (+ i 1))
+               (procs '() (cons (lambda () i) procs)))
+              ((= i 3) procs)))
+; expect (2 1 0)
+
+(do ((i 0 (+ i 1))) (#f 'never) (if (= i 3) (car '())))
+; expect Error
+(do ((i 0 (+ i 1))))
+; expect Error
+
+;; -- END TEST -- ;;
+
+;; -- BEGIN TEST -- ;;
+;;;; Promises and streams ;;
+
+(define count 0)
+(define p (delay (begin (set! count (+ count 1)) (* 6 7))))
+(promise? p)
+; expect #t
+count
+; expect 0
+(force p)
+; expect 42
+(force p)
+; expect 42
+count
+; expect 1
+(force 5)
+; expect 5
+(force (make-promise 'ready))
+; expect ready
+(eq? p (make-promise p))
+; expect #t
+
+(define (countdown n)
+  (if (= n 0) (delay 'liftoff) (delay-force (countdown (- n 1)))))
+(force (countdown 5000))
+; expect liftoff
+
+(define (integers-from n)
+  (cons-stream n (integers-from (+ n 1))))
+(define nat (integers-from 0))
+(stream-car (stream-cdr (stream-cdr nat)))
+; expect 2
+(eq? (stream-cdr nat) (stream-cdr nat))
+; expect #t
+(stream->list nat 5)
+; expect (0 1 2 3 4)
+(stream->list (stream-map * nat nat) 5)
+; expect (0 1 4 9 16)
+(stream->list (stream-filter (lambda (x) (= (remainder x 1000) 0)) nat) 3)
+; expect (0 1000 2000)
+(stream->list (stream-take (stream-map + nat (stream-cdr nat)) 4))
+; expect (1 3 5 7)
+(stream->list (stream-take nat 0))
+; expect ()
+(stream-null? (stream-take the-empty-stream 3))
+; expect #t
+
+(define (stream-ref s n)
+  (if (= n 0) (stream-car s) (stream-ref (stream-cdr s) (- n 1))))
+(stream-ref (integers-from 0) 5000)
+; expect 5000
+
+(define evens (stream-filter (lambda (x) (= (remainder x 2) 0)) nat))
+(stream->list (stream-map (lambda (x) (* x 10)) (stream-take evens 3)))
+; expect (0 20 40)
+
+(define ones (cons-stream 1 ones))
+(stream->list ones 3)
+; expect (1 1 1)
+
+(define (finite n) (if (= n 0) the-empty-stream (cons-stream n (finite (- n 1)))))
+(stream->list (finite 4))
+; expect (4 3 2 1)
+(stream->list (stream-filter (lambda (x) #f) (finite 1000)))
+; expect ()
+
+(stream-cdr '(1 2))
+; expect Error
+(force (delay-force 5))
+; expect Error
+(stream-take nat -1)
+; expect Error
+(delay)
+; expect Error
+
+;; -- END TEST -- ;;
+
+;; -- BEGIN TEST -- ;;
+;;;; Higher-order list operations ;;
+
+(map (lambda (x) (* x x)) '(1 2 3 4))
+; expect (1 4 9 16)
+(map + '(1 2 3) '(10 20 30) '(100 200 300))
+; expect (111 222 333)
+(map cons '(a b c) '(1 2))
+; expect ((a . 1) (b . 2))
+(map car '())
+; expect ()
+
+(define (range n)
+  (do ((i (- n 1) (- i 1)) (acc '() (cons i acc))) ((< i 0) acc)))
+(length (map (lambda (x) (+ x 1)) (range 100000)))
+; expect 100000
+(fold + 0 (range 100001))
+; expect 5000050000
+
+(define total 0)
+(for-each (lambda (x y) (set! total (+ total (* x y)))) '(1 2 3) '(4 5 6))
+total
+; expect 32
+(begin (for-each display '(a b c)) (newline))
+; expect abc
+
+(filter (lambda (x) (= (remainder x 3) 0)) '(1 3 5 6 9 10))
+; expect (3 6 9)
+(filter pair? '(1 (2) () (3 4)))
+; expect ((2) (3 4))
+
+(fold cons '() '(1 2 3))
+; expect (3 2 1)
+(fold cons* '() '(a b c) '(1 2 3))
+; expect Error
+(fold (lambda (x y acc) (+ acc (* x y))) 0 '(1 2 3) '(4 5 6))
+; expect 32
+(fold-right cons '() '(1 2 3))
+; expect (1 2 3)
+(fold-right (lambda (x y acc) (cons (list x y) acc)) '() '(a b) '(1 2))
+; expect ((a 1) (b 2))
+(reduce + 0 '(1 2 3 4 5))
+; expect 15
+(reduce + 0 '())
+; expect 0
+(reduce max 'none '(3 9 2))
+; expect 9
+
+(map car '(1 2))
+; expect Error
+(map (lambda (x) x) '(1 . 2))
+; expect Error
+(map 5 '(1 2))
+; expect Error
+(filter pair? 7)
+; expect Error
+(map cons '(1 2))
+; expect Error
+
+;; -- END TEST -- ;;
+
+;; -- BEGIN TEST -- ;;
+;;;; Numeric operations ;;
+
+(+)
+; expect 0
+(+ 1 2 3)
+; expect 6
+(* 2 3 4)
+; expect 24
+(- 5)
+; expect -5
+(- 10 1 2)
+; expect 7
+(+ 1 'a)
+; expect Error
+(- 'a)
+; expect Error
+(< 1 2 3)
+; expect #t
+(< 1 3 2)
+; expect #f
+(= 2 2 2)
+; expect #t
+(>= 3 3 1)
+; expect #t
+(> 3 2 'a)
+; expect Error
+(<= 1)
+; expect Error
+(apply < '(1 2 3 4 5))
+; expect #t
+(ceiling 2.1)
+; expect 3
+(ceil -2.5)
+; expect -2
+(floor -2.5)
+; expect -3
+(exact->inexact 3)
+; expect 3.0
+(expt 2 10)
+; expect 1024
+(expt 2 -1)
+; expect 0.5
+(expt 0 -1)
+; expect Error
+(expt -8 0.5)
+; expect Error
+(sqrt 16)
+; expect 4
+(sqrt 6.25)
+; expect 2.5
+(sqrt -1)
+; expect Error
+
+;; -- END TEST -- ;;
+
+;; -- BEGIN TEST -- ;;
+;;;; Closures ;;
+
+(define (make-counter)
+  (define n 0)
+  (lambda () (set! n (+ n 1)) n))
+(define counter (make-counter))
+(counter)
+; expect 1
+(counter)
+; expect 2
+((make-counter))
+; expect 1
+
+(define (make-account balance)
+  (define (withdraw amount) (set! balance (- balance amount)) balance)
+  (define (deposit amount) (set! balance (+ balance amount)) balance)
+  (lambda (op amount) (if (eq? op 'withdraw) (withdraw amount) (deposit amount))))
+(define account (make-account 100))
+(account 'withdraw 30)
+; expect 70
+(account 'deposit 5)
+; expect 75
+
+(define (parity n)
+  (define (ev? n) (if (= n 0) 'even (od? (- n 1))))
+  (define (od? n) (if (= n 0) 'odd (ev? (- n 1))))
+  (ev? n))
+(parity 7)
+; expect odd
+
+(define (late-assignment)
+  (define x 1)
+  (define get-x (lambda () x))
+  (set! x 2)
+  (get-x))
+(late-assignment)
+; expect 2
+
+(define shadowed 'global)
+(define (late-definition)
+  (define get (lambda () shadowed))
+  (define shadowed 'local)
+  (get))
+(late-definition)
+; expect local
+
+(define (adders n)
+  (let ((k n) (big (list 1 2 3)))
+    (let* ((j (+ k 1)) (add (lambda (x) (+ x j k))))
+      add)))
+((adders 10) 1)
+; expect 22
+
+(define (make-thunks)
+  (let loop ((i 0) (thunks '()))
+    (if (= i 3) thunks
+        (loop (+ i 1) (cons (lambda () i) thunks)))))
+(map (lambda (thunk) (thunk)) (make-thunks))
+; expect (2 1 0)
+
+(define (nested a)
+  (lambda (b)
+    (lambda (c) (set! a (+ a 1)) (list a b c))))
+(define inner ((nested 1) 2))
+(inner 3)
+; expect (2 2 3)
+(inner 3)
+; expect (3 2 3)
+
+;; -- END TEST -- ;;
+
+;; -- BEGIN TEST -- ;;
+;;;; Frame reuse in tail calls ;;
+
+(define (count-down n acc)
+  (if (= n 0) acc (count-down (- n 1) (cons n acc))))
+(count-down 5 '())
+; expect (1 2 3 4 5)
+(define (fact n) (if (= n 0) 1 (* n (fact (- n 1)))))
+(fact 10)
+; expect 3628800
+(define (rest-sum total . xs)
+  (if (null? xs) total (apply rest-sum (+ total (car xs)) (cdr xs))))
+(rest-sum 0 1 2 3 4)
+; expect 10
+(define (collect n thunks)
+  (if (= n 0)
+      (map (lambda (thunk) (thunk)) thunks)
+      (collect (- n 1) (cons (lambda () n) thunks))))
+(collect 3 '())
+; expect (1 2 3)
+(define (promise-after n p)
+  (if (= n 0) (force p) (promise-after (- n 1) (delay 'done))))
+(promise-after 3 (delay 'start))
+; expect done
+(define (make-stepper step)
+  (define (walk n acc) (if (> n 10) acc (walk (+ n step) (cons n acc))))
+  walk)
+((make-stepper 3) 0 '())
+; expect (9 6 3 0)
+((make-stepper 5) 1 '())
+; expect (6 1)
+
+;; -- END TEST -- ;;
+
+;; -- BEGIN TEST -- ;;
+;;;; Tasks and channels ;;
+
+(define ch (make-channel))
+(define (produce n)
+  (if (> n 0)
+      (begin (channel-send ch n) (produce (- n 1)))
+      (channel-send ch 'done)))
+(define (consume total)
+  (let ((x (channel-receive ch)))
+    (if (eq? x 'done) total (consume (+ total x)))))
+(define producer (spawn (lambda () (produce 100))))
+(define consumer (spawn (lambda () (consume 0))))
+(task-join consumer)
+; expect 5050
+(list (task? consumer) (task? ch) (channel? ch) (channel? consumer))
+; expect (#t #f #t #f)
+(define trace '())
+(define (agent name n)
+  (if (> n 0)
+      (begin (set! trace (cons name trace)) (yield) (agent name (- n 1)))))
+(define a (spawn (lambda () (agent 'a 3))))
+(define b (spawn (lambda () (agent 'b 3))))
+(task-join a)
+(task-join b)
+trace
+; expect (b a b a b a)
+(define bounded (make-channel 1))
+(define sender
+  (spawn (lambda () (channel-send bounded 1) (channel-send bounded 2) 'sent)))
+(channel-receive bounded)
+; expect 1
+(channel-receive bounded)
+; expect 2
+(task-join sender)
+; expect sent
+(define stop #f)
+(define spinner (spawn (lambda () (do ((n 0 (+ n 1))) (stop 'spun)))))
+(define looper
+  (spawn (lambda () (let loop () (if stop 'looped (loop))))))
+(task-join (spawn (lambda () (set! stop #t) 'stopped)))
+; expect stopped
+(list (task-join spinner) (task-join looper))
+; expect (spun looped)
+(define items (make-channel))
+(define mapper
+  (spawn (lambda () (map (lambda (x) (+ x (channel-receive items))) '(1 2 3)))))
+(for-each (lambda (x) (channel-send items x)) '(10 20 30))
+(task-join mapper)
+; expect (11 22 33)
+(define (task-depth n) (if (= n 0) 0 (+ 1 (task-depth (- n 1)))))
+(task-join (spawn (lambda () (task-depth 3000))))
+; expect 3000
+(task-join
+ (spawn (lambda ()
+          (let* ((x 1) (y (+ x 1)))
+            (case y ((1) 'one) ((2) 'two) (else 'many))))))
+; expect two
+(define cond-trace '())
+(define (traced-cond)
+  (cond ((begin (set! cond-trace (cons 'first cond-trace)) #f) 1)
+        (else (set! cond-trace (cons 'else cond-trace)) 2)))
+(list (task-join (spawn traced-cond)) cond-trace)
+; expect (2 (else first))
+(task-join (spawn (lambda () (car '()))))
+; expect Error
+(channel-receive (make-channel))
+; expect Error
+(make-channel 0)
+; expect Error
+
+;; -- END TEST -- ;;
+
+;; -- BEGIN TEST -- ;;
+;;;; Parallel map ;;
+
+(define (square x) (* x x))
+(pmap square '(1 2 3 4 5 6 7 8 9 10))
+; expect (1 4 9 16 25 36 49 64 81 100)
+(define offset 100)
+(pmap (lambda (x) (list x (+ x offset) (> x 1))) '(1 2))
+; expect ((1 101 #f) (2 102 #t))
+(pmap square '())
+; expect ()
+(define adders (pmap (lambda (n) (lambda (x) (+ x n))) '(1 2)))
+((cadr adders) 10)
+; expect 12
+(define counter 0)
+(begin (pfor-each (lambda (x) (set! counter (+ counter x)) (display x))
+                  '(1 2 3))
+       (newline))
+; expect 123
+counter
+; expect 0
+(pmap (lambda (x) (if (= x 3) (car '()) x)) '(1 2 3 4))
+; expect Error
+(pmap square 3)
+; expect Error
+
+;; -- END TEST -- ;;
+
+;; -- BEGIN TEST -- ;;
+;;;; Binary serialization ;;
+
+(define data (list 0 127 128 -5 (expt 2 70) 2.5 'abc 'abc #t #f '()
+                   (list 'nested (list 1 2))))
+(fasl-write data '/tmp/scheme-test-data.fasl)
+(fasl-read '/tmp/scheme-test-data.fasl)
+; expect (0 127 128 -5 1180591620717411303424 2.5 abc abc #t #f () (nested (1 2)))
+(define shared (list 1 2))
+(fasl-write (cons shared shared) '/tmp/scheme-test-shared.fasl)
+(define copy (fasl-read '/tmp/scheme-test-shared.fasl))
+(eq? (car copy) (cdr copy))
+; expect #t
+(define ring (list 1 2 3))
+(set-cdr! (cddr ring) ring)
+(fasl-write ring '/tmp/scheme-test-ring.fasl)
+(define ring-copy (fasl-read '/tmp/scheme-test-ring.fasl))
+(list (car ring-copy) (car (cdddr ring-copy)) (eq? ring-copy (cdddr ring-copy)))
+; expect (1 1 #t)
+(fasl-write 'word '/tmp/scheme-test-word.fasl)
+(eq? (fasl-read '/tmp/scheme-test-word.fasl) 'word)
+; expect #t
+(fasl-write (lambda (x) x) '/tmp/scheme-test-closure.fasl)
+; expect Error
+(fasl-read '/nonexistent/file)
+; expect Error
+
 ;; -- END TEST -- ;;
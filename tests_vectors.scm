@@ -0,0 +1,133 @@
+;;; Test Cases for the numeric vectors of scheme_vectors.py, which need NumPy.
+
+;; To run:
+;;     python3 scheme_test.py tests_vectors.scm
+
+;; -- BEGIN TEST -- ;;
+
+;;;; Construction and access
+
+(define v (f64vector 1 2 3))
+v
+; expect #f64(1.0 2.0 3.0)
+(define w (s64vector 4 5 6))
+w
+; expect #s64(4 5 6)
+(f64vector? v)
+; expect #t
+(f64vector? w)
+; expect #f
+(s64vector? w)
+; expect #t
+(s64vector? '(4 5 6))
+; expect #f
+(make-s64vector 3 7)
+; expect #s64(7 7 7)
+(make-f64vector 2)
+; expect #f64(0.0 0.0)
+(list->s64vector '(1 2))
+; expect #s64(1 2)
+(s64vector->list w)
+; expect (4 5 6)
+(f64vector-length v)
+; expect 3
+(s64vector-ref w 2)
+; expect 6
+(s64vector-set! w 0 40)
+w
+; expect #s64(40 5 6)
+(s64vector-set! w 0 4)
+(equal? w (s64vector 4 5 6))
+; expect #t
+(equal? v (s64vector 1 2 3))
+; expect #f
+
+(s64vector 1 2.5)
+; expect Error
+(s64vector-ref w 3)
+; expect Error
+(f64vector-ref w 0)
+; expect Error
+(make-f64vector -1)
+; expect Error
+(list->f64vector '(1 a))
+; expect Error
+
+;;;; Arithmetic and comparisons
+
+(vector+ v w)
+; expect #f64(5.0 7.0 9.0)
+(vector+ w w 1)
+; expect #s64(9 11 13)
+(vector* 2 w)
+; expect #s64(8 10 12)
+(vector- w)
+; expect #s64(4 5 6)
+(vector- w v)
+; expect #f64(3.0 3.0 3.0)
+(vector/ w 2)
+; expect #f64(2.0 2.5 3.0)
+(vector< v 2)
+; expect #s64(1 0 0)
+(vector>= w (s64vector 4 6 6))
+; expect #s64(1 0 1)
+(vector-sum w)
+; expect 15
+(vector-sum v)
+; expect 6.0
+(vector-dot v w)
+; expect 32.0
+(vector-dot w w)
+; expect 77
+
+(vector/ w (s64vector 1 0 1))
+; expect Error
+(vector+ v (f64vector 1 2))
+; expect Error
+(vector+ v 'a)
+; expect Error
+(vector-dot v (f64vector 1))
+; expect Error
+
+;;;; Slices
+
+(define s (vector-slice w 1))
+s
+; expect #s64(5 6)
+(vector-slice w 1 2)
+; expect #s64(5)
+(s64vector-set! s 0 50)
+w
+; expect #s64(4 50 6)
+(vector-slice w 2 1)
+; expect Error
+(vector-slice w 0 4)
+; expect Error
+
+;;;; Range of elements
+
+(s64vector 9223372036854775807 -9223372036854775808)
+; expect #s64(9223372036854775807 -9223372036854775808)
+(s64vector 99999999999999999999)
+; expect Error
+(make-s64vector 2 99999999999999999999)
+; expect Error
+(s64vector-set! w 0 99999999999999999999)
+; expect Error
+w
+; expect #s64(4 50 6)
+(vector* (s64vector 4611686018427387904) 99999999999999999999)
+; expect Error
+(vector< (s64vector 1) 99999999999999999999)
+; expect #s64(1)
+(f64vector (expt 10 400))
+; expect Error
+(f64vector-ref (f64vector 1 2) 1.0)
+; expect Error
+
+;;;; Reading from files
+
+(read-f64vector '/nonexistent/file)
+; expect Error
+
+;; -- END TEST -- ;;